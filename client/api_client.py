@@ -0,0 +1,147 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from messaging import ActuatorState, SensorMeasurement
+from spool import MeasurementSpool
+import common
+
+"""
+Klient for skytjenesten som alle klientskriptene bruker. Én 'requests.Session' per klient gjenbruker
+TCP forbindelsene (keep-alive) fra en pool, i stedet for en ny forbindelse per forespørsel.
+Alle forespørsler har timeout, så en treg server aldri henger en tråd (eller GUI) for alltid, og
+forbindelsesfeil og 502/503/504 prøves på nytt med eksponentiell backoff.
+Målinger legges i en varig kø på disk (se spool.py) og sendes mange om gangen til 'POST sensor/{id}/values'.
+Serveren lagrer målinger idempotent (samme tidsstempel lagres bare én gang), så også POST kan trygt prøves på nytt.
+"""
+
+#Metodene som prøves på nytt ved feil. POST er med fordi serveren ignorerer målinger den allerede har lagret
+_RETRY_METHODS = frozenset({"GET", "PUT", "POST", "DELETE"})
+
+
+class SmartHouseClient:
+
+    def __init__(self, base_url=common.BASE_URL, timeout=common.HTTP_TIMEOUT, retries=common.HTTP_RETRIES,
+                 backoff_factor=common.HTTP_BACKOFF_FACTOR, pool_size=common.HTTP_POOL_SIZE,
+                 batch_size=common.MEASUREMENT_BATCH_SIZE, max_pending=common.MEASUREMENT_MAX_PENDING,
+                 spool_file=common.MEASUREMENT_SPOOL_FILE):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(502, 503, 504),
+                      allowed_methods=_RETRY_METHODS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        #Målinger som venter på å bli sendt, per sensor. Blir det for mange (serveren er nede) kastes de eldste
+        self.spool = MeasurementSpool(spool_file, max_pending)
+
+    def request(self, method, path, **kwargs):
+        """
+        Sender en forespørsel til 'base_url' + 'path' med sesjonen og timeout
+        Raises:
+            requests.RequestException: ved nettverksfeil, timeout eller statuskode 4xx/5xx
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.request(method, self.base_url + path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def get_sensor_current(self, did):
+        response = self.request("GET", f"sensor/{did}/current")
+        return SensorMeasurement.from_json(response.text)
+
+    def post_measurement(self, did, measurement):
+        self.request("POST", f"sensor/{did}/current", data=measurement.to_json(),
+                     headers={'Content-Type': 'application/json'})
+
+    def get_actuator_state(self, did):
+        response = self.request("GET", f"actuator/{did}/current")
+        return ActuatorState.from_json(response.text)
+
+    def wait_actuator_state(self, did, version=None, wait=common.ACTUATOR_LONG_POLL_WAIT):
+        """
+        Venter (long-polling) til tilstanden til aktuatoren har en annen versjon enn 'version', eller i maks
+        'wait' sekunder. Uten 'version' hentes tilstanden med en gang
+        Returns:
+            tuple: (ActuatorState, versjon), eller (None, versjon) hvis tilstanden er uendret (304)
+        """
+        params, headers = {}, {}
+        if version is not None:
+            params = {"wait": wait, "since": version}
+            headers = {"If-None-Match": f'"{version}"'}
+        connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+        response = self.request("GET", f"actuator/{did}/current", params=params, headers=headers,
+                                timeout=(connect, read + wait))
+        version = int(response.headers.get("ETag", '"0"').strip('"'))
+        if response.status_code == 304:
+            return None, version
+        return ActuatorState.from_json(response.text), version
+
+    def set_actuator_state(self, did, state):
+        self.request("PUT", f"actuator/{did}/", data=ActuatorState(state).to_json(),
+                     headers={'Content-Type': 'application/json'})
+
+    def add_measurement(self, did, measurement):
+        """
+        Legger en måling i køen til sensoren, uten å vente på nettverket. Målingene sendes med 'flush'
+        """
+        self.spool.append(did, measurement.__dict__.copy())
+
+    def pending(self, did):
+        return self.spool.count(did)
+
+    def flush(self, did=None):
+        """
+        Sender ventende målinger (for én sensor, eller alle) i bunker på 'batch_size', til køen er tom
+        eller serveren ikke svarer. Målinger som ikke kom fram blir liggende i køen til neste gang
+        Returns:
+            int: Antall målinger som ble sendt
+        """
+        sent = 0
+        for sensor in [did] if did is not None else self.spool.sensors():
+            while True:
+                batch = self.spool.peek(sensor, self.batch_size)
+                if not batch:
+                    break
+                try:
+                    self.request("POST", f"sensor/{sensor}/values", json=[m for _, m in batch])
+                except requests.HTTPError as e:
+                    #Serveren avviser bunken (f.eks. ukjent sensor eller ugyldig måling), den blir aldri tatt imot
+                    if 400 <= e.response.status_code < 500 and e.response.status_code not in (408, 429):
+                        logging.error(f"Sensor {sensor}: {len(batch)} measurements rejected, dropping them ({e})")
+                        self.spool.remove([id for id, _ in batch])
+                        continue
+                    logging.warning(f"Sensor {sensor}: could not send {len(batch)} measurements ({e})")
+                    break
+                except requests.RequestException as e:
+                    logging.warning(f"Sensor {sensor}: could not send {len(batch)} measurements ({e})")
+                    break
+                #Fjernes først når serveren har tatt imot dem
+                self.spool.remove([id for id, _ in batch])
+                sent += len(batch)
+        return sent
+
+    def close(self):
+        self.session.close()
+        self.spool.close()
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """
+    Returnerer klienten som deles av alle delene av et program (dashboard, simulatorer), så de bruker samme pool
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = SmartHouseClient()
+        return _default_client
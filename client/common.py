@@ -1,3 +1,5 @@
+from pathlib import Path
+
 LIGHTBULB_DID = "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"
 TEMPERATURE_SENSOR_DID = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
 
@@ -13,3 +15,24 @@ TEMPERATURE_SENSOR_CLIENT_SLEEP_TIME = 4
 TEMP_RANGE = 40
 
 
+# HTTP client (see api_client.py): timeouts in seconds (connect, read), retries with exponential backoff
+# for connection errors and 502/503/504
+HTTP_TIMEOUT = (3.05, 10)
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_SIZE = 10
+# seconds the server holds a request for the actuator state open, waiting for a change (long-polling)
+ACTUATOR_LONG_POLL_WAIT = 30
+
+# Measurements that have not reached the cloud service are kept in a local SQLite file (see spool.py),
+# at most MEASUREMENT_MAX_PENDING per sensor (the oldest are dropped), and sent MEASUREMENT_BATCH_SIZE at a time
+MEASUREMENT_BATCH_SIZE = 50
+MEASUREMENT_MAX_PENDING = 10000
+MEASUREMENT_SPOOL_FILE = str(Path(__file__).parent / "measurements.spool")
+
+# Dashboard (see dashboard_worker.py): background threads for requests, how often (ms) results are moved to
+# the GUI and at most how many per round, and how often (ms) values are refreshed automatically
+DASHBOARD_WORKERS = 8
+DASHBOARD_POLL_INTERVAL = 50
+DASHBOARD_MAX_CALLBACKS = 200
+DASHBOARD_REFRESH_INTERVAL = 5000
@@ -5,6 +5,8 @@ import logging
 #importerer funksj9on for lyspære og temp sensor som vi har definert i dashboard_
 from dashboard_lightbulb import init_lightbulb
 from dashboard_temperaturesensor import init_temperature_sensor
+#Bakgrunnstrådene som utfører nettverkskallene for GUI
+from dashboard_worker import DashboardWorker
 
 #Importerer common modul
 import common
@@ -20,10 +22,22 @@ root.geometry('450x300')
 #Setter tittelen på hovedvinduet
 root.title('ING301 SmartHouse Dashboard')
 
+#Oppretter bakgrunnstrådene som alle enhetene i dashboardet deler, så GUI ikke fryser mens de venter på nettverket
+worker = DashboardWorker(root)
+
 #Kaller funksjonen for å initialisere lyspæren i GUI, med referanse til hovedvinduet og enhetens ID fra common modul
-init_lightbulb(root, common.LIGHTBULB_DID)
+init_lightbulb(root, common.LIGHTBULB_DID, worker)
 #Samme for temp sensor
-init_temperature_sensor(root, common.TEMPERATURE_SENSOR_DID)
+init_temperature_sensor(root, common.TEMPERATURE_SENSOR_DID, worker)
+
+
+#Stopper bakgrunnstrådene når vinduet lukkes
+def close():
+    worker.close()
+    root.destroy()
+
+
+root.protocol("WM_DELETE_WINDOW", close)
 
 #Starter tkinter sin hovedløkke som holder GUI vinduet åpent og lytter etter bruker interaksjon.
 root.mainloop()
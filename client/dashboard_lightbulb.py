@@ -2,14 +2,12 @@
 import tkinter as tk
 from tkinter import ttk
 import logging
-import requests
 
-#Importerer klasse med Aktuator status og common modul
-from messaging import ActuatorState
-import common
+#Importerer klienten for skytjenesten
+from api_client import default_client
 
 #Funksjon som håndterer endring av tilstand på lyspære
-def lightbulb_cmd(state, did):
+def lightbulb_cmd(state, did, worker):
     #Henter den valgte tilstanden fra radioknappene i GUI
     new_state = state.get()
     #Logger denne tilstanden
@@ -23,21 +21,14 @@ def lightbulb_cmd(state, did):
     else:
         new_state = "off"
 
-    #Oppretter en instans av ActuatorState med den nye tilstanden
-    actuator_state = ActuatorState(new_state)
-    #Konverterer aktuatortilstanden til JSON format for å sende over HTTP
-    payload = actuator_state.to_json()
-    #Setter headere for forespørselen, spesifikt innholds typen altså JSON
-    headers = {'Content-Type': 'application/json'}
-    #Bygger URLen for PUT forespørselen ved å hente enhetens ID fra common og legge til basen URL
-    url = common.BASE_URL + f"actuator/{did}/"
-    #Sender PUT forespørsel til server med den nye tilstanden
-    response = requests.request("PUT", url, headers=headers, data=payload)
+    #Sender den nye tilstanden til skytjenesten i en bakgrunnstråd, så GUI ikke venter på nettverket.
+    #Raske klikk slås sammen, og bare den siste tilstanden sendes etter den som allerede er på vei
+    worker.submit(("actuator", did), lambda: default_client().set_actuator_state(did, new_state))
 
     # TODO: END
 
 #
-def init_lightbulb(container, did):
+def init_lightbulb(container, did, worker):
     #Oppretter en etikkeramme (Labelframe) for lyspæren
     lb_lf = ttk.LabelFrame(container, text=f'LightBulb [{did}]')
     #Plasserer den i i hovedvindu
@@ -48,12 +39,12 @@ def init_lightbulb(container, did):
     #Radio knapp for å skru lyspæren på
     on_radio = ttk.Radiobutton(lb_lf, text='On', value='On',
                                variable=lightbulb_state_var,
-                               command=lambda: lightbulb_cmd(lightbulb_state_var, did))
+                               command=lambda: lightbulb_cmd(lightbulb_state_var, did, worker))
     #Plasserer radioknapp i etikettrammen
     on_radio.grid(column=0, row=0, ipadx=10, ipady=10)
     #Oppretter radioknapp for å skru lyspæren av
     off_radio = ttk.Radiobutton(lb_lf, text='Off', value='Off',
                                 variable=lightbulb_state_var,
-                                command=lambda: lightbulb_cmd(lightbulb_state_var, did))
+                                command=lambda: lightbulb_cmd(lightbulb_state_var, did, worker))
     #PLasserer radioknapp for av ved siden av på
     off_radio.grid(column=1, row=0, ipadx=10, ipady=10)
@@ -2,33 +2,26 @@ import tkinter as tk
 from tkinter import ttk
 
 import logging
-import requests
 
-from messaging import SensorMeasurement
+from api_client import default_client
 import common
 
 #Definerer funksjon som kalles når bruker klikker på 'refresh' i GUI
-def refresh_btn_cmd(temp_widget, did):
+def refresh_btn_cmd(temp_widget, did, worker):
     #Logger at temperaturendring er initiert
     logging.info("Temperature refresh")
 
     # TODO START
     # send request to cloud service to obtain current temperature
-    #Bygger URL for API forespørsel basert på sensor ID og URL fra common modul
-    url = common.BASE_URL + f"sensor/{did}/current"
-    #Forbereder payload og headers for GET forespørsel
-    payload = {}
-    headers = {}
-    #Utfører GET forespørselen for å hente nåværende temp
-    response = requests.request("GET", url, headers=headers, data=payload)
-    #Parser svaret fra server og oppretter en SensorMeasurement fra JSON-dataen
-    sensor_measurement = SensorMeasurement.from_json(response.text)
-
-    # replace statement below with measurement from response
-    # sensor_measurement = SensorMeasurement(init_value="-273.15")
+    #Henter nåværende temperatur i en bakgrunnstråd, og viser den i GUI tråden når svaret kommer.
+    #Klikk mens en henting pågår slås sammen med den automatiske oppdateringen
+    worker.submit(("sensor", did), lambda: default_client().get_sensor_current(did),
+                  lambda sensor_measurement: show_temperature(temp_widget, sensor_measurement))
 
     # TODO END
 
+
+def show_temperature(temp_widget, sensor_measurement):
     #Oppdaterer tekstfeltet i brukergrensesnittet for å vise den mottate temperaturen
     temp_widget['state'] = 'normal' # setter tekstfeltet til normal for å tillate endringer
     temp_widget.delete(1.0, 'end') #Sletter den eksiterende testsen i tekstfeltet
@@ -36,7 +29,7 @@ def refresh_btn_cmd(temp_widget, did):
     temp_widget['state'] = 'disabled' #Setter tekstfeltet tilbake til deaktivert modus for å forhindre brukerendringer
 
 
-def init_temperature_sensor(container, did):
+def init_temperature_sensor(container, did, worker):
 
     ts_lf = ttk.LabelFrame(container, text=f'Temperature sensor [{did}]')
 
@@ -49,6 +42,10 @@ def init_temperature_sensor(container, did):
     temp.grid(column=0, row=0, padx=20, pady=20)
 
     refresh_button = ttk.Button(ts_lf, text='Refresh',
-                                command=lambda: refresh_btn_cmd(temp, did))
+                                command=lambda: refresh_btn_cmd(temp, did, worker))
 
     refresh_button.grid(column=1, row=0, padx=20, pady=20)
+
+    #Oppdaterer temperaturen automatisk, med samme nøkkel som knappen
+    worker.every(("sensor", did), common.DASHBOARD_REFRESH_INTERVAL, lambda: default_client().get_sensor_current(did),
+                 lambda sensor_measurement: show_temperature(temp, sensor_measurement))
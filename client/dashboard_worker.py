@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import common
+
+"""
+Kjører nettverkskall fra dashboardet i bakgrunnstråder, så GUI aldri fryser mens en forespørsel venter på svar.
+Tkinter er ikke trådsikkert: trådene rører aldri widgets, de legger resultatet i en kø som GUI tråden
+henter fra med 'root.after'. Alle jobber har en nøkkel (f.eks. ("actuator", did)). Mens en jobb for en nøkkel
+kjører, erstatter nye jobber for samme nøkkel hverandre, så ti raske klikk blir én forespørsel som kjører nå
+og én med den siste verdien etterpå. En fast pool av tråder og sammenslåing per nøkkel gjør at hundrevis av
+enheter med automatisk oppdatering ikke gir flere samtidige forespørsler enn poolen, og ingen kø som vokser
+når serveren er treg.
+"""
+
+
+class DashboardWorker:
+
+    def __init__(self, root, workers=common.DASHBOARD_WORKERS, poll_interval=common.DASHBOARD_POLL_INTERVAL,
+                 max_callbacks=common.DASHBOARD_MAX_CALLBACKS):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.max_callbacks = max_callbacks #Maks antall resultater som vises per runde, så GUI aldri stopper opp
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dashboard")
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = set() #Nøkler med en jobb i poolen
+        self._next = {} #Siste jobb som venter per nøkkel
+        self._closed = False
+        self.root.after(self.poll_interval, self._poll)
+
+    def submit(self, key, call, on_done=None):
+        """
+        Kjører 'call' i en bakgrunnstråd, og 'on_done(resultat)' i GUI tråden når den er ferdig.
+        Kjører det allerede en jobb med samme nøkkel, erstatter denne jobben den som ventet fra før
+        """
+        with self._lock:
+            if self._closed:
+                return
+            if key in self._running:
+                self._next[key] = (call, on_done)
+                return
+            self._running.add(key)
+        self._executor.submit(self._run, key, call, on_done)
+
+    def every(self, key, interval, call, on_done=None):
+        """
+        Kjører 'call' nå og deretter hvert 'interval' millisekund. Er forrige runde ikke ferdig slås de sammen
+        """
+        if self._closed:
+            return
+        self.submit(key, call, on_done)
+        self.root.after(interval, self.every, key, interval, call, on_done)
+
+    def _run(self, key, call, on_done):
+        while True:
+            try:
+                result = call()
+            except requests.RequestException as e:
+                logging.warning(f"Dashboard {key}: request failed ({e})")
+            except Exception:
+                logging.exception(f"Dashboard {key}: request failed")
+            else:
+                if on_done is not None:
+                    self._results.put((on_done, result))
+            #Kjører jobben som kom mens denne kjørte, eller slipper nøkkelen
+            with self._lock:
+                if self._closed or key not in self._next:
+                    self._running.discard(key)
+                    return
+                call, on_done = self._next.pop(key)
+
+    def _poll(self):
+        for _ in range(self.max_callbacks):
+            try:
+                on_done, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                on_done(result)
+            except Exception:
+                logging.exception("Dashboard: could not show result")
+        if not self._closed:
+            self.root.after(self.poll_interval, self._poll)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._next.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -3,6 +3,7 @@ import threading
 import time
 import requests
 
+from api_client import default_client
 from messaging import ActuatorState
 import common
 
@@ -12,6 +13,7 @@ class Actuator:
     def __init__(self, did):
         self.did = did
         self.state = ActuatorState('False')
+        self.api = default_client()
 
     def simulator(self):
         logging.info(f"Actuator {self.did} starting")
@@ -25,20 +27,21 @@ class Actuator:
         logging.info(f"Actuator Client {self.did} starting")
 
         # TODO START
-        #Bygger URLen for å sende forespørsel til skytjeneste og hente den nyeste tilstanden til akutatoren
-        url = common.BASE_URL + f"actuator/{self.did}/current"
-        #Initialiserer Payload og headers for HTTP forespørselen
-        payload = {}
-        headers = {}
+        #Versjonen til tilstanden vi har, None til den er hentet første gang
+        version = None
         #En undelig løkke som kontinuerlig oppdaterer tilstanden til aktuatoren basert på data fra skytjenesten
         while True:
-            #Sender en GET forespørsel til skytjenesten og henter responsen
-            response = requests.request("GET", url, headers=headers, data=payload)
-            #Oppdaterer tilstanden til aktatoren basert på responsen
-            self.state = ActuatorState.from_json(response.text)
-            logging.info(f"Actuator Client {self.did} {self.state.state}")
-            #Venter på et forhåndsdefinert tidsintervall før neste oppdatering
-            time.sleep(common.LIGHTBULB_CLIENT_SLEEP_TIME)
+            #Venter på en ny tilstand fra skytjenesten (long-polling). Serveren svarer med en gang tilstanden
+            #endres, og med 304 uten innhold hvis den er uendret etter ventetiden
+            try:
+                state, version = self.api.wait_actuator_state(self.did, version)
+                if state is not None:
+                    self.state = state
+                    logging.info(f"Actuator Client {self.did} {self.state.state}")
+            except requests.RequestException as e:
+                logging.warning(f"Actuator Client {self.did}: could not get state ({e})")
+                #Venter på et forhåndsdefinert tidsintervall før neste forsøk
+                time.sleep(common.LIGHTBULB_CLIENT_SLEEP_TIME)
 
         logging.info(f"Client {self.did} finishing")
 
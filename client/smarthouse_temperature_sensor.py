@@ -2,8 +2,8 @@ import logging
 import threading
 import time
 import math
-import requests
 
+from api_client import default_client
 from messaging import SensorMeasurement
 import common
 
@@ -14,6 +14,7 @@ class Sensor:
         #Konstruktør som initialiserer sensoren med en enehts ID setter målingen til 0.0
         self.did = did
         self.measurement = SensorMeasurement('0.0')
+        self.api = default_client()
 
     def simulator(self):
         logging.info(f"Sensor {self.did} starting")
@@ -24,6 +25,8 @@ class Sensor:
             logging.info(f"Sensor {self.did}: {temp}")
             #Oppdaterer sensoren med den nye temperaturen
             self.measurement.set_temperature(str(temp))
+            #Legger målingen i køen som klienten sender til skytjenesten
+            self.api.add_measurement(self.did, self.measurement)
             #Pauser simulatoren i en definert tidsperiode fra common modulen, før den generer neste måling
             time.sleep(common.TEMPERATURE_SENSOR_SIMULATOR_SLEEP_TIME)
 
@@ -38,20 +41,13 @@ class Sensor:
         logging.info(f"Sensor Client {self.did} starting")
 
         # TODO START
-        #Uendelig løkke som kontinuerlig sender den nyeste temperaturmålingen til skytjenesten
+        #Uendelig løkke som sender målingene fra simulatoren til skytjenesten, samlet i bunker
         while True:
             logging.info(f"Sensor Client {self.did} {self.measurement.get_temperature()}")
-            #Bygger URLen for å sende målinger til skytjenesten basert på enhetens device id
-            url = common.BASE_URL + f"sensor/{self.did}/current"
-            #Serialiserer målingene til JSON for sending, dette inkluderer temperaturverdien.
-            payload = self.measurement.to_json();
-
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            #Sender en POST forespørsel med målingen til skytjenesten
-            response = requests.request("POST", url, headers=headers, data=payload)
-            #Venter et forhåndsdefinert tidsintervall (definert i common) før neste måling sendes
+            #Sender alle målinger som har kommet siden sist i én forespørsel per bunke.
+            #Kommer de ikke fram blir de liggende i køen til neste runde
+            self.api.flush(self.did)
+            #Venter et forhåndsdefinert tidsintervall (definert i common) før neste bunke sendes
             time.sleep(common.TEMPERATURE_SENSOR_CLIENT_SLEEP_TIME)
 
         logging.info(f"Client {self.did} finishing")
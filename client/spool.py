@@ -0,0 +1,81 @@
+import json
+import logging
+import sqlite3
+import threading
+
+"""
+Varig kø (spool) for målinger som ikke er sendt til skytjenesten ennå, lagret i en lokal SQLite fil.
+Simulatoren legger hver måling i køen og går videre uten å vente på nettverket, og klienten sender dem i
+bunker når serveren svarer. Er serveren nede, blir målingene liggende, også om programmet stoppes, og
+sendes mange om gangen når forbindelsen er tilbake. En måling slettes først når serveren har tatt imot den.
+Dør programmet mellom sending og sletting sendes den på nytt, som serveren ignorerer (lagrer idempotent).
+Køen har et tak per sensor, så en server som er nede lenge ikke fyller disken: da slettes de eldste målingene.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY AUTOINCREMENT, sensor TEXT NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS pending_sensor ON pending (sensor, id);
+"""
+
+
+class MeasurementSpool:
+
+    def __init__(self, file, max_pending):
+        """
+        Args:
+            file(str): Filen køen lagres i, ':memory:' gir en kø som ikke overlever at programmet stopper
+            max_pending(int): Maks antall målinger i køen per sensor
+        """
+        self.file = file
+        self.max_pending = max_pending
+        self.dropped = 0 #Antall målinger som er kastet fordi køen var full
+        #Simulatoren og klienten går i hver sin tråd, og deler tilkoblingen
+        self._conn = sqlite3.connect(file, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def append(self, sensor, measurement):
+        """
+        Legger en måling (dict) i køen. Er køen til sensoren full, slettes den eldste målingen
+        """
+        with self._lock, self._conn:
+            count = self._count(sensor)
+            if count >= self.max_pending:
+                overflow = count - self.max_pending + 1
+                self._conn.execute("DELETE FROM pending WHERE id IN "
+                                   "(SELECT id FROM pending WHERE sensor = ? ORDER BY id LIMIT ?)", (sensor, overflow))
+                if not self.dropped:
+                    logging.warning(f"Sensor {sensor}: {self.max_pending} measurements pending, dropping the oldest")
+                self.dropped += overflow
+            self._conn.execute("INSERT INTO pending (sensor, data) VALUES (?, ?)", (sensor, json.dumps(measurement)))
+
+    def peek(self, sensor, n):
+        """
+        Returnerer de 'n' eldste målingene til sensoren som (id, måling), uten å fjerne dem fra køen
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM pending WHERE sensor = ? ORDER BY id LIMIT ?",
+                                      (sensor, n)).fetchall()
+        return [(id, json.loads(data)) for id, data in rows]
+
+    def remove(self, ids):
+        """
+        Fjerner målingene med 'ids' fra køen, f.eks. når serveren har tatt imot dem
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM pending WHERE id = ?", [(id,) for id in ids])
+
+    def sensors(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT sensor FROM pending")]
+
+    def count(self, sensor):
+        with self._lock:
+            return self._count(sensor)
+
+    def _count(self, sensor):
+        return self._conn.execute("SELECT COUNT(*) FROM pending WHERE sensor = ?", (sensor,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+"""
+Aggregater (antall, gjennomsnitt, min og maks) for en enhet (°C, %, kWh ...) over et tidsrom, per rom, etasje
+eller for hele huset. Databasen grupperer per rom i én spørring, og etasje og hus regnes ut fra radene per rom,
+slik at alle nivåene kan besvares fra samme resultat. Resultatene caches per (enhet, tidsrom) og fjernes
+fra cachen når det kommer en ny måling med samme enhet innenfor tidsrommet. Analysene per rom og døgn caches
+på samme måte per (rom, analyse, tidsrom), og fjernes når det kommer en måling fra rommet innenfor tidsrommet.
+"""
+
+SCOPES = ("room", "floor", "house")
+
+#Maks antall (enhet, tidsrom) som holdes i cachen
+DEFAULT_CACHE_SIZE = 256
+
+
+class Aggregate:
+    """
+    Aggregat for én gruppe, kan slås sammen med andre aggregater
+    """
+    __slots__ = ("scope", "id", "count", "total", "min", "max")
+
+    def __init__(self, scope: str, id: Optional[int], count: int, total: float, low: float, high: float) -> None:
+        self.scope = scope
+        self.id = id
+        self.count = count
+        self.total = total
+        self.min = low
+        self.max = high
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count
+
+    def merge(self, other: "Aggregate") -> None:
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+def group_aggregates(rooms: list[tuple], scope: str) -> list[Aggregate]:
+    """
+    Slår sammen rader per rom til aggregater for ønsket nivå
+    Args:
+        rooms(list[tuple]): Rader på formen (rom id, etasje, antall, sum, min, maks)
+        scope(str): 'room', 'floor' eller 'house'
+    Returns:
+        list[Aggregate]: Ett aggregat per rom/etasje, eller ett for huset, sortert etter id
+    """
+    if scope not in SCOPES:
+        raise ValueError(f"unknown scope: {scope}")
+    groups: dict[Optional[int], Aggregate] = {}
+    for room, floor, count, total, low, high in rooms:
+        key = room if scope == "room" else floor if scope == "floor" else None
+        aggregate = Aggregate(scope, key, count, total, low, high)
+        if key in groups:
+            groups[key].merge(aggregate)
+        else:
+            groups[key] = aggregate
+    return [groups[k] for k in sorted(groups, key=lambda k: -1 if k is None else k)]
+
+
+class AggregateCache:
+    """
+    LRU cache med rader per rom for (enhet, fra, til), der tidsrommet er [fra, til) og None betyr åpent
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, list[tuple]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[list[tuple]]:
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return rows
+
+    def put(self, key: tuple, rows: list[tuple]) -> None:
+        with self._lock:
+            self._entries[key] = rows
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, unit: Optional[str], ts: str) -> None:
+        """
+        Fjerner resultatene en måling med enheten 'unit' og tidspunkt 'ts' ville endret.
+        'ts' må være i formatet i databasen ('YYYY-MM-DD HH:MM:SS'), som grensene i nøklene
+        """
+        with self._lock:
+            stale = [k for k in self._entries
+                     if k[0] == unit and (k[1] is None or k[1] <= ts) and (k[2] is None or ts < k[2])]
+            for k in stale:
+                del self._entries[k]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RoomAnalyticsCache(AggregateCache):
+    """
+    LRU cache med resultatene av analysene for ett rom (f.eks. gjennomsnittstemperatur per døgn), for
+    (rom id, analyse, fra, til) der tidsrommet er [fra, til] (begge inkludert) og None betyr åpent.
+    Resultater for avsluttede døgn blir liggende til cachen er full, eller det kommer en måling for sent
+    """
+
+    def invalidate(self, room: int, ts: str) -> None:
+        """
+        Fjerner resultatene en måling fra rommet 'room' med tidspunkt 'ts' ville endret
+        """
+        with self._lock:
+            stale = [k for k in self._entries
+                     if k[0] == room and (k[2] is None or k[2] <= ts) and (k[3] is None or ts <= k[3])]
+            for k in stale:
+                del self._entries[k]
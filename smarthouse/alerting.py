@@ -0,0 +1,159 @@
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+"""
+Varsling over strømmen av målinger. For hver sensor holdes løpende statistikk med konstant minnebruk
+(gjennomsnitt og varians med Welford sin algoritme, og eksponentielt glidende gjennomsnitt og varians),
+slik at hver ny måling kan sjekkes uten å lese historikken på nytt. Tre typer varsler:
+- 'outlier': målingen er mer enn 'z_threshold' glidende standardavvik fra det glidende gjennomsnittet.
+  Det glidende gjennomsnittet følger langsomme endringer (f.eks. temperatur over døgnet), slik at bare
+  brå hopp varsles, mens gjennomsnittet over hele historikken ville varslet hver måling etter en drift
+- 'stuck': sensoren har rapportert nøyaktig samme verdi 'stuck_after' ganger på rad
+- 'heartbeat': sensoren har ikke rapportert på 'heartbeat_timeout' sekunder
+"""
+
+#Standardverdier for 'AlertMonitor'
+DEFAULT_Z_THRESHOLD = 4.0
+DEFAULT_MIN_SAMPLES = 30
+DEFAULT_EWMA_ALPHA = 0.1
+DEFAULT_STUCK_AFTER = 20
+DEFAULT_HEARTBEAT_TIMEOUT = 3600.0
+
+
+class SensorStats:
+    """
+    Løpende statistikk for én sensor
+    """
+    __slots__ = ("count", "mean", "m2", "ewma", "ewvar", "last_value", "repeats", "last_seen")
+
+    def __init__(self, last_seen: float) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 #Summen av kvadrerte avvik fra gjennomsnittet (Welford)
+        self.ewma: Optional[float] = None
+        self.ewvar = 0.0 #Eksponentielt glidende varians rundt 'ewma'
+        self.last_value: Optional[float] = None
+        self.repeats = 0 #Antall ganger på rad den siste verdien er rapportert
+        self.last_seen = last_seen
+
+    def update(self, value: float, alpha: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            diff = value - self.ewma
+            self.ewma += alpha * diff
+            self.ewvar = (1 - alpha) * (self.ewvar + alpha * diff * diff)
+        self.repeats = self.repeats + 1 if value == self.last_value else 1
+        self.last_value = value
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    @property
+    def ewstd(self) -> float:
+        return math.sqrt(self.ewvar)
+
+
+class Alert:
+    """
+    Et aktivt varsel for en sensor
+    """
+    __slots__ = ("sensor", "kind", "since", "value", "message")
+
+    def __init__(self, sensor: str, kind: str, since: float, value: Optional[float], message: str) -> None:
+        self.sensor = sensor
+        self.kind = kind
+        self.since = since
+        self.value = value
+        self.message = message
+
+    @property
+    def since_iso(self) -> str:
+        return datetime.fromtimestamp(self.since).isoformat(timespec="seconds")
+
+
+class AlertMonitor:
+    """
+    Holder statistikk og aktive varsler for alle sensorene i et hus.
+    'observe' er O(1) per måling, mens manglende heartbeat sjekkes når varslene hentes.
+    """
+
+    def __init__(self, sensors: list[str] = (), z_threshold: float = DEFAULT_Z_THRESHOLD,
+                 min_samples: int = DEFAULT_MIN_SAMPLES, ewma_alpha: float = DEFAULT_EWMA_ALPHA,
+                 stuck_after: int = DEFAULT_STUCK_AFTER,
+                 heartbeat_timeout: Optional[float] = DEFAULT_HEARTBEAT_TIMEOUT) -> None:
+        """
+        Args:
+            sensors(list[str]): Sensorer som skal overvåkes fra start, også for heartbeat før første måling
+            z_threshold(float): Antall glidende standardavvik fra det glidende gjennomsnittet før en måling
+                                regnes som avvikende
+            min_samples(int): Antall målinger før avvik sjekkes, så statistikken rekker å stabilisere seg
+            ewma_alpha(float): Vekten til den nyeste målingen i det glidende gjennomsnittet
+            stuck_after(int): Antall like målinger på rad før sensoren regnes som 'hengt'
+            heartbeat_timeout(Optional[float]): Sekunder uten måling før det varsles, None skrur av sjekken
+        """
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.ewma_alpha = ewma_alpha
+        self.stuck_after = stuck_after
+        self.heartbeat_timeout = heartbeat_timeout
+        self._lock = threading.Lock()
+        started = time.time()
+        self._stats: dict[str, SensorStats] = {s: SensorStats(started) for s in sensors}
+        self._alerts: dict[tuple[str, str], Alert] = {}
+
+    def observe(self, sensor: str, value: float, now: Optional[float] = None) -> None:
+        """
+        Oppdaterer statistikken til sensoren med en ny måling og setter eller fjerner varsler
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            stats = self._stats.get(sensor)
+            if stats is None:
+                stats = self._stats[sensor] = SensorStats(now)
+            stats.last_seen = now
+            self._alerts.pop((sensor, "heartbeat"), None)
+
+            #Avvik sjekkes mot det glidende gjennomsnittet før målingen tas med
+            std = stats.ewstd
+            if stats.count >= self.min_samples and std > 0 and abs(value - stats.ewma) > self.z_threshold * std:
+                self._alerts[(sensor, "outlier")] = Alert(
+                    sensor, "outlier", now, value,
+                    f"value {value:g} is {abs(value - stats.ewma) / std:.1f} std from moving average {stats.ewma:.2f}")
+            else:
+                self._alerts.pop((sensor, "outlier"), None)
+
+            stats.update(value, self.ewma_alpha)
+
+            if stats.repeats >= self.stuck_after:
+                if (sensor, "stuck") not in self._alerts:
+                    self._alerts[(sensor, "stuck")] = Alert(
+                        sensor, "stuck", now, value, f"same value reported {self.stuck_after} times in a row")
+            else:
+                self._alerts.pop((sensor, "stuck"), None)
+
+    def stats(self, sensor: str) -> Optional[SensorStats]:
+        return self._stats.get(sensor)
+
+    def active_alerts(self, sensor: Optional[str] = None, now: Optional[float] = None) -> list[Alert]:
+        """
+        Returnerer de aktive varslene, eventuelt bare for én sensor, sortert etter når de oppstod
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.heartbeat_timeout is not None:
+                for s, stats in self._stats.items():
+                    if now - stats.last_seen > self.heartbeat_timeout and (s, "heartbeat") not in self._alerts:
+                        self._alerts[(s, "heartbeat")] = Alert(
+                            s, "heartbeat", stats.last_seen + self.heartbeat_timeout, stats.last_value,
+                            f"no readings for more than {self.heartbeat_timeout:g} seconds")
+            alerts = [a for a in self._alerts.values() if sensor is None or a.sensor == sensor]
+        return sorted(alerts, key=lambda a: a.since)
@@ -1,48 +1,61 @@
+from contextlib import asynccontextmanager
 from typing import Literal
-import uvicorn
-from fastapi import FastAPI, Response
+from fastapi import APIRouter, Depends, FastAPI, Query, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse, JSONResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from smarthouse.aggregates import Aggregate
+from smarthouse.alerting import Alert
+from smarthouse.automation import AutomationWorker, Rule
 from smarthouse.domain import Actuator, ActuatorWithSensor, Device, Floor, Measurement, Room, Sensor, SmartHouse
-from smarthouse.persistence import SmartHouseRepository
+from smarthouse.registry import DEFAULT_HOUSE_ID, HouseNotFound, HouseRegistry, HouseWarmer, LoadedHouse, house_file_resolver
+from smarthouse.serialization import FastJSONResponse
 from pydantic import BaseModel
 from pathlib import Path
-import os
 
 """
 Importer: fast api brukt for å opprette web server
 Staticfiles, brukt for å operere statisk innhold som HTML, CSS og JL filer
-pathlib from path og os, brukt for håndtere fil og server manipulering/endringer
+pathlib from path, brukt for å finne data og www mappene i forhold til prosjektets rotmappe
+
+Selve applikasjonen lages av 'create_app'. Å importere modulen åpner ingen database,
+husene lastes inn i bakgrunnen når serveren starter (se 'lifespan') og '/ready' viser når de er klare.
 """
 
-#Funksjon for å sette opp database ved å peke på riktig fil
-def setup_database():
-    #Finner prosjektets rotmappe basert på filens plassering
-    project_dir = Path(__file__).parent.parent
-    #Definerer stien til database filen
-    db_file = project_dir / "data" / "db.sql" # you have to adjust this if you have changed the file name of the database
+#Finner prosjektets rotmappe basert på filens plassering
+PROJECT_DIR = Path(__file__).parent.parent
+WWW_DIR = PROJECT_DIR / "www"
 
-    return SmartHouseRepository(str(db_file.absolute()))
+#Funksjon for å sette opp registeret over hus ved å peke på riktig datamappe
+def setup_registry() -> HouseRegistry:
+    data_dir = PROJECT_DIR / "data"
+    #Definerer stien til database filen for standard huset
+    db_file = data_dir / "db.sql" # you have to adjust this if you have changed the file name of the database
 
-#Oppretter et nytt FastApi applikasjonsobjekt
-app = FastAPI()
+    return HouseRegistry(house_file_resolver(data_dir, db_file))
 
-#Setter opp referansen og lagrer referansen i "repo"
-repo = setup_database()
+#Rutene for ett hus, disse monteres både under '/smarthouse' (standard huset)
+#og under '/house/{house_id}/smarthouse'
+router = APIRouter()
 
-#Laster inn hele smarthuset fra databasen
-smarthouse = repo.load_smarthouse_deep()
-#testing av smarthuset http://127.0.0.1:8000/docs#/
+#Ruter som gjelder selve tjenesten (velkomstside, health check og readiness)
+service_router = APIRouter()
 
-#Sjekker om mappen www eksisterer i gjeldende mappe
-if not (Path.cwd() / "www").exists():
-    os.chdir(Path.cwd().parent)
 
-    #Hvis www mappen eksisterer, setter opp en rute for å håndtere statiske filer fra denne mappen
-if (Path.cwd() / "www").exists():
-    # http://localhost:8000/welcome/index.html
-    app.mount("/static", StaticFiles(directory="www"), name="static")
+def get_house(request: Request) -> LoadedHouse:
+    """
+    Avhengighet (dependency) som finner huset en forespørsel gjelder.
+    Rutene under '/smarthouse' bruker standard huset, ellers brukes 'house_id' fra stien.
+    Huset synkroniseres med endringer fra andre workers før det brukes
+    """
+    registry: HouseRegistry = request.app.state.registry
+    entry = registry.get(request.path_params.get("house_id", DEFAULT_HOUSE_ID))
+    entry.sync()
+    return entry
+
+
+def house_not_found(request: Request, exc: HouseNotFound) -> Response:
+    return FastJSONResponse({'reason': 'house with id not found'}, status_code=404)
 
 
 # http://localhost:8000/ -> welcome page
@@ -176,22 +189,123 @@ class ActuatorStateInfo(BaseModel):
         else:
             return ActuatorStateInfo(state="off")
 
-#Rute for å håndtere statiske filer fra mappen "www"
-# http://localhost:8000/welcome/index.html
-app.mount("/static", StaticFiles(directory="www"), name="static")
+#Pydantic modell for en måling sendt inn av en sensor. 'seq' er et valgfritt sekvensnummer fra klienten:
+#en måling med samme tidsstempel som en lagret måling lagres ikke på nytt, med mindre 'seq' er høyere
+class MeasurementIn(Measurement):
+    seq: int | None = None
+
+#Pydantic modell med resultatet av en bunke med målinger, se 'add_sensor_measurements'
+class MeasurementBatchResult(BaseModel):
+    inserted: int
+    duplicates: int
+
+#Pydantic modell for en kommando til mange aktuatorer samtidig, f.eks. "alle lys av i 2. etasje".
+#Aktuatorene velges med id'er, rom, etasje og/eller enhetstype, og alle kriteriene som er satt må stemme
+class ActuatorBatchCommand(BaseModel):
+    state: str | float
+    ids: list[str] | None = None
+    room: int | None = None
+    floor: int | None = None
+    device_type: str | None = None
+
+#Pydantic modell med resultatet av en batch kommando for én enhet
+class ActuatorCommandResult(BaseModel):
+    id: str
+    #'not_matched': aktuatoren finnes, men passer ikke med rom, etasje eller enhetstype i forespørselen
+    status: Literal["ok"] | Literal["not_found"] | Literal["not_matched"]
+    state: str | float | None = None
+
+#Pydantic modell for en automatiseringsregel, se 'Rule' for betydningen av feltene
+class RuleInfo(BaseModel):
+    id: int | None = None
+    sensor: str
+    aggregate: Literal["last", "avg", "min", "max"] = "last"
+    window: int = 1
+    operator: Literal[">", ">=", "<", "<="]
+    threshold: float
+    actuator: str
+    state: Literal["running", "off"] | float
+    else_state: Literal["running", "off"] | float | None = None
+
+    @staticmethod
+    def from_obj(rule: Rule):
+        return RuleInfo(id=rule.id, sensor=rule.sensor, aggregate=rule.aggregate, window=rule.window,
+                        operator=rule.operator, threshold=rule.threshold, actuator=rule.actuator,
+                        state=rule.state, else_state=rule.else_state)
+
+#Pydantic modell for et aggregat over målinger med én enhet, for et rom, en etasje eller hele huset
+class AggregateInfo(BaseModel):
+    scope: Literal["room", "floor", "house"]
+    id: int | None
+    count: int
+    mean: float
+    min: float
+    max: float
+
+    @staticmethod
+    def from_obj(aggregate: Aggregate):
+        return AggregateInfo(scope=aggregate.scope, id=aggregate.id, count=aggregate.count, mean=aggregate.mean,
+                             min=aggregate.min, max=aggregate.max)
+
+#Pydantic modeller for energiforbruk, per periode og per rom
+class EnergyPeriodInfo(BaseModel):
+    start: str
+    kwh: float
+
+class RoomEnergyInfo(BaseModel):
+    room: int
+    kwh: float
+
+#Pydantic modell for timene med høyest forbruk for en måler
+class EnergyPeaksInfo(BaseModel):
+    top_hours: list[EnergyPeriodInfo]
+    peak_hour_of_day: int | None
+
+#Pydantic modell for et aktivt varsel
+class AlertInfo(BaseModel):
+    sensor: str
+    kind: Literal["outlier", "stuck", "heartbeat"]
+    since: str
+    value: float | None
+    message: str
+
+    @staticmethod
+    def from_obj(alert: Alert):
+        return AlertInfo(sensor=alert.sensor, kind=alert.kind, since=alert.since_iso, value=alert.value,
+                         message=alert.message)
+
+#Pydantic modell for én tilstandsendring i loggen til en aktuator. Av er 'off', ellers tilstandsverdien
+class ActuatorEventInfo(BaseModel):
+    timestamp: str
+    old: str | float
+    new: str | float
+    source: str | None
+
+    @staticmethod
+    def from_row(row: tuple):
+        ts, old, new, source = row
+        return ActuatorEventInfo(timestamp=ts, old="off" if old is None else old,
+                                 new="off" if new is None else new, source=source)
+
+#Pydantic modell for hvor lenge en aktuator var påslått i én periode
+class DutyCycleInfo(BaseModel):
+    start: str
+    end: str
+    on_seconds: int
+    duty_cycle: float
 
 
 # http://localhost:8000/ -> welcome page
 
 #Definerer rotruten for applikasjonen
-@app.get("/")
+@service_router.get("/")
 def root():
     return RedirectResponse("/static/index.html")
 
 
 # Health Check / Hello World
 #Definerer en enkel health check
-@app.get("/hello")
+@service_router.get("/hello")
 def hello(name: str = "Oskar"):
     """
     En enkel endpoint for å si 'Hello' til brukeren, med navn som kan tilpasses
@@ -202,27 +316,39 @@ def hello(name: str = "Oskar"):
     """
     return {"hello": name}
 
+@service_router.get("/ready")
+def ready(request: Request) -> Response:
+    """
+    Readiness endpoint som viser om husene som lastes inn ved oppstart er klare (varme).
+    Returns:
+    JSONResponse: Status per hus, med statuskode 200 når alle er klare og 503 ellers
+    """
+    warmer: HouseWarmer | None = getattr(request.app.state, "warmer", None)
+    status = warmer.status if warmer else {}
+    is_ready = warmer is not None and warmer.ready
+    return FastJSONResponse({'ready': is_ready, 'houses': status}, status_code=200 if is_ready else 503)
+
 #Definerer en rute for å hente generell info om smarthuset
-@app.get("/smarthouse")
-def get_smarthouse_info() -> SmartHouseInfo:
+@router.get("")
+def get_smarthouse_info(house: LoadedHouse = Depends(get_house)) -> SmartHouseInfo:
     """
     Endpoint som returnerer et objekt med informasjon om den generelle strukturen av smarthuset
     Returns:
     SmartHouseInfo: Pydantic modell som inneholder informasjon om antall rom, etasjer, enheter og totalt areal av hus
     """
-    #Bruker den statiske metoden fra SmartHouseInfo for å lage et info objekt fra det globale 'smarthouse' objektet
-    return SmartHouseInfo.from_obj(smarthouse)
+    #Bruker den statiske metoden fra SmartHouseInfo for å lage et info objekt fra det gjeldende huset
+    return SmartHouseInfo.from_obj(house.house)
 
-@app.get("/smarthouse/floor")
-def get_floors() -> list[FloorInfo]:
+@router.get("/floor")
+def get_floors(house: LoadedHouse = Depends(get_house)) -> list[FloorInfo]:
     """
     Endpoint som returnerer en liste med informasjon om de ulike etasjene, konverterer hver etasje til FloorInfo objekter
     """
     #Konverterer hver etasje til et FloorInfo objekt og returnerer listen
-    return [FloorInfo.from_obj(x) for x in smarthouse.get_floors()]
+    return [FloorInfo.from_obj(x) for x in house.house.get_floors()]
 
-@app.get("/smarthouse/floor/{fid}")
-def get_floor(fid: int) -> Response:
+@router.get("/floor/{fid}")
+def get_floor(fid: int, house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som returnerer detaljert informasjon om spesifikk etasje spesifisert ved 'fid'.
     Args:
@@ -231,16 +357,16 @@ def get_floor(fid: int) -> Response:
     JSONResponse: En JSON-respons som inneholder informasjonen om etasjen, eller 404 response hvis ikke funnet.
     """
     #Går gjennom listen av etasjer og sjekker om den angitte ID'en matcher med noen av etasjene i smarthuset
-    for f in smarthouse.get_floors():
+    for f in house.house.get_floors():
         if f.level == fid:
             #Hvis funnet, returnerer da en JSON-respons med info om etasjen.
-            return JSONResponse(content=jsonable_encoder(FloorInfo.from_obj(f)))
+            return FastJSONResponse(FloorInfo.from_obj(f))
     #Hvis etasjen ikke finnes returneres en 404 error message
     return Response(status_code=404)
 
 #Henter en liste over rom i en spesifikk etasje, spesifisert med 'fid'.
-@app.get("/smarthouse/floor/{fid}/room")
-def get_rooms(fid: int) -> list[RoomInfo]:
+@router.get("/floor/{fid}/room")
+def get_rooms(fid: int, house: LoadedHouse = Depends(get_house)) -> list[RoomInfo]:
     """
     Endpoint som returnerer en liste av RoomInfo objekter for hvert rom i den spesifikke etasjen
     Args:
@@ -249,10 +375,10 @@ def get_rooms(fid: int) -> list[RoomInfo]:
     list[RoomInfo]: En liste med informasjon fra alle rommene i etasjen
     """
     #Filtrerer og returnerer rom som tilhører den spesifikke etasjen, konvertert til RoomInfo objekter
-    return [RoomInfo.from_obj(r) for r in smarthouse.get_rooms() if r.floor.level == fid]
+    return [RoomInfo.from_obj(r) for r in house.house.get_rooms() if r.floor.level == fid]
 
-@app.get("/smarthouse/floor/{fid}/room/{rid}")
-def get_room(fid: int, rid: int) -> Response:
+@router.get("/floor/{fid}/room/{rid}")
+def get_room(fid: int, rid: int, house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som søker gjennom alle rom i smarthuset og returnerer detaljert informasjon om spesififsert rom, hvis det finnes
     Args:
@@ -262,26 +388,26 @@ def get_room(fid: int, rid: int) -> Response:
     JSONResponse: En respons med detaljer om rommet i dict format, hvis ikke funnet 404 error message
     """
     #Iterer gjennom alle rom i huset
-    for r in smarthouse.get_rooms():
+    for r in house.house.get_rooms():
         #Sjekker om rom-ID og etasje ID matcher med oppgitte ID'er
         if r.db_id == rid and r.floor.level == fid:
 
-            return JSONResponse(content=jsonable_encoder(RoomInfo.from_obj(r)))
+            return FastJSONResponse(RoomInfo.from_obj(r))
 
     return Response(status_code=404)
 
-@app.get("/smarthouse/device")
-def get_devices() -> list[DeviceInfo]:
+@router.get("/device")
+def get_devices(house: LoadedHouse = Depends(get_house)) -> list[DeviceInfo]:
     """
     Endpoint som returnerer en liste over alle enheter i smarthuset, hver representert som DeviceInfo objekter.
     Returns:
     list[DeviceInfo]: En liste med enhetsinformasjon for alle enheter i huset.
     """
     #Konverterer hvert enhet til et DeviceInfo objekt og returnerer listen
-    return [DeviceInfo.from_obj(d) for d in smarthouse.get_devices()]
+    return [DeviceInfo.from_obj(d) for d in house.house.get_devices()]
 
-@app.get("/smarthouse/device/{uuid}")
-def get_device(uuid: str) -> Response:
+@router.get("/device/{uuid}")
+def get_device(uuid: str, house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som søker etter og returnerer detaljer om en spesifikk smart enhet, baser på dens Device-ID
     Args:
@@ -290,15 +416,15 @@ def get_device(uuid: str) -> Response:
     JSONResponse: Respons med detaljer om enheten hvis den finnes, hvis ikke 404 error message.
     """
     #Iterer gjennom devices i smarthuset
-    for d in smarthouse.get_devices():
+    for d in house.house.get_devices():
         #Sjekker om angitt id er registrert i huset
         if d.id == uuid:
-            return JSONResponse(content=jsonable_encoder(DeviceInfo.from_obj(d)))
+            return FastJSONResponse(DeviceInfo.from_obj(d))
 
     return Response(status_code=404)
 
-@app.get("/smarthouse/sensor/{uuid}/current")
-def get_most_recent_measurement(uuid: str) -> Response:
+@router.get("/sensor/{uuid}/current")
+def get_most_recent_measurement(uuid: str, house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som returnerer den nyligste målingen fra en gitt sensor
     Args:
@@ -307,41 +433,78 @@ def get_most_recent_measurement(uuid: str) -> Response:
     JSONResponse: Respons med den nyeste måling fra sensor, eller feilmelding hvis ingen måling tilgjengelig
     """
     #Finner enheten basert på uuid og sjekker at det er en sensor
-    device = smarthouse.get_device_by_id(uuid)
+    device = house.house.get_device_by_id(uuid)
     if device and device.is_sensor():
-        reading = repo.get_latest_reading(device)
+        reading = house.repo.get_latest_reading(device)
         if reading:
-            return JSONResponse(content=jsonable_encoder(reading))
+            return FastJSONResponse(reading)
         else:
             #Returnerer feilmelding hvis ingen måling er tilgjengelig
-            return JSONResponse(content=jsonable_encoder({'reason': 'no timeseries available'}), status_code=404)
+            return FastJSONResponse({'reason': 'no timeseries available'}, status_code=404)
     else:
         #Returnerer feilmelding hvis enhet ikke funnet, eller enhet ikke er en sensor
-        return JSONResponse(content=jsonable_encoder({'reason': 'sensor with id not found'}), status_code=404)
+        return FastJSONResponse({'reason': 'sensor with id not found'}, status_code=404)
 
-@app.post("/smarthouse/sensor/{uuid}/current")
-def add_sensor_measurement(uuid: str, measurement: Measurement) -> Response:
+@router.post("/sensor/{uuid}/current")
+def add_sensor_measurement(uuid: str, measurement: MeasurementIn, request: Request,
+                           house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som tar imot og lagrer en ny måling for en sensor.
+    Målingen evalueres mot automatiseringsreglene i bakgrunnen, etter at responsen er klar.
+    Et nytt forsøk med en måling som allerede er lagret (samme tidsstempel) gir 200 og lagres ikke på nytt.
+    En måling som kommer for sent (eldre enn den nyeste målingen til sensoren) lagres, men endrer ikke
+    nåverdien og evalueres ikke mot reglene.
     Args:
     uuid(str): Den unike ID-en til sensoren
-    measurement(Measurement): Målingsobjektet som vi vil legge til
+    measurement(MeasurementIn): Målingsobjektet som vi vil legge til
     Returns:
-    JSONResponse: Bekreftelse på at måling er lagt til eller en feilmelding hvis sensor ikke finnes
+    JSONResponse: Bekreftelse på at måling er lagt til (201) eller allerede fantes (200),
+                  eller en feilmelding hvis sensor ikke finnes
     """
     #Sjekker om enheten finnes og er en sensor
-    device = smarthouse.get_device_by_id(uuid)
+    device = house.house.get_device_by_id(uuid)
     if device and device.is_sensor():
         #Hvis det er en sensor lagres måling i db
-        repo.insert_measurement(uuid, measurement)
+        stored = Measurement(timestamp=measurement.timestamp, value=measurement.value, unit=measurement.unit)
+        if not house.repo.insert_measurement(uuid, stored, measurement.seq):
+            return FastJSONResponse(stored, status_code=200)
+        if not house.repo.is_late(uuid, measurement.timestamp):
+            request.app.state.automation.submit(house, uuid, measurement.value)
 
-        return JSONResponse(content=jsonable_encoder(measurement), status_code=201)
+        return FastJSONResponse(stored, status_code=201)
     else:
 
-        return JSONResponse(content=jsonable_encoder({'reason': 'sensor with uuid not found'}), status_code=404)
+        return FastJSONResponse({'reason': 'sensor with uuid not found'}, status_code=404)
+
+@router.post("/sensor/{uuid}/values")
+def add_sensor_measurements(uuid: str, measurements: list[MeasurementIn], request: Request,
+                            house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som tar imot mange målinger for en sensor på en gang, f.eks. målinger en sensor har lagret
+    mens den var uten nett. Målingene lagres i én transaksjon, og målinger som allerede er lagret hoppes over.
+    Args:
+    uuid(str): Den unike ID-en til sensoren
+    measurements(list[MeasurementIn]): Målingene som skal legges til
+    Returns:
+    JSONResponse: Antall målinger som ble lagt til og antall som allerede fantes,
+                  eller en feilmelding hvis sensor ikke finnes
+    """
+    device = house.house.get_device_by_id(uuid)
+    if device and device.is_sensor():
+        inserted = house.repo.insert_measurements(
+            uuid, [Measurement(timestamp=m.timestamp, value=m.value, unit=m.unit) for m in measurements],
+            [m.seq for m in measurements])
+        #Reglene evalueres mot den nyeste målingen til sensoren etter bunken
+        latest = house.repo.get_latest_reading(device) if inserted else None
+        if latest is not None:
+            request.app.state.automation.submit(house, uuid, latest.value)
+        result = MeasurementBatchResult(inserted=inserted, duplicates=len(measurements) - inserted)
+        return FastJSONResponse(result, status_code=201 if inserted else 200)
+    else:
+        return FastJSONResponse({'reason': 'sensor with uuid not found'}, status_code=404)
 
-@app.get("/smarthouse/sensor/{uuid}/values")
-def get_measurements(uuid: str, n: int | None = None) -> Response:
+@router.get("/sensor/{uuid}/values")
+def get_measurements(uuid: str, n: int | None = None, house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som returnerer en liste med målinger for en spesifikk sensor
     Args:
@@ -351,16 +514,52 @@ def get_measurements(uuid: str, n: int | None = None) -> Response:
     JSONResponse: En liste med alle målingene eller en feilmelding hvis sensor ikke finnes
     """
     #Sjekker om enheten finnes og er en sensor
-    device = smarthouse.get_device_by_id(uuid)
+    device = house.house.get_device_by_id(uuid)
     if device and device.is_sensor():
         #hvis den finnes og er sensor henter målingene
-        result = repo.get_readings(uuid, n)
-        return JSONResponse(content=jsonable_encoder(result), status_code=200)
+        result = house.repo.get_reading_series(uuid, n)
+        #Serien kodes direkte til JSON uten å lage et pydantic objekt per måling
+        return FastJSONResponse(result, status_code=200)
+    else:
+        return FastJSONResponse({'reason': 'sensor with uuid not found'}, status_code=404)
+
+@router.get("/sensor/{uuid}/stats")
+def get_measurement_stats(uuid: str, n: int = Query(ge=1), house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som returnerer antall, gjennomsnitt, minimum og maksimum av de 'n' nyeste målingene fra en sensor
+    Args:
+    uuid(str): Device id for enhet vi vil hente fra
+    n(int): Antall nyeste målinger statistikken beregnes over
+    Returns:
+    JSONResponse: Statistikken, eller feilmelding hvis sensor ikke finnes eller ikke har målinger
+    """
+    device = house.house.get_device_by_id(uuid)
+    if device and device.is_sensor():
+        result = house.repo.get_window_stats(uuid, n)
+        if result is None:
+            return FastJSONResponse({'reason': 'no timeseries available'}, status_code=404)
+        return FastJSONResponse(result)
     else:
-        return JSONResponse(content=jsonable_encoder({'reason': 'sensor with uuid not found'}), status_code=404)
+        return FastJSONResponse({'reason': 'sensor with uuid not found'}, status_code=404)
 
-@app.delete("/smarthouse/sensor/{uuid}/oldest")
-def delete_old_measurement(uuid: str) -> Response:
+@router.get("/sensor/{uuid}/lateness")
+def get_measurement_lateness(uuid: str, house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som viser hvor mange målinger fra en sensor som har kommet for sent (eldre enn den nyeste
+    målingen da de kom), og gjennomsnittlig og største forsinkelse i sekunder
+    Args:
+    uuid(str): Device id for enhet vi vil hente fra
+    Returns:
+    JSONResponse: Tellerne, eller feilmelding hvis sensor ikke finnes
+    """
+    device = house.house.get_device_by_id(uuid)
+    if device and device.is_sensor():
+        return FastJSONResponse(house.repo.lateness.get(uuid))
+    else:
+        return FastJSONResponse({'reason': 'sensor with uuid not found'}, status_code=404)
+
+@router.delete("/sensor/{uuid}/oldest")
+def delete_old_measurement(uuid: str, house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som sletter den eldste målingen for en spesifikk sensor
     Args:
@@ -369,30 +568,47 @@ def delete_old_measurement(uuid: str) -> Response:
     JSONResponse: En respons som bekrefter sletting av siste måling eller feilmelding hvis sensor ikke finnes
     """
     #Henter device og sjekker at device er en sensor
-    device = smarthouse.get_device_by_id(uuid)
+    device = house.house.get_device_by_id(uuid)
     if device and device.is_sensor():
-        result = repo.delete_oldest_reading(uuid)
-        return JSONResponse(content=jsonable_encoder(result), status_code=200)
+        result = house.repo.delete_oldest_reading(uuid)
+        return FastJSONResponse(result, status_code=200)
     else:
-        return JSONResponse(content=jsonable_encoder({'reason': 'sensor with uuid not found'}), status_code=404)
+        return FastJSONResponse({'reason': 'sensor with uuid not found'}, status_code=404)
+
+#Maks antall sekunder en forespørsel kan vente på en ny tilstand (long-polling)
+MAX_STATE_WAIT = 60.0
 
-@app.get("/smarthouse/actuator/{uuid}/current")
-def get_sensor_state(uuid: str) -> Response:
+@router.get("/actuator/{uuid}/current")
+async def get_sensor_state(uuid: str, request: Request, wait: float | None = Query(None, ge=0, le=MAX_STATE_WAIT),
+                           since: int | None = None, house: LoadedHouse = Depends(get_house)) -> Response:
     """
-    Endpoint som returnerer tilstanden til en spesifikk aktuator
+    Endpoint som returnerer tilstanden til en spesifikk aktuator.
+    Svaret har en ETag med versjonen til tilstanden. Sender klienten den tilbake i 'If-None-Match' og tilstanden
+    er uendret, svares det 304 uten innhold. Med 'wait' og 'since' (long-polling) venter forespørselen til
+    versjonen er en annen enn 'since', eller i maks 'wait' sekunder, i stedet for at klienten spør om og om igjen
     Args:
     uuid(str): Device-id til Aktuator som vi vil hente tilstand på
+    wait(float | None): Maks antall sekunder å vente på en endring
+    since(int | None): Versjonen klienten allerede har (fra ETag)
     Returns:
-    JSONResponse: En respons med tilstands data eller en feilmelding hvis aktuator ikke funnet
+    JSONResponse: En respons med tilstands data, 304 hvis uendret, eller en feilmelding hvis aktuator ikke funnet
     """
-    device = smarthouse.get_device_by_id(uuid)
-    if device and isinstance(device, Actuator):
-        return JSONResponse(jsonable_encoder(ActuatorStateInfo.from_obj(device)))
-    else:
-        return JSONResponse(content=jsonable_encoder({'reason': 'actuator with uuid not found'}), status_code=404)
-
-@app.put("/smarthouse/actuator/{uuid}/")
-def update_sensor_state(uuid: str, target_state: ActuatorStateInfo) -> Response:
+    device = house.house.get_device_by_id(uuid)
+    if not (device and isinstance(device, Actuator)):
+        return FastJSONResponse({'reason': 'actuator with uuid not found'}, status_code=404)
+
+    version = house.repo.state_version(uuid)
+    if wait and since is not None and version == since:
+        version = await house.states.wait(uuid, since, wait, lambda: house.repo.state_version(uuid),
+                                          lambda: run_in_threadpool(house.sync))
+    etag = f'"{version}"'
+    tags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return FastJSONResponse(ActuatorStateInfo.from_obj(device), headers={"ETag": etag})
+
+@router.put("/actuator/{uuid}/")
+def update_sensor_state(uuid: str, target_state: ActuatorStateInfo, house: LoadedHouse = Depends(get_house)) -> Response:
     """
     Endpoint som oppdaterer tilstanden til en aktuator basert på input tilstand som vi vil skal settes
     Args:
@@ -401,22 +617,291 @@ def update_sensor_state(uuid: str, target_state: ActuatorStateInfo) -> Response:
     Response:
     JSONResponse: Respons som bekrefter oppdateringen eller feilmelding hvis aktuator ikke funnet
     """
-    device = smarthouse.get_device_by_id(uuid)
+    device = house.house.get_device_by_id(uuid)
     if device and isinstance(device, Actuator):
-        if isinstance(target_state.state, float):
-            device.turn_on(target_state.state)
-        elif target_state.state == "running":
-            device.turn_on()
-        elif target_state.state == "off":
-            device.turn_off()
-        # else leave unchanged
-        repo.update_actuator_state(device)
-        return JSONResponse(jsonable_encoder(ActuatorStateInfo.from_obj(device)))
+        house.repo.apply_actuator_states([(device, target_state.state)], source="api")
+        return FastJSONResponse(ActuatorStateInfo.from_obj(device))
+    else:
+        return FastJSONResponse({'reason': 'actuator with uuid not found'}, status_code=404)
+
+@router.post("/actuator/batch")
+def update_actuator_states(command: ActuatorBatchCommand, house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som endrer tilstanden til mange aktuatorer med én forespørsel. Tilstandene endres i minnet
+    og lagres så i én transaksjon, i stedet for én forespørsel og én commit per aktuator.
+    Args:
+    command(ActuatorBatchCommand): Tilstanden som skal settes og hvilke aktuatorer den gjelder
+    Returns:
+    JSONResponse: Resultat per enhet, eller feilmelding hvis ingen utvalgskriterier er gitt
+    """
+    if command.ids is None and command.room is None and command.floor is None and command.device_type is None:
+        return FastJSONResponse({'reason': 'no actuators selected'}, status_code=400)
+
+    results = []
+    targets = []
+    if command.ids is not None:
+        candidates = []
+        for uuid in command.ids:
+            device = house.house.get_device_by_id(uuid)
+            if device and isinstance(device, Actuator):
+                candidates.append(device)
+            else:
+                results.append(ActuatorCommandResult(id=uuid, status="not_found"))
     else:
-        return JSONResponse(content=jsonable_encoder({'reason': 'actuator with uuid not found'}), status_code=404)
+        candidates = [d for d in house.house.get_devices() if isinstance(d, Actuator)]
+
+    #Filtrerer på rom, etasje og enhetstype hvis de er oppgitt
+    for device in candidates:
+        matched = True
+        if command.room is not None and (device.room is None or device.room.db_id != command.room):
+            matched = False
+        elif command.floor is not None and (device.room is None or device.room.floor.level != command.floor):
+            matched = False
+        elif command.device_type is not None and device.device_type != command.device_type:
+            matched = False
+        if matched:
+            targets.append(device)
+        elif command.ids is not None:
+            #Bare aktuatorer som er bedt om med id får et svar når de ikke passer med utvalget
+            results.append(ActuatorCommandResult(id=device.id, status="not_matched"))
+
+    #Tilstandene settes i minnet og lagres under låsen til repository, og settes tilbake hvis lagringen feiler
+    house.repo.apply_actuator_states([(device, command.state) for device in targets], source="api-batch")
+
+    for device in targets:
+        results.append(ActuatorCommandResult(id=device.id, status="ok", state=ActuatorStateInfo.from_obj(device).state))
+    return FastJSONResponse(results)
+
+@router.get("/actuator/{uuid}/history")
+def get_actuator_history(uuid: str, from_ts: str | None = None, to_ts: str | None = None,
+                         house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som returnerer tilstandsendringene til en aktuator, eventuelt begrenset til et tidsrom
+    Args:
+    uuid(str): Device-id til aktuatoren
+    from_ts(str | None): Start på tidsrommet (ISO format)
+    to_ts(str | None): Slutt på tidsrommet (ISO format), ikke inkludert
+    Returns:
+    JSONResponse: Liste med endringer sortert etter tid, eller feilmelding hvis aktuator ikke funnet
+    """
+    device = house.house.get_device_by_id(uuid)
+    if not (device and isinstance(device, Actuator)):
+        return FastJSONResponse({'reason': 'actuator with uuid not found'}, status_code=404)
+    try:
+        rows = house.repo.get_state_timeline(uuid, from_ts, to_ts)
+    except ValueError:
+        return FastJSONResponse({'reason': 'invalid timestamp'}, status_code=400)
+    return FastJSONResponse([ActuatorEventInfo.from_row(r) for r in rows])
+
+@router.get("/actuator/{uuid}/duty-cycle")
+def get_actuator_duty_cycle(uuid: str, from_ts: str, to_ts: str, period: Literal["hour", "day"] = "day",
+                            house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som returnerer hvor lenge en aktuator var påslått i hver time eller dag i et tidsrom
+    Args:
+    uuid(str): Device-id til aktuatoren
+    from_ts(str): Start på tidsrommet (ISO format)
+    to_ts(str): Slutt på tidsrommet (ISO format), ikke inkludert
+    period(str): 'hour' eller 'day'
+    Returns:
+    JSONResponse: Sekunder og andel påslått per periode, eller feilmelding hvis aktuator ikke funnet
+    """
+    device = house.house.get_device_by_id(uuid)
+    if not (device and isinstance(device, Actuator)):
+        return FastJSONResponse({'reason': 'actuator with uuid not found'}, status_code=404)
+    try:
+        rows = house.repo.calc_duty_cycle(uuid, from_ts, to_ts, period)
+    except ValueError:
+        return FastJSONResponse({'reason': 'invalid timestamp'}, status_code=400)
+    return FastJSONResponse([DutyCycleInfo(start=start, end=end, on_seconds=on, duty_cycle=share)
+                             for start, end, on, share in rows])
+
+@router.get("/aggregates")
+def get_aggregates(unit: str, scope: Literal["room", "floor", "house"] = "room", from_ts: str | None = None,
+                   to_ts: str | None = None, house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som returnerer antall, gjennomsnitt, min og maks for alle målinger med en enhet i et tidsrom,
+    per rom, per etasje eller for hele huset
+    Args:
+    unit(str): Enheten til målingene, f.eks. '°C', '%' eller 'kWh'
+    scope(str): 'room', 'floor' eller 'house'
+    from_ts(str | None): Start på tidsrommet (ISO format)
+    to_ts(str | None): Slutt på tidsrommet (ISO format), ikke inkludert
+    Returns:
+    JSONResponse: Liste med aggregater, eller feilmelding ved ugyldig tidspunkt
+    """
+    try:
+        result = house.repo.calc_aggregates(unit, scope, from_ts, to_ts)
+    except ValueError:
+        return FastJSONResponse({'reason': 'invalid timestamp'}, status_code=400)
+    return FastJSONResponse([AggregateInfo.from_obj(a) for a in result])
+
+def electricity_meters(house: SmartHouse) -> list[Device]:
+    return [d for d in house.get_devices() if d.is_sensor() and d.device_type == "Electricity Meter"]
+
+@router.get("/energy/rooms")
+def get_energy_by_room(from_ts: str | None = None, to_ts: str | None = None,
+                       house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som fordeler strømforbruket (kWh) i et tidsrom på rommene strømmålerne står i
+    Args:
+    from_ts(str | None): Start på tidsrommet (ISO format)
+    to_ts(str | None): Slutt på tidsrommet (ISO format), ikke inkludert
+    Returns:
+    JSONResponse: Forbruk per rom, eller feilmelding ved ugyldig tidspunkt
+    """
+    meters = {d.id: d.room.db_id for d in electricity_meters(house.house) if d.room and d.room.db_id is not None}
+    try:
+        result = house.energy.consumption_by_room(meters, from_ts, to_ts)
+    except ValueError:
+        return FastJSONResponse({'reason': 'invalid timestamp'}, status_code=400)
+    return FastJSONResponse([RoomEnergyInfo(room=room, kwh=kwh) for room, kwh in sorted(result.items())])
+
+@router.get("/energy/{uuid}")
+def get_energy_consumption(uuid: str, period: Literal["hour", "day", "month"] = "day", from_ts: str | None = None,
+                           to_ts: str | None = None, house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som returnerer strømforbruket (kWh) til en måler per time, dag eller måned
+    Args:
+    uuid(str): Device id til strømmåleren
+    period(str): 'hour', 'day' eller 'month'
+    from_ts(str | None): Ta bare med perioder som starter fra og med dette tidspunktet
+    to_ts(str | None): Ta bare med perioder som starter før dette tidspunktet
+    Returns:
+    JSONResponse: Forbruk per periode, eller feilmelding hvis måleren ikke finnes eller tidspunktet er ugyldig
+    """
+    if uuid not in {d.id for d in electricity_meters(house.house)}:
+        return FastJSONResponse({'reason': 'electricity meter with uuid not found'}, status_code=404)
+    try:
+        result = house.energy.consumption_by_period(uuid, period, from_ts, to_ts)
+    except ValueError:
+        return FastJSONResponse({'reason': 'invalid timestamp'}, status_code=400)
+    return FastJSONResponse([EnergyPeriodInfo(start=start, kwh=kwh) for start, kwh in result])
+
+@router.get("/energy/{uuid}/peaks")
+def get_energy_peaks(uuid: str, n: int = Query(5, ge=1), from_ts: str | None = None, to_ts: str | None = None,
+                     house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som returnerer timene med høyest strømforbruk, og timen på døgnet med høyest forbruk i snitt
+    Args:
+    uuid(str): Device id til strømmåleren
+    n(int): Antall timer som returneres
+    Returns:
+    JSONResponse: Timene med høyest forbruk, eller feilmelding hvis måleren ikke finnes eller tidspunktet er ugyldig
+    """
+    if uuid not in {d.id for d in electricity_meters(house.house)}:
+        return FastJSONResponse({'reason': 'electricity meter with uuid not found'}, status_code=404)
+    try:
+        peaks = house.energy.peak_hours(uuid, n, from_ts, to_ts)
+    except ValueError:
+        return FastJSONResponse({'reason': 'invalid timestamp'}, status_code=400)
+    return FastJSONResponse(EnergyPeaksInfo(
+        top_hours=[EnergyPeriodInfo(start=start, kwh=kwh) for start, kwh in peaks["top_hours"]],
+        peak_hour_of_day=peaks["peak_hour_of_day"]))
+
+@router.get("/alerts")
+def get_alerts(sensor: str | None = None, house: LoadedHouse = Depends(get_house)) -> list[AlertInfo]:
+    """
+    Endpoint som returnerer de aktive varslene (avvikende målinger, sensorer som står fast
+    og sensorer som ikke har rapportert), eventuelt bare for én sensor
+    Args:
+    sensor(str | None): Device id til sensoren, alle sensorer hvis ikke gitt
+    Returns:
+    list[AlertInfo]: De aktive varslene, eldste først
+    """
+    return [AlertInfo.from_obj(a) for a in house.alerts.active_alerts(sensor)]
+
+@router.get("/automation/rule")
+def get_rules(house: LoadedHouse = Depends(get_house)) -> list[RuleInfo]:
+    """
+    Endpoint som returnerer alle automatiseringsreglene for huset
+    """
+    return [RuleInfo.from_obj(r) for r in house.automation.rules]
+
+@router.post("/automation/rule")
+def add_rule(rule: RuleInfo, house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som legger til en automatiseringsregel
+    Args:
+    rule(RuleInfo): Regelen, sensoren og aktuatoren må finnes i huset
+    Returns:
+    JSONResponse: Regelen med ny id, eller feilmelding hvis regelen er ugyldig
+    """
+    sensor = house.house.get_device_by_id(rule.sensor)
+    actuator = house.house.get_device_by_id(rule.actuator)
+    if not (sensor and sensor.is_sensor()):
+        return FastJSONResponse({'reason': 'sensor with uuid not found'}, status_code=404)
+    if not (actuator and isinstance(actuator, Actuator)):
+        return FastJSONResponse({'reason': 'actuator with uuid not found'}, status_code=404)
+    try:
+        new_rule = Rule(None, rule.sensor, rule.operator, rule.threshold, rule.actuator, rule.state,
+                        rule.aggregate, rule.window, rule.else_state)
+    except ValueError as e:
+        return FastJSONResponse({'reason': str(e)}, status_code=400)
+    house.repo.add_rule(new_rule)
+    house.automation.load(house.repo.get_rules())
+    return FastJSONResponse(RuleInfo.from_obj(new_rule), status_code=201)
+
+@router.delete("/automation/rule/{rule_id}")
+def delete_rule(rule_id: int, house: LoadedHouse = Depends(get_house)) -> Response:
+    """
+    Endpoint som sletter en automatiseringsregel
+    """
+    if not house.repo.delete_rule(rule_id):
+        return FastJSONResponse({'reason': 'rule with id not found'}, status_code=404)
+    house.automation.load(house.repo.get_rules())
+    return Response(status_code=204)
+
+
+def create_app(registry: HouseRegistry | None = None, warm_houses: tuple[str, ...] = (DEFAULT_HOUSE_ID,)) -> FastAPI:
+    """
+    App factory som setter sammen FastAPI applikasjonen.
+    Args:
+    registry(HouseRegistry | None): Registeret som skal brukes, standard er husene i 'data' mappen
+    warm_houses(tuple[str, ...]): Hus som lastes inn i bakgrunnen når serveren starter
+    Returns:
+    FastAPI: Applikasjonen, klar til å kjøres av uvicorn (f.eks. 'uvicorn --factory smarthouse.api:create_app')
+    """
+    if registry is None:
+        registry = setup_registry()
+    automation = AutomationWorker()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        #Starter innlastingen i bakgrunnen, serveren tar imot forespørsler med en gang
+        warmer = HouseWarmer(registry, list(warm_houses))
+        app.state.warmer = warmer
+        warmer.start()
+        automation.start()
+        yield
+        #Venter på bakgrunnstrådene, slik at ingen av dem skriver til databasen etter at serveren har stoppet
+        warmer.stop()
+        automation.stop()
+        registry.flush_snapshots()
+
+    #Oppretter et nytt FastApi applikasjonsobjekt, alle responser serialiseres med FastJSONResponse
+    app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+    app.state.registry = registry
+    app.state.automation = automation
+    app.add_exception_handler(HouseNotFound, house_not_found)
+
+    #Hvis www mappen eksisterer, setter opp en rute for å håndtere statiske filer fra denne mappen
+    if WWW_DIR.exists():
+        # http://localhost:8000/static/index.html
+        app.mount("/static", StaticFiles(directory=WWW_DIR), name="static")
+
+    app.include_router(service_router)
+    app.include_router(router, prefix="/smarthouse")
+    app.include_router(router, prefix="/house/{house_id}/smarthouse")
+    return app
+
+
+#Applikasjonen som uvicorn bruker som standard, å lage den gjør ikke noe databasearbeid
+app = create_app()
 
 
 if __name__ == '__main__':
+    import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
 
 #Kjører serveren hvis filen blir eksekvert som hovedprogram
@@ -0,0 +1,225 @@
+import logging
+import operator
+import os
+import queue
+import threading
+from typing import Optional
+
+from smarthouse.domain import Actuator
+from smarthouse.ringbuffer import RingBuffer
+
+"""
+Automatisering: regler som 'fuktighet i rom 4 over 60 % -> slå på avfukteren'.
+Reglene kompileres til en indeks fra sensor id til reglene for sensoren, slik at en ny måling
+bare evalueres mot reglene som gjelder den sensoren. Aggregater over de siste målingene
+(gjennomsnitt, min, maks) holdes i ringbuffere. Evalueringen skjer i en bakgrunnstråd ('AutomationWorker'),
+så forespørselen som tar imot målingen venter ikke på reglene.
+Ringbufferne og om betingelsen til en regel er sann holdes i minnet i hver prosess, ikke i databasen.
+En måling evalueres bare i prosessen (uvicorn worker) som tok imot den, så med flere workers ser hver
+regel bare en del av målingene og aggregater over et vindu blir feil. Reglene krever derfor én worker,
+'AutomationWorker.start' advarer når serveren er satt opp med flere (WEB_CONCURRENCY).
+"""
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+AGGREGATES = ("last", "avg", "min", "max")
+
+#Maks antall målinger en regel kan aggregere over
+MAX_WINDOW = 1000
+
+
+def parse_state(value: str | float) -> str | float:
+    """
+    Gjør om en tilstand lagret som tekst til "running", "off" eller en verdi
+    """
+    if value in ("running", "off"):
+        return value
+    return float(value)
+
+
+class Rule:
+    """
+    En regel: når 'aggregate' over de siste 'window' målingene fra 'sensor' sammenlignet med 'threshold'
+    blir sann settes 'actuator' til 'state'. Blir betingelsen usann igjen settes 'else_state' hvis den er gitt.
+    Regelen reagerer kun når betingelsen endrer seg, ikke for hver måling.
+    """
+
+    def __init__(self, rule_id: Optional[int], sensor: str, operator: str, threshold: float, actuator: str,
+                 state: str | float, aggregate: str = "last", window: int = 1, else_state: str | float | None = None):
+        if operator not in OPERATORS:
+            raise ValueError(f"unknown operator: {operator}")
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"unknown aggregate: {aggregate}")
+        if not 1 <= window <= MAX_WINDOW:
+            raise ValueError(f"window must be between 1 and {MAX_WINDOW}")
+        self.id = rule_id
+        self.sensor = sensor
+        self.operator = operator
+        self.threshold = threshold
+        self.actuator = actuator
+        self.state = state
+        self.aggregate = aggregate
+        self.window = window if aggregate != "last" else 1
+        self.else_state = else_state
+
+
+class RuleEngine:
+    """
+    Evaluerer målinger mot reglene. Kostnaden per måling er O(antall regler for sensoren)
+    (min/maks går i tillegg gjennom vinduet, som er begrenset av 'MAX_WINDOW').
+    Vinduene og tilstanden til reglene finnes bare i denne prosessen, se modulbeskrivelsen.
+    """
+
+    def __init__(self, rules: list[Rule]) -> None:
+        self._lock = threading.Lock()
+        self._index: dict[str, list[Rule]] = {}
+        #Ett ringbuffer per (sensor, vindusstørrelse), deles av regler med samme vindu
+        self._windows: dict[tuple[str, int], RingBuffer] = {}
+        self._active: dict[int, bool] = {} #Resultatet av betingelsen sist regelen ble evaluert
+        self.load(rules)
+
+    def load(self, rules: list[Rule]) -> None:
+        """
+        Bygger indeksen på nytt fra en liste med regler. Vinduer og tilstand for regler som fortsatt finnes beholdes
+        """
+        index: dict[str, list[Rule]] = {}
+        for rule in rules:
+            index.setdefault(rule.sensor, []).append(rule)
+        with self._lock:
+            self._index = index
+            keys = {(r.sensor, r.window) for r in rules}
+            ids = {r.id for r in rules}
+            self._windows = {k: w for k, w in self._windows.items() if k in keys}
+            self._active = {k: v for k, v in self._active.items() if k in ids}
+
+    @property
+    def rules(self) -> list[Rule]:
+        return [r for rules in self._index.values() for r in rules]
+
+    def evaluate(self, sensor: str, value: float) -> list[tuple[Rule, str | float]]:
+        """
+        Legger målingen inn i vinduene til sensoren og evaluerer reglene for den
+        Returns:
+            list[tuple[Rule, str | float]]: Regler som slo til, med tilstanden aktuatoren skal settes til
+        """
+        rules = self._index.get(sensor)
+        if not rules:
+            return []
+        commands = []
+        with self._lock:
+            for window in {r.window for r in rules}:
+                buffer = self._windows.get((sensor, window))
+                if buffer is None:
+                    buffer = self._windows[(sensor, window)] = RingBuffer(window)
+                buffer.append(value)
+
+            for rule in rules:
+                buffer = self._windows[(sensor, rule.window)]
+                if rule.aggregate == "avg":
+                    current = buffer.mean()
+                elif rule.aggregate == "min":
+                    current = buffer.min()
+                elif rule.aggregate == "max":
+                    current = buffer.max()
+                else:
+                    current = buffer.last()
+                condition = OPERATORS[rule.operator](current, rule.threshold)
+                previous = self._active.get(rule.id)
+                if condition == previous:
+                    continue
+                self._active[rule.id] = condition
+                if condition:
+                    commands.append((rule, rule.state))
+                elif previous is not None and rule.else_state is not None:
+                    commands.append((rule, rule.else_state))
+        return commands
+
+
+class AutomationWorker:
+    """
+    Bakgrunnstråd som evaluerer målinger mot reglene til huset målingen kom fra.
+    'submit' legger bare målingen i en kø, så den er rask og blokkerer aldri. Er køen full
+    forkastes målingen for automatiseringen (den er allerede lagret i databasen).
+    """
+
+    def __init__(self, max_queue: int = 10000) -> None:
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def submit(self, house, sensor: str, value: float) -> bool:
+        """
+        Args:
+            house(LoadedHouse): Huset målingen hører til
+            sensor(str): ID til sensoren
+            value(float): Verdien som ble målt
+        Returns:
+            bool: False hvis køen var full og målingen ikke blir evaluert
+        """
+        try:
+            self._queue.put_nowait((house, sensor, value))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Automation queue full, dropping reading from %s", sensor)
+            return False
+
+    def start(self) -> None:
+        #uvicorn leser antall workers fra WEB_CONCURRENCY, reglene ser da bare målingene til sin egen prosess
+        workers = os.environ.get("WEB_CONCURRENCY", "1")
+        if workers.isdigit() and int(workers) > 1:
+            logger.warning("Automation rules are evaluated per process, with %s workers windowed rules "
+                           "only see part of the readings, run the server with a single worker", workers)
+        self._thread = threading.Thread(target=self._run, name="automation", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def drain(self) -> None:
+        """
+        Venter til alle målinger i køen er evaluert
+        """
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            #Tar med alt som allerede ligger i køen, slik at endringene kan lagres samlet
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                self.process([item for item in batch if item is not None])
+            except Exception:
+                logger.exception("Evaluating automation rules failed")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def process(self, batch: list[tuple]) -> None:
+        """
+        Evaluerer en samling målinger og lagrer endringene per hus i én transaksjon
+        """
+        changed: dict[int, tuple] = {} #id(hus) -> (hus, {aktuator id: (aktuator, tilstand)})
+        for house, sensor, value in batch:
+            for rule, state in house.automation.evaluate(sensor, value):
+                device = house.house.get_device_by_id(rule.actuator)
+                if not isinstance(device, Actuator):
+                    logger.warning("Rule %s refers to unknown actuator %s", rule.id, rule.actuator)
+                    continue
+                #Den siste tilstanden for en aktuator i samme runde vinner
+                changed.setdefault(id(house), (house, {}))[1][device.id] = (device, state)
+        #Tilstanden i minnet endres under låsen til repository, samme vei som endepunktene, så versjoner
+        #og loggen stemmer og en forespørsel som endrer samme aktuator ikke kommer i mellom
+        for house, changes in changed.values():
+            house.repo.apply_actuator_states(list(changes.values()), source="automation")
@@ -0,0 +1,197 @@
+import calendar
+import struct
+import time
+from datetime import datetime, timezone
+
+"""
+Komprimert lagring av målinger i biter ('chunks') på ett døgn per sensor, etter Gorilla formatet
+(Pelkonen m.fl., "Gorilla: A Fast, Scalable, In-Memory Time Series Database", VLDB 2015):
+- tidsstempler lagres som 'delta-of-delta', jevne målinger (f.eks. hver time) koster da 1 bit
+- verdier lagres som XOR mot forrige verdi, der bare de meningsfulle bitene i midten tas med
+
+Tidsstempler lagres som hele sekunder (UTC), og gjøres om til formatet i databasen ved lesing.
+"""
+
+#Lengden på en bit i sekunder. Bitene starter ved midnatt, så én bit er ett døgn
+CHUNK_SECONDS = 86400
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#Grupper for delta-of-delta: (prefiks, antall prefiksbits, antall bits for verdien)
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+def ts_to_epoch(ts: str) -> int:
+    """
+    Gjør om et tidsstempel i ISO format til sekunder siden 1970. Tidsstempler uten tidssone regnes som UTC
+    """
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(dt.timetuple())
+
+
+def epoch_to_ts(epoch: int) -> str:
+    return time.strftime(_TIMESTAMP_FORMAT, time.gmtime(epoch))
+
+
+def chunk_start(epoch: int) -> int:
+    return epoch - epoch % CHUNK_SECONDS
+
+
+class BitWriter:
+    """
+    Skriver bits til en bytearray, de minst signifikante 'n' bitene av 'value' skrives først mest signifikant
+    """
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value: int, n: int) -> None:
+        self._acc = (self._acc << n) | (value & ((1 << n) - 1))
+        self._bits += n
+        while self._bits >= 8:
+            self._bits -= 8
+            self.data.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self._bits:
+            return bytes(self.data) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self.data)
+
+
+class BitReader:
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+        self._pos = 0
+        self._acc = 0
+        self._bits = 0
+
+    def read(self, n: int) -> int:
+        while self._bits < n:
+            if self._pos >= len(self._data):
+                raise ValueError("truncated chunk")
+            self._acc = (self._acc << 8) | self._data[self._pos]
+            self._pos += 1
+            self._bits += 8
+        self._bits -= n
+        value = (self._acc >> self._bits) & ((1 << n) - 1)
+        self._acc &= (1 << self._bits) - 1
+        return value
+
+
+def _float_bits(value: float) -> int:
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+def _write_signed(writer: BitWriter, value: int, n: int) -> None:
+    writer.write(value & ((1 << n) - 1), n)
+
+
+def _read_signed(reader: BitReader, n: int) -> int:
+    value = reader.read(n)
+    return value - (1 << n) if value & (1 << (n - 1)) else value
+
+
+def encode_chunk(start: int, points: list[tuple[int, float]]) -> bytes:
+    """
+    Koder målinger i én bit
+    Args:
+        start(int): Starten på biten (sekunder), alle tidsstempler må være i [start, start + CHUNK_SECONDS)
+        points(list[tuple[int, float]]): (sekunder, verdi) sortert etter tid
+    Returns:
+        bytes: De kodede målingene
+    """
+    writer = BitWriter()
+    prev_ts = start
+    prev_delta = 0
+    prev_bits = 0
+    leading, trailing = 64, 64
+    for i, (ts, value) in enumerate(points):
+        delta = ts - prev_ts
+        if i == 0:
+            writer.write(delta, 17) #Første målings avstand fra starten, et døgn er under 2^17 sekunder
+        else:
+            dod = delta - prev_delta
+            if dod == 0:
+                writer.write(0, 1)
+            else:
+                for prefix, prefix_bits, bits in _DOD_BUCKETS:
+                    if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+                        writer.write(prefix, prefix_bits)
+                        _write_signed(writer, dod, bits)
+                        break
+                else:
+                    writer.write(0b1111, 4)
+                    _write_signed(writer, dod, 32)
+        prev_delta = delta
+        prev_ts = ts
+
+        bits = _float_bits(value)
+        if i == 0:
+            writer.write(bits, 64)
+        else:
+            xor = bits ^ prev_bits
+            if xor == 0:
+                writer.write(0, 1)
+            else:
+                writer.write(1, 1)
+                lead = 64 - xor.bit_length()
+                trail = (xor & -xor).bit_length() - 1
+                if lead >= leading and trail >= trailing:
+                    #Passer i samme vindu som forrige verdi, vinduet trenger ikke lagres på nytt
+                    writer.write(0, 1)
+                    writer.write(xor >> trailing, 64 - leading - trailing)
+                else:
+                    lead = min(lead, 31)
+                    length = 64 - lead - trail
+                    writer.write(1, 1)
+                    writer.write(lead, 5)
+                    writer.write(length & 63, 6) #64 lagres som 0
+                    writer.write(xor >> trail, length)
+                    leading, trailing = lead, trail
+        prev_bits = bits
+    return writer.getvalue()
+
+
+def decode_chunk(start: int, data: bytes, count: int) -> list[tuple[int, float]]:
+    """
+    Dekoder en bit kodet med 'encode_chunk'
+    Returns:
+        list[tuple[int, float]]: (sekunder, verdi) sortert etter tid
+    """
+    reader = BitReader(data)
+    points = []
+    ts = start
+    delta = 0
+    bits = 0
+    leading, trailing = 64, 64
+    for i in range(count):
+        if i == 0:
+            delta = reader.read(17)
+        elif reader.read(1):
+            for _, _, n in _DOD_BUCKETS:
+                if not reader.read(1):
+                    delta += _read_signed(reader, n)
+                    break
+            else:
+                delta += _read_signed(reader, 32)
+        ts += delta
+
+        if i == 0:
+            bits = reader.read(64)
+        elif reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                length = reader.read(6) or 64
+                trailing = 64 - leading - length
+            bits ^= reader.read(64 - leading - trailing) << trailing
+        points.append((ts, _bits_float(bits)))
+    return points
@@ -1,6 +1,7 @@
+from array import array
 from datetime import datetime
 from random import random
-from typing import List, Optional, Union 
+from typing import Iterator, List, Optional, Union 
 from abc import abstractmethod
 
 from pydantic import BaseModel
@@ -15,9 +16,61 @@ class Measurement(BaseModel):
     unit: str | None
 
 
+class MeasurementSeries:
+    """
+    Kompakt representasjon av mange målinger fra samme sensor, brukes ved bulk lesing.
+    Verdiene lagres i en 'array' av flyttall og tidsstemplene i en parallell liste, mens
+    enhetene interneres slik at alle målinger med samme enhet deler ett streng objekt.
+    'Measurement' objekter lages først når serien konverteres ved API grensen.
+    """
+    __slots__ = ("timestamps", "values", "units", "_unit_pool")
+
+    def __init__(self) -> None:
+        self.timestamps: list[str] = []
+        self.values = array("d")
+        self.units: list[str | None] = []
+        self._unit_pool: dict[str | None, str | None] = {}
+
+    @staticmethod
+    def from_rows(rows) -> "MeasurementSeries":
+        """
+        Lager en serie fra rader på formen (ts, value, unit), slik de kommer fra databasen
+        """
+        series = MeasurementSeries()
+        for ts, value, unit in rows:
+            series.append(ts, value, unit)
+        return series
+
+    def append(self, timestamp: str, value: float, unit: str | None) -> None:
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+        #Interner enheten slik at den samme strengen gjenbrukes for hver måling
+        self.units.append(self._unit_pool.setdefault(unit, unit))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, i: int) -> Measurement:
+        return Measurement(timestamp=self.timestamps[i], value=self.values[i], unit=self.units[i])
+
+    def __iter__(self) -> Iterator[Measurement]:
+        for i in range(len(self.values)):
+            yield self[i]
+
+    def to_measurements(self) -> list[Measurement]:
+        """
+        Konverterer serien til en liste med pydantic 'Measurement' objekter
+        """
+        return list(self)
+
+
 class Device:
     """En baseklasse for alle enheter i huset, definerer felles attributer
     som navn, id, type osv..."""
+    #'unit' og 'state' ligger her og ikke i Sensor/Actuator, fordi ActuatorWithSensor arver fra
+    #begge og Python tillater ikke flere baseklasser med egne (ikke-tomme) __slots__
+    __slots__ = ("id", "model_name", "supplier", "device_type", "room", "unit", "state")
+
     def __init__(self, id: str, model_name: str, supplier: str, device_type: str):
         self.id = id
         self.model_name = model_name 
@@ -38,6 +91,8 @@ class Device:
         pass
 
 class Sensor(Device):
+    __slots__ = ()
+
     def __init__(self, id: str, model_name: str, supplier: str, device_type: str, unit: str = ""):
         super().__init__(id, model_name, supplier, device_type)
         self.unit = unit
@@ -53,6 +108,8 @@ class Sensor(Device):
         
 
 class Actuator(Device):
+    __slots__ = ()
+
     def __init__(self, id: str, model_name: str, supplier: str, device_type: str):
         super().__init__(id, model_name, supplier, device_type)
         self.state : Union[float, bool] = False
@@ -79,10 +136,28 @@ class Actuator(Device):
 
 
 
+def apply_target_state(device: Actuator, target_state: str | float) -> None:
+    """
+    Setter tilstanden til en aktuator ut fra en ønsket tilstand, slik den kommer fra API'et eller en regel
+    Args:
+    device(Actuator): Aktuatoren som skal endres
+    target_state(str | float): En verdi slår på med verdien, "running" slår på og "off" slår av
+    """
+    if isinstance(target_state, float):
+        device.turn_on(target_state)
+    elif target_state == "running":
+        device.turn_on()
+    elif target_state == "off":
+        device.turn_off()
+    # else leave unchanged
+
+
 class ActuatorWithSensor(Actuator, Sensor):
     """Klassen arver både fra actuator klassen og sensor klassen,
     demonstrerer prinsippet om flerav. Klassen representerer enheter som kan
     fungere både som sensor og aktuator, vil da ha en måling og en av/på funksjon"""
+    __slots__ = ()
+
     def __init__(self, id: str, model_name: str, supplier: str, device_type: str):
         super().__init__(id, model_name, supplier, device_type)
 
@@ -95,6 +170,8 @@ class ActuatorWithSensor(Actuator, Sensor):
 
 class Floor:
     """En klasse for etasje i huset, hver etasje inneholder flere rom"""
+    __slots__ = ("level", "rooms")
+
     def __init__(self, level: int):
         self.level = level
         self.rooms : list[Room] = []
@@ -102,6 +179,7 @@ class Floor:
 
 class Room:
     """Representerer et rom i en etasje, hvor romdata spesifiseres"""
+    __slots__ = ("floor", "room_size", "room_name", "devices", "db_id")
 
     def __init__(self, floor: Floor, room_size: float, room_name: Optional[str]):
         self.floor = floor
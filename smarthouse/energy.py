@@ -0,0 +1,214 @@
+import threading
+from array import array
+from datetime import datetime, timedelta
+from typing import Optional
+from smarthouse.persistence import normalize_timestamp
+
+"""
+Energianalyse for strømmålere (sensorer med enhet 'kWh'): forbruk per time, dag og måned, timene med
+høyest forbruk og forbruk per rom. Målerne kan rapportere forbruket siden forrige måling (standard),
+eller en akkumulert måleravlesning ('cumulative'), der forbruket er differansen mellom to avlesninger.
+
+Forbruket for perioder som er avsluttet (før perioden vi er i nå) endres ikke av nye målinger, og caches
+per måler og periodetype. Neste beregning leser bare målingene etter den siste avsluttede perioden
+(indeksen på (device, ts) gjør at dette ikke leser hele tabellen). Kommer det en måling for sent eller en
+sletting i en avsluttet periode, merkes bare den perioden (og for akkumulerte målere neste periode med målinger,
+som regnes fra siste avlesning i den) som utdatert, og regnes ut på nytt ved neste beregning.
+"""
+
+PERIODS = ("hour", "day", "month")
+
+#Antall tegn av tidsstempelet ('2024-01-28 14:00:00') som identifiserer perioden, og det som legges til for start
+_PERIOD_PREFIX = {"hour": (13, ":00:00"), "day": (10, " 00:00:00"), "month": (7, "-01 00:00:00")}
+
+
+def period_start(ts: str, period: str) -> str:
+    """
+    Returnerer starten på perioden tidspunktet 'ts' ligger i, f.eks. '2024-01-28 00:00:00' for en dag
+    """
+    length, suffix = _PERIOD_PREFIX[period]
+    return ts[:length].replace("T", " ") + suffix
+
+
+def period_end(start: str, period: str) -> str:
+    """
+    Returnerer starten på perioden etter perioden som starter i 'start'
+    """
+    dt = datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
+    if period == "hour":
+        dt += timedelta(hours=1)
+    elif period == "day":
+        dt += timedelta(days=1)
+    else:
+        dt = dt.replace(year=dt.year + dt.month // 12, month=dt.month % 12 + 1)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def consumption(values: array, cumulative: bool, previous: Optional[float] = None) -> array:
+    """
+    Gjør om målerverdier til forbruk per måling.
+    For akkumulerte målere er forbruket differansen til forrige verdi, og en lavere verdi enn forrige
+    tolkes som at måleren er nullstilt (forbruket er da selve verdien). Den første verdien uten en
+    forrige verdi gir 0, siden vi ikke vet når telleren startet.
+    Args:
+        values(array): Målerverdiene i tidsrekkefølge
+        cumulative(bool): True for akkumulert måleravlesning
+        previous(Optional[float]): Siste verdi før 'values', hvis kjent
+    Returns:
+        array: Forbruket for hver måling
+    """
+    if not cumulative:
+        return array("d", values)
+    shifted = array("d", [values[0] if previous is None else previous]) + values[:-1] if values else array("d")
+    return array("d", [v - p if v >= p else v for v, p in zip(values, shifted)])
+
+
+class _MeterCache:
+    """
+    Avsluttede perioder for én måler og periodetype
+    """
+    __slots__ = ("closed", "last", "until", "previous", "dirty")
+
+    def __init__(self) -> None:
+        self.closed: dict[str, float] = {} #periodestart -> kWh
+        self.last: dict[str, float] = {} #periodestart -> siste målerverdi i perioden
+        self.until = "" #Start på første periode som ikke er avsluttet (og ikke cachet)
+        self.previous: Optional[float] = None #Siste målerverdi før 'until'
+        self.dirty: set[str] = set() #Avsluttede perioder som må regnes ut på nytt
+
+
+class EnergyAnalytics:
+    """
+    Energianalyse for målerne i ett hus, bruker repository til huset for å lese målingene
+    """
+
+    def __init__(self, repo, cumulative: bool = False) -> None:
+        """
+        Args:
+            repo(SmartHouseRepository): Repository til huset
+            cumulative(bool): True hvis målerne rapporterer akkumulert måleravlesning
+        """
+        self.repo = repo
+        self.cumulative = cumulative
+        self._cache: dict[tuple[str, str], _MeterCache] = {}
+        self._lock = threading.Lock()
+        repo.reading_listeners.append(lambda sensor, ts, value, unit: self._changed(sensor, ts))
+        repo.late_listeners.append(lambda sensor, ts, value, unit: self._changed(sensor, ts))
+        repo.delete_listeners.append(self._changed)
+
+    def _changed(self, meter: str, ts: str) -> None:
+        """
+        Merker perioden en endret måling ligger i som utdatert, hvis perioden er avsluttet
+        """
+        #Samme format som 'until' (uten 'T' og brøkdeler av sekunder)
+        ts = ts[:19].replace("T", " ")
+        with self._lock:
+            for (m, period), cache in self._cache.items():
+                if m != meter or ts >= cache.until:
+                    continue
+                start = period_start(ts, period)
+                cache.dirty.add(start)
+                if self.cumulative:
+                    #Forbruket i neste periode med målinger regnes fra siste avlesning i denne
+                    later = [s for s in cache.closed if s > start]
+                    if later:
+                        cache.dirty.add(min(later))
+
+    def _recompute(self, meter: str, period: str, cache: _MeterCache) -> None:
+        """
+        Regner ut de utdaterte periodene i cachen på nytt, eldste først, og leser bare målingene i dem
+        """
+        for start in sorted(cache.dirty):
+            rows = self.repo.get_meter_readings(meter, start, period_end(start, period))
+            earlier = [s for s in cache.last if s < start]
+            previous = cache.last[max(earlier)] if earlier else None
+            cache.closed.pop(start, None)
+            cache.last.pop(start, None)
+            if rows:
+                cache.closed[start] = sum(consumption(array("d", (r[1] for r in rows)), self.cumulative, previous))
+                cache.last[start] = rows[-1][1]
+        cache.dirty.clear()
+        cache.previous = cache.last[max(cache.last)] if cache.last else None
+
+    def consumption_by_period(self, meter: str, period: str = "day", from_ts: Optional[str] = None,
+                              until_ts: Optional[str] = None, now: Optional[datetime] = None) -> list[tuple[str, float]]:
+        """
+        Beregner forbruket (kWh) til en måler per time, dag eller måned
+        Args:
+            meter(str): ID til måleren
+            period(str): 'hour', 'day' eller 'month'
+            from_ts(Optional[str]): Ta bare med perioder som starter fra og med dette tidspunktet
+            until_ts(Optional[str]): Ta bare med perioder som starter før dette tidspunktet
+            now(Optional[datetime]): Nåtid, bestemmer hvilke perioder som er avsluttet
+        Returns:
+            list[tuple[str, float]]: (periodestart, kWh) sortert etter tid, bare perioder med målinger
+        """
+        if period not in PERIODS:
+            raise ValueError(f"unknown period: {period}")
+        current = period_start((now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S"), period)
+
+        with self._lock:
+            cache = self._cache.get((meter, period))
+            if cache is None:
+                cache = self._cache[(meter, period)] = _MeterCache()
+            if cache.dirty:
+                self._recompute(meter, period, cache)
+            rows = self.repo.get_meter_readings(meter, cache.until)
+            used = consumption(array("d", (r[1] for r in rows)), self.cumulative, cache.previous)
+
+            totals: dict[str, float] = {}
+            lasts: dict[str, float] = {}
+            for (ts, value), kwh in zip(rows, used):
+                start = period_start(ts, period)
+                totals[start] = totals.get(start, 0.0) + kwh
+                lasts[start] = value
+
+            #Perioder før den vi er i nå er avsluttet og flyttes inn i cachen
+            for start in [s for s in totals if s < current]:
+                cache.closed[start] = cache.closed.get(start, 0.0) + totals.pop(start)
+                cache.last[start] = lasts[start]
+            closed_rows = [r for r in rows if r[0] < current]
+            if closed_rows:
+                cache.previous = closed_rows[-1][1]
+            cache.until = max(cache.until, current)
+            result = dict(cache.closed)
+
+        for start, kwh in totals.items():
+            result[start] = result.get(start, 0.0) + kwh
+        lower = period_start(normalize_timestamp(from_ts), period) if from_ts else None
+        upper = normalize_timestamp(until_ts) if until_ts else None
+        return [(start, result[start]) for start in sorted(result)
+                if (lower is None or start >= lower) and (upper is None or start < upper)]
+
+    def peak_hours(self, meter: str, n: int = 5, from_ts: Optional[str] = None,
+                   until_ts: Optional[str] = None) -> dict:
+        """
+        Finner timene med høyest forbruk, og hvilken time på døgnet som i snitt har høyest forbruk
+        Returns:
+            dict: 'top_hours' med de 'n' timene med høyest forbruk, og 'peak_hour_of_day' (0-23, None uten målinger)
+        """
+        hours = self.consumption_by_period(meter, "hour", from_ts, until_ts)
+        top = sorted(hours, key=lambda h: h[1], reverse=True)[:n]
+        total = [0.0] * 24
+        count = [0] * 24
+        for start, kwh in hours:
+            hour = int(start[11:13])
+            total[hour] += kwh
+            count[hour] += 1
+        averages = [(total[h] / count[h], h) for h in range(24) if count[h]]
+        return {"top_hours": top, "peak_hour_of_day": max(averages)[1] if averages else None}
+
+    def consumption_by_room(self, meters: dict[str, int], from_ts: Optional[str] = None,
+                            until_ts: Optional[str] = None) -> dict[int, float]:
+        """
+        Fordeler forbruket i et tidsrom på rommene målerne står i
+        Args:
+            meters(dict[str, int]): Måler id -> rom id
+        Returns:
+            dict[int, float]: Rom id -> kWh
+        """
+        result: dict[int, float] = {}
+        for meter, room in meters.items():
+            used = sum(kwh for _, kwh in self.consumption_by_period(meter, "hour", from_ts, until_ts))
+            result[room] = result.get(room, 0.0) + used
+        return result
@@ -1,6 +1,714 @@
+import logging
+import re
 import sqlite3
-from typing import Optional
-from smarthouse.domain import Actuator, ActuatorWithSensor, Measurement, Room, Sensor, SmartHouse
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+from smarthouse.aggregates import Aggregate, AggregateCache, RoomAnalyticsCache, group_aggregates
+from smarthouse.automation import Rule, parse_state
+from smarthouse.chunks import chunk_start, decode_chunk, encode_chunk, epoch_to_ts, ts_to_epoch
+from smarthouse.domain import Actuator, ActuatorWithSensor, Measurement, MeasurementSeries, Room, Sensor, SmartHouse, apply_target_state
+from smarthouse.replica import DEFAULT_MAX_AGE, AnalyticsReplica
+from smarthouse.ringbuffer import RecentReadings
+from smarthouse.snapshot import DatabaseStamp, Snapshot, read_file_header, read_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+#Regulære uttrykk som brukes for å redusere en SQL tekst til sin 'form' (statement shape),
+#slik at spørringer som kun skiller seg i literaler telles sammen i statistikken
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(sql: str) -> str:
+    """
+    Funksjonen normaliserer en SQL tekst til formen dens: literaler byttes ut med '?'
+    og all whitespace slås sammen til ett mellomrom.
+    Args:
+        sql(str): SQL teksten som skal normaliseres
+    Returns:
+        str: Den normaliserte formen av spørringen
+    """
+    shape = _STRING_LITERAL.sub("?", sql)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    return _WHITESPACE.sub(" ", shape).strip().rstrip(";").strip()
+
+
+class QueryStats:
+    """
+    Klassen holder på statistikk for én spørringsform:
+    antall kjøringer, total og maksimal tid (sekunder) og antall rader returnert
+    """
+
+    def __init__(self, shape: str) -> None:
+        self.shape = shape
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.slow_count = 0
+        self.last_plan: list[str] | None = None #Siste 'EXPLAIN QUERY PLAN' for en treg kjøring
+
+    def record(self, duration: float, rows: int) -> None:
+        self.count += 1
+        self.total_time += duration
+        self.rows += rows
+        if duration > self.max_time:
+            self.max_time = duration
+
+    def as_dict(self) -> dict:
+        return {
+            "shape": self.shape,
+            "count": self.count,
+            "total_time": self.total_time,
+            "avg_time": self.total_time / self.count if self.count else 0.0,
+            "max_time": self.max_time,
+            "rows": self.rows,
+            "slow_count": self.slow_count,
+            "last_plan": self.last_plan,
+        }
+
+
+#Maks antall SQL tekster med ferdig beregnet form. Spørringene i 'STATEMENTS' er faste, så dette
+#fylles bare opp hvis 'execute' kalles med mange forskjellige tekster, da tømmes cachen
+_SHAPE_CACHE_SIZE = 1024
+
+
+class QueryStatistics:
+    """
+    Samler 'QueryStats' per spørringsform for alle spørringer som går gjennom repository klassen.
+    Formen til hver SQL tekst regnes bare ut én gang, og tellerne oppdateres under en lås
+    siden flere tråder kan bruke samme repository
+    """
+
+    def __init__(self) -> None:
+        self.by_shape: dict[str, QueryStats] = {}
+        self._shapes: dict[str, str] = {} #SQL tekst -> form
+        self._lock = threading.Lock()
+
+    def get(self, shape: str) -> QueryStats:
+        with self._lock:
+            stats = self.by_shape.get(shape)
+            if stats is None:
+                stats = QueryStats(shape)
+                self.by_shape[shape] = stats
+            return stats
+
+    def record(self, sql: str, duration: float, rows: int, slow: bool) -> QueryStats:
+        """
+        Registrerer én kjøring av 'sql' og returnerer statistikken for formen til spørringen
+        """
+        shape = self._shapes.get(sql)
+        if shape is None:
+            shape = statement_shape(sql)
+            if len(self._shapes) >= _SHAPE_CACHE_SIZE:
+                self._shapes.clear()
+            self._shapes[sql] = shape
+        with self._lock:
+            stats = self.by_shape.get(shape)
+            if stats is None:
+                stats = self.by_shape[shape] = QueryStats(shape)
+            stats.record(duration, rows)
+            if slow:
+                stats.slow_count += 1
+            return stats
+
+    def report(self) -> list[dict]:
+        """
+        Returnerer statistikken som en liste med ordbøker, sortert etter total tid (dyreste først)
+        """
+        with self._lock:
+            stats = sorted(self.by_shape.values(), key=lambda s: s.total_time, reverse=True)
+            return [s.as_dict() for s in stats]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.by_shape.clear()
+
+
+class LatenessStats:
+    """
+    Teller målinger som kommer for sent, dvs. med tidsstempel før den nyeste målingen til sensoren
+    (vannmerket). Forsinkelsen er hvor mange sekunder målingen ligger bak vannmerket
+    """
+
+    def __init__(self) -> None:
+        self._by_sensor: dict[str, list] = {} #sensor -> [antall, total forsinkelse, maks forsinkelse]
+        self._lock = threading.Lock()
+
+    def record(self, sensor: str, lag: float) -> None:
+        with self._lock:
+            stats = self._by_sensor.get(sensor)
+            if stats is None:
+                stats = self._by_sensor[sensor] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += lag
+            stats[2] = max(stats[2], lag)
+
+    def get(self, sensor: str) -> dict:
+        with self._lock:
+            count, total, high = self._by_sensor.get(sensor, (0, 0.0, 0.0))
+        return {"late": count, "avg_lag": total / count if count else 0.0, "max_lag": high}
+
+    def report(self) -> dict[str, dict]:
+        with self._lock:
+            sensors = list(self._by_sensor)
+        return {sensor: self.get(sensor) for sensor in sensors}
+
+
+#Register med faste, parametriserte SQL tekster per operasjon. Siden teksten aldri endres
+#kan sqlite3 gjenbruke den kompilerte spørringen fra 'statement cache' til tilkoblingen,
+#i stedet for å parse spørringen på nytt for hver id (og det hindrer SQL injection)
+STATEMENTS: dict[str, str] = {
+    "max_floor": "SELECT MAX(floor) FROM rooms",
+    "all_rooms": "SELECT id, floor, area, name FROM rooms",
+    "all_devices": "SELECT id, room, kind, category, supplier, product, key FROM devices",
+    "all_states": "SELECT d.id, s.state FROM states s INNER JOIN devices d ON d.key = s.device",
+    #Oppslag mellom id (UUID) og heltallsnøkkel for enheter, og mellom enhet og nøkkel for måleenheter
+    "device_keys": "SELECT key, id FROM devices",
+    "device_key": "SELECT key FROM devices WHERE id = ?",
+    "device_id": "SELECT id FROM devices WHERE key = ?",
+    "all_units": "SELECT key, unit FROM units",
+    "unit_key": "SELECT key FROM units WHERE unit = ?",
+    "insert_unit": "INSERT INTO units (unit) VALUES (?) ON CONFLICT (unit) DO UPDATE SET unit = excluded.unit RETURNING key",
+    "topology_fingerprint": """
+SELECT (SELECT COUNT(*) FROM rooms), (SELECT COALESCE(MAX(rowid), 0) FROM rooms),
+       (SELECT COUNT(*) FROM devices), (SELECT COALESCE(MAX(rowid), 0) FROM devices)
+""",
+    "max_measurement_rowid": "SELECT COALESCE(MAX(rowid), 0) FROM measurements",
+    #De 'n' nyeste målingene per sensor, nyeste først. Brukes til å fylle ringbufferne og cachen med siste måling
+    "recent_readings": """
+SELECT device, ts, value, unit FROM (
+    SELECT m.device, m.ts, m.value, u.unit, ROW_NUMBER() OVER (PARTITION BY m.device ORDER BY datetime(m.ts) DESC) AS rn
+    FROM measurements m
+    LEFT JOIN units u ON u.key = m.unit)
+WHERE rn <= ?
+ORDER BY device, rn
+""",
+    "data_version": "PRAGMA data_version",
+    #Loggen over slettede målinger, slik at andre prosesser kan rydde i cachene sine (se '_catch_up_deletes')
+    "log_delete": "INSERT INTO measurement_deletes (device, ts, unit) VALUES (?, ?, ?) RETURNING seq",
+    "prune_deletes": "DELETE FROM measurement_deletes WHERE seq <= (SELECT MAX(seq) FROM measurement_deletes) - ?",
+    "delete_log_bounds": "SELECT COALESCE(MIN(seq), 0), COALESCE(MAX(seq), 0) FROM measurement_deletes",
+    "deletes_since": """
+SELECT l.seq, l.device, l.ts, u.unit
+FROM measurement_deletes l
+LEFT JOIN units u ON u.key = l.unit
+WHERE l.seq > ?
+ORDER BY l.seq
+""",
+    "readings_since_rowid": """
+SELECT m.rowid, m.device, m.ts, m.value, u.unit
+FROM measurements m
+LEFT JOIN units u ON u.key = m.unit
+WHERE m.rowid > ?
+ORDER BY m.rowid
+""",
+    "readings": """
+SELECT m.ts, m.value, u.unit
+FROM measurements m
+LEFT JOIN units u ON u.key = m.unit
+WHERE m.device = ?
+ORDER BY datetime(m.ts) DESC
+""",
+    "readings_limit": """
+SELECT m.ts, m.value, u.unit
+FROM measurements m
+LEFT JOIN units u ON u.key = m.unit
+WHERE m.device = ?
+ORDER BY datetime(m.ts) DESC
+LIMIT ?
+""",
+    "window_stats": """
+SELECT COUNT(*), AVG(value), MIN(value), MAX(value) FROM (
+    SELECT value FROM measurements WHERE device = ? ORDER BY datetime(ts) DESC LIMIT ?)
+""",
+    #Tidsstempler med 'T' sorteres etter de med mellomrom samme døgn, så 'ts >= :since' tar med alle radene
+    #'datetime(ts) >= :since' gjelder (og bruker indeksen), og 'datetime(ts)' gir det eksakte utvalget og formatet
+    "meter_readings_since": """
+SELECT datetime(ts), value FROM measurements
+WHERE device = :device AND ts >= :since AND datetime(ts) >= :since
+ORDER BY datetime(ts), rowid
+""",
+    #Som 'meter_readings_since', men bare før ':until' (en periode som regnes ut på nytt)
+    "meter_readings_between": """
+SELECT datetime(ts), value FROM measurements
+WHERE device = :device AND ts >= :since AND datetime(ts) >= :since AND datetime(ts) < :until
+ORDER BY datetime(ts), rowid
+""",
+    #Målinger som kan pakkes i komprimerte biter: eldre enn ':cutoff', men ikke de ':keep' nyeste per sensor
+    "compactable_readings": """
+SELECT id, device, ts, value, unit FROM (
+    SELECT rowid AS id, device, ts, value, unit,
+           ROW_NUMBER() OVER (PARTITION BY device ORDER BY datetime(ts) DESC) AS rn
+    FROM measurements)
+WHERE rn > :keep AND ts < :cutoff
+ORDER BY device, ts, id
+""",
+    "delete_measurement_rowid": "DELETE FROM measurements WHERE rowid = ?",
+    "chunk": "SELECT count, data FROM measurement_chunks WHERE device = ? AND chunk_start = ? AND unit IS ?",
+    "delete_chunk": "DELETE FROM measurement_chunks WHERE device = ? AND chunk_start = ? AND unit IS ?",
+    "insert_chunk": """
+INSERT INTO measurement_chunks (device, chunk_start, unit, first_ts, last_ts, count, total, min, max, data)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+""",
+    "chunk_bounds": "SELECT COUNT(*), MIN(first_ts), MAX(last_ts) FROM measurement_chunks WHERE device = ?",
+    "chunked_devices": "SELECT DISTINCT device FROM measurement_chunks",
+    "device_chunks": """
+SELECT c.chunk_start, u.unit, c.count, c.data, c.last_ts
+FROM measurement_chunks c
+LEFT JOIN units u ON u.key = c.unit
+WHERE c.device = :device AND c.last_ts >= :lower AND c.first_ts < :upper
+ORDER BY c.chunk_start DESC
+""",
+    "oldest_chunk": """
+SELECT c.chunk_start, c.unit, u.unit, c.count, c.data, c.first_ts
+FROM measurement_chunks c
+LEFT JOIN units u ON u.key = c.unit
+WHERE c.device = ?
+ORDER BY c.first_ts
+LIMIT 1
+""",
+    "oldest_reading": """
+SELECT m.ts, m.value, u.unit
+FROM measurements m
+LEFT JOIN units u ON u.key = m.unit
+WHERE m.device = ?
+ORDER BY datetime(m.ts) ASC
+LIMIT 1
+""",
+    "delete_reading": "DELETE FROM measurements WHERE device = ? AND ts = ?",
+    #Idempotent: en måling med samme (device, ts) som en lagret måling (f.eks. et nytt forsøk fra en klient) lagres ikke
+    "insert_measurement": """
+INSERT INTO measurements (device, ts, value, unit, seq) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (device, ts) DO NOTHING
+RETURNING rowid
+""",
+    "measurement_at": """
+SELECT m.rowid, m.seq, m.unit, u.unit
+FROM measurements m
+LEFT JOIN units u ON u.key = m.unit
+WHERE m.device = ? AND m.ts = ?
+""",
+    "latest_reading": """
+SELECT m.ts, m.value, u.unit
+FROM measurements m
+LEFT JOIN units u ON u.key = m.unit
+WHERE m.device = ?
+ORDER BY m.ts DESC
+LIMIT 1
+""",
+    "update_state": "UPDATE states SET state = ? WHERE device = ?",
+    #Logger endringen med gammel verdi fra states, må kjøres før 'update_state'. Uendret tilstand logges ikke
+    "log_state_change": """
+INSERT INTO actuator_events (device, ts, old, new, source)
+SELECT device, :ts, state, :new, :source FROM states
+WHERE device = :device AND state IS NOT :new
+""",
+    #Tilstandsendringer logget etter en gitt rowid, gir versjonen til aktuatorene (se 'state_version')
+    "state_events_since": "SELECT rowid, device FROM actuator_events WHERE rowid > ? ORDER BY rowid",
+    #Siste endring per aktuator, for å sette versjonene uten å lese hele loggen
+    "state_versions": "SELECT device, MAX(rowid) FROM actuator_events GROUP BY device",
+    "state_timeline": """
+SELECT ts, old, new, source
+FROM actuator_events
+WHERE device = :device AND ts >= :lower AND ts < :upper
+ORDER BY ts
+""",
+    #Tid påslått per periode: tilstanden ved starten av tidsrommet (siste endring før, eller 'old' til første
+    #endring i tidsrommet, eller nåværende tilstand) og endringene i tidsrommet gir segmenter med lik tilstand,
+    #som så fordeles på periodene. Av (NULL) lagres som 0 her slik at COALESCE skiller 'av' fra 'ingen rad'
+    "duty_cycle": """
+WITH RECURSIVE
+periods(start, stop) AS (
+    SELECT :lower, MIN(DATETIME(:lower, :step), :upper)
+    UNION ALL
+    SELECT stop, MIN(DATETIME(stop, :step), :upper) FROM periods WHERE stop < :upper
+),
+changes(ts, state) AS (
+    SELECT :lower, COALESCE(
+        (SELECT IFNULL(new, 0) FROM actuator_events WHERE device = :device AND ts < :lower ORDER BY ts DESC LIMIT 1),
+        (SELECT IFNULL(old, 0) FROM actuator_events WHERE device = :device AND ts >= :lower ORDER BY ts LIMIT 1),
+        (SELECT IFNULL(state, 0) FROM states WHERE device = :device),
+        0)
+    UNION ALL
+    SELECT ts, IFNULL(new, 0) FROM actuator_events WHERE device = :device AND ts >= :lower AND ts < :upper
+),
+segments(start, stop, state) AS (
+    SELECT ts, LEAD(ts, 1, :upper) OVER (ORDER BY ts), state FROM changes
+)
+SELECT p.start, p.stop,
+       ROUND(SUM(CASE WHEN s.state != 0
+                 THEN (JULIANDAY(MIN(s.stop, p.stop)) - JULIANDAY(MAX(s.start, p.start))) * 86400
+                 ELSE 0 END)) AS on_seconds
+FROM periods p
+INNER JOIN segments s ON s.start < p.stop AND s.stop > p.start
+GROUP BY p.start, p.stop
+ORDER BY p.start
+""",
+    "all_rules": """
+SELECT r.id, s.id, r.aggregate, r.window_size, r.operator, r.threshold, a.id, r.state, r.else_state
+FROM automation_rules r
+INNER JOIN devices s ON s.key = r.sensor
+INNER JOIN devices a ON a.key = r.actuator
+ORDER BY r.id
+""",
+    "insert_rule": """
+INSERT INTO automation_rules (sensor, aggregate, window_size, operator, threshold, actuator, state, else_state)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+RETURNING id
+""",
+    "delete_rule": "DELETE FROM automation_rules WHERE id = ? RETURNING id",
+    #Aggregater per rom for én enhet, etasje og hus regnes ut fra disse radene (se 'group_aggregates')
+    "unit_aggregates": """
+SELECT d.room, r.floor, COUNT(*), SUM(m.value), MIN(m.value), MAX(m.value)
+FROM measurements m
+INNER JOIN devices d ON d.key = m.device
+INNER JOIN rooms r ON r.id = d.room
+WHERE m.unit = :unit
+AND (:lower IS NULL OR datetime(m.ts) >= :lower)
+AND (:upper IS NULL OR datetime(m.ts) < :upper)
+GROUP BY d.room, r.floor
+""",
+    #Samme rader for komprimerte biter som ligger helt innenfor tidsrommet, fra oppsummeringen til biten
+    "chunk_aggregates": """
+SELECT d.room, r.floor, SUM(c.count), SUM(c.total), MIN(c.min), MAX(c.max)
+FROM measurement_chunks c
+INNER JOIN devices d ON d.key = c.device
+INNER JOIN rooms r ON r.id = d.room
+WHERE c.unit = :unit
+AND (:lower IS NULL OR c.first_ts >= :lower)
+AND (:upper IS NULL OR c.last_ts < :upper)
+GROUP BY d.room, r.floor
+""",
+    #Biter som bare delvis ligger innenfor tidsrommet, disse må dekodes
+    "partial_chunk_aggregates": """
+SELECT d.room, r.floor, c.chunk_start, c.count, c.data
+FROM measurement_chunks c
+INNER JOIN devices d ON d.key = c.device
+INNER JOIN rooms r ON r.id = d.room
+WHERE c.unit = :unit
+AND (:lower IS NULL OR c.last_ts >= :lower)
+AND (:upper IS NULL OR c.first_ts < :upper)
+AND NOT ((:lower IS NULL OR c.first_ts >= :lower) AND (:upper IS NULL OR c.last_ts < :upper))
+""",
+    #En bit dekker ett døgn, og grensene er hele døgn, så en bit er enten helt med eller ikke med
+    "avg_temperatures": """
+SELECT day, CAST(SUM(total) AS REAL) / SUM(n) FROM (
+    SELECT STRFTIME('%Y-%m-%d', DATETIME(ts)) AS day, SUM(value) AS total, COUNT(*) AS n
+    FROM devices d
+    INNER JOIN measurements m ON m.device = d.key
+    WHERE d.room = :room AND m.unit = (SELECT key FROM units WHERE unit = '°C')
+    AND (:lower IS NULL OR ts >= :lower)
+    AND (:upper IS NULL OR ts <= :upper)
+    GROUP BY STRFTIME('%Y-%m-%d', DATETIME(ts))
+    UNION ALL
+    SELECT SUBSTR(c.first_ts, 1, 10), c.total, c.count
+    FROM devices d
+    INNER JOIN measurement_chunks c ON c.device = d.key
+    WHERE d.room = :room AND c.unit = (SELECT key FROM units WHERE unit = '°C')
+    AND (:lower IS NULL OR c.first_ts >= :lower)
+    AND (:upper IS NULL OR c.last_ts <= :upper))
+GROUP BY day
+""",
+    "humidity_hours": """
+SELECT STRFTIME('%H', DATETIME(m.ts)) AS hours
+FROM measurements m
+INNER JOIN devices d ON m.device = d.key
+WHERE d.room = :room
+AND m.unit = (SELECT key FROM units WHERE unit = '%')
+AND DATE(m.ts) = DATE(:date)
+AND m.value > (
+    SELECT AVG(value)
+    FROM measurements m
+    INNER JOIN devices d ON d.key = m.device
+    WHERE d.room = :room AND DATE(ts) = DATE(:date))
+GROUP BY hours
+HAVING COUNT(m.value) > 3
+""",
+    "room_chunks_on_day": """
+SELECT c.chunk_start, u.unit, c.count, c.data
+FROM measurement_chunks c
+INNER JOIN devices d ON d.key = c.device
+LEFT JOIN units u ON u.key = c.unit
+WHERE d.room = :room AND c.chunk_start = :start
+""",
+    "room_readings_on_date": """
+SELECT m.ts, m.value, u.unit
+FROM measurements m
+INNER JOIN devices d ON d.key = m.device
+LEFT JOIN units u ON u.key = m.unit
+WHERE d.room = :room AND DATE(m.ts) = DATE(:date)
+""",
+}
+
+#Kostnadsklassen 'analyse': spørringer som leser hele historikken eller mange sensorer, og som sorterer eller
+#grupperer store mengder rader. Med en lesekopi ('replica_file') kjører disse på kopien (se 'AnalyticsReplica'),
+#mens alle andre spørringer, og alt som skriver, går til databasen
+ANALYTICS_STATEMENTS = frozenset({
+    "readings", "avg_temperatures", "humidity_hours", "room_readings_on_date",
+    "unit_aggregates", "chunk_aggregates", "partial_chunk_aggregates", "state_timeline", "duty_cycle",
+})
+
+#Tabeller og indekser som ikke finnes i den opprinnelige databasen, opprettes ved oppstart hvis de mangler.
+#actuator_events er en logg (kun innsetting) over tilstandsendringer. Indeksen på (device, ts) gjør at
+#spørringer for én aktuator i et tidsrom bare leser de aktuelle radene og ikke hele loggen.
+#measurement_chunks holder eldre målinger komprimert, ett døgn per sensor og enhet (se 'compact_measurements'),
+#med antall, sum, min og maks slik at aggregater for hele biter ikke trenger å dekode dem.
+#Enheter og måleenheter lagres som heltallsnøkler i alle tabellene (se 'MIGRATE_SURROGATE_KEYS').
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actuator_events (
+	device INTEGER NOT NULL,
+	ts TEXT NOT NULL,
+	old REAL,
+	new REAL,
+	source TEXT NULL,
+	CONSTRAINT actuator_events_devices_FK FOREIGN KEY (device) REFERENCES devices(key)
+);
+CREATE INDEX IF NOT EXISTS actuator_events_device_ts ON actuator_events (device, ts);
+CREATE UNIQUE INDEX IF NOT EXISTS measurements_device_ts ON measurements (device, ts);
+CREATE TABLE IF NOT EXISTS automation_rules (
+	id INTEGER PRIMARY KEY,
+	sensor INTEGER NOT NULL,
+	aggregate TEXT NOT NULL,
+	window_size INT NOT NULL,
+	operator TEXT NOT NULL,
+	threshold REAL NOT NULL,
+	actuator INTEGER NOT NULL,
+	state TEXT NOT NULL,
+	else_state TEXT NULL,
+	CONSTRAINT automation_rules_sensor_FK FOREIGN KEY (sensor) REFERENCES devices(key),
+	CONSTRAINT automation_rules_actuator_FK FOREIGN KEY (actuator) REFERENCES devices(key)
+);
+CREATE TABLE IF NOT EXISTS units (
+	key INTEGER PRIMARY KEY,
+	unit TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS measurement_chunks (
+	device INTEGER NOT NULL,
+	chunk_start INTEGER NOT NULL,
+	unit INTEGER NULL,
+	first_ts TEXT NOT NULL,
+	last_ts TEXT NOT NULL,
+	count INTEGER NOT NULL,
+	total REAL NOT NULL,
+	min REAL NOT NULL,
+	max REAL NOT NULL,
+	data BLOB NOT NULL,
+	CONSTRAINT measurement_chunks_devices_FK FOREIGN KEY (device) REFERENCES devices(key),
+	CONSTRAINT measurement_chunks_units_FK FOREIGN KEY (unit) REFERENCES units(key)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS measurement_chunks_device_start ON measurement_chunks (device, chunk_start, unit);
+CREATE TABLE IF NOT EXISTS measurement_deletes (
+	seq INTEGER PRIMARY KEY AUTOINCREMENT,
+	device INTEGER NOT NULL,
+	ts TEXT NOT NULL,
+	unit INTEGER NULL
+);
+"""
+
+#Migrering fra den opprinnelige databasen, der hver måling og tilstand lagret hele id-en (UUID) til enheten
+#og enheten som tekst. Enhetene får en heltallsnøkkel 'key', og måleenhetene en egen tabell 'units', slik at
+#en rad i measurements og indeksen på (device, ts) bare lagrer små heltall. Tabellene bygges på nytt
+#(SQLite kan ikke endre kolonnetyper) og beholder rowid til målingene. Id-ene brukes fortsatt utad.
+MIGRATE_SURROGATE_KEYS = """
+CREATE TABLE devices_new (
+	key INTEGER PRIMARY KEY,
+	id TEXT NOT NULL UNIQUE,
+	room INT NOT NULL,
+	kind TEXT NOT NULL,
+	category TEXT NOT NULL,
+	supplier TEXT NULL,
+	product TEXT NULL,
+	FOREIGN KEY (room) REFERENCES rooms(id)
+);
+INSERT INTO devices_new (id, room, kind, category, supplier, product)
+SELECT id, room, kind, category, supplier, product FROM devices ORDER BY rowid;
+CREATE TABLE IF NOT EXISTS units (
+	key INTEGER PRIMARY KEY,
+	unit TEXT NOT NULL UNIQUE
+);
+INSERT OR IGNORE INTO units (unit) SELECT DISTINCT unit FROM measurements WHERE unit IS NOT NULL;
+CREATE TABLE measurements_new (
+	device INTEGER NOT NULL,
+	ts TEXT NOT NULL,
+	value REAL NOT NULL,
+	unit INTEGER NULL,
+	seq INTEGER NULL,
+	FOREIGN KEY (device) REFERENCES devices(key),
+	FOREIGN KEY (unit) REFERENCES units(key)
+);
+INSERT INTO measurements_new (rowid, device, ts, value, unit)
+SELECT m.rowid, d.key, m.ts, m.value, u.key
+FROM measurements m
+INNER JOIN devices_new d ON d.id = m.device
+LEFT JOIN units u ON u.unit = m.unit
+WHERE m.rowid IN (SELECT MIN(rowid) FROM measurements GROUP BY device, ts)
+ORDER BY m.rowid;
+CREATE TABLE states_new (
+	device INTEGER NOT NULL,
+	state REAL,
+	CONSTRAINT states_pk PRIMARY KEY (device),
+	CONSTRAINT states_devices_FK FOREIGN KEY (device) REFERENCES devices(key)
+);
+INSERT INTO states_new (device, state)
+SELECT d.key, s.state FROM states s INNER JOIN devices_new d ON d.id = s.device;
+DROP TABLE states;
+DROP TABLE measurements;
+DROP TABLE devices;
+ALTER TABLE devices_new RENAME TO devices;
+ALTER TABLE measurements_new RENAME TO measurements;
+ALTER TABLE states_new RENAME TO states;
+"""
+
+#Tabellene fra 'SCHEMA' som fantes før migreringen har også id og enhet som tekst. De flyttes unna før
+#migreringen (med indeksene, så 'SCHEMA' kan lage dem på nytt), og radene kopieres inn i de nye tabellene etterpå
+MIGRATE_OWN_TABLES: dict[str, tuple[str, str]] = {
+    "actuator_events": ("""
+DROP INDEX IF EXISTS actuator_events_device_ts;
+ALTER TABLE actuator_events RENAME TO actuator_events_old;
+""", """
+INSERT INTO actuator_events (device, ts, old, new, source)
+SELECT d.key, e.ts, e.old, e.new, e.source
+FROM actuator_events_old e
+INNER JOIN devices d ON d.id = e.device
+ORDER BY e.rowid;
+DROP TABLE actuator_events_old;
+"""),
+    "automation_rules": ("""
+ALTER TABLE automation_rules RENAME TO automation_rules_old;
+""", """
+INSERT INTO automation_rules (id, sensor, aggregate, window_size, operator, threshold, actuator, state, else_state)
+SELECT r.id, s.key, r.aggregate, r.window_size, r.operator, r.threshold, a.key, r.state, r.else_state
+FROM automation_rules_old r
+INNER JOIN devices s ON s.id = r.sensor
+INNER JOIN devices a ON a.id = r.actuator;
+DROP TABLE automation_rules_old;
+"""),
+    "measurement_chunks": ("""
+DROP INDEX IF EXISTS measurement_chunks_device_start;
+ALTER TABLE measurement_chunks RENAME TO measurement_chunks_old;
+""", """
+INSERT OR IGNORE INTO units (unit) SELECT DISTINCT unit FROM measurement_chunks_old WHERE unit IS NOT NULL;
+INSERT INTO measurement_chunks (device, chunk_start, unit, first_ts, last_ts, count, total, min, max, data)
+SELECT d.key, c.chunk_start, u.key, c.first_ts, c.last_ts, c.count, c.total, c.min, c.max, c.data
+FROM measurement_chunks_old c
+INNER JOIN devices d ON d.id = c.device
+LEFT JOIN units u ON u.unit = c.unit;
+DROP TABLE measurement_chunks_old;
+"""),
+}
+
+#Migrering til idempotent lagring av målinger: kolonnen 'seq' (sekvensnummer fra klienten) og en unik indeks
+#på (device, ts). Like målinger som allerede er lagret flere ganger fjernes, den første beholdes
+MIGRATE_UNIQUE_READINGS = """
+DELETE FROM measurements WHERE rowid NOT IN (SELECT MIN(rowid) FROM measurements GROUP BY device, ts);
+DROP INDEX IF EXISTS measurements_device_ts;
+CREATE UNIQUE INDEX measurements_device_ts ON measurements (device, ts);
+"""
+
+#Standard antall målinger per sensor i ringbufferne, og maks antall sensorer med ringbuffer
+DEFAULT_RING_CAPACITY = 256
+DEFAULT_MAX_RING_SENSORS = 4096
+
+#Standard størrelse på sqlite3 sin statement cache per tilkobling
+DEFAULT_STATEMENT_CACHE_SIZE = 128
+
+#Antall slettinger som beholdes i 'measurement_deletes'. En prosess som henger lenger etter enn dette
+#forkaster alle ringbufferne i stedet for å rydde per sensor
+DELETE_LOG_SIZE = 10000
+
+#Standard ventetid (sekunder) før snapshot skrives etter en endring, endringer i mellomtiden samles i én skriving
+DEFAULT_SNAPSHOT_DELAY = 1.0
+
+
+#Tidsformatet som brukes i databasen, f.eks. '2024-01-28 14:00:00'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#Periodene 'calc_duty_cycle' kan dele opp i, med tilhørende modifikator til SQLite sin DATETIME
+DUTY_CYCLE_PERIODS = {"hour": "+1 hour", "day": "+1 day"}
+
+
+def _ts_key(ts: str) -> str:
+    """
+    Sorteringsnøkkel for et tidsstempel, som 'datetime(ts)' i spørringene (uten 'T' og brøkdeler av sekunder)
+    """
+    return ts[:19].replace("T", " ")
+
+
+def normalize_timestamp(ts: str) -> str:
+    """
+    Gjør om et tidspunkt i ISO format (f.eks. '2024-01-28T14:00' eller '2024-01-28') til formatet
+    i databasen, slik at tidspunkter kan sammenlignes som tekst
+    """
+    return datetime.fromisoformat(ts).strftime(TIMESTAMP_FORMAT)
+
+
+#Navnene på tabellene og indeksene i 'SCHEMA', en database uten alle disse må migreres
+SCHEMA_OBJECTS = frozenset(re.findall(r"CREATE (?:UNIQUE )?(?:TABLE|INDEX) IF NOT EXISTS (\w+)", SCHEMA))
+
+
+class MigrationRequired(RuntimeError):
+    """
+    Kastes når databasen har et eldre skjema og repository ikke har fått lov til å migrere den ('migrate')
+    """
+
+
+def migrate_database(file: str) -> None:
+    """
+    Migrerer databasen i 'file' til skjemaet klassen bruker, gjør ingenting hvis den allerede er migrert.
+    Kan også kjøres fra kommandolinjen: 'python -m smarthouse.persistence <fil>'
+    """
+    repo = SmartHouseRepository(file, migrate=True)
+    repo.conn.close()
+
+
+class StatementRegistry:
+    """
+    Klassen slår opp den faste SQL teksten for en operasjon og teller hvor mange ganger operasjonen er brukt
+    første gang og senere ganger siden tilkoblingen ble åpnet. Tellerne er ikke treff og bom i statement cache,
+    som sqlite3 ikke viser fram: cachen er minst like stor som 'STATEMENTS', så en senere bruk gjenbruker
+    normalt den kompilerte spørringen, men det er ikke målt. Operasjoner som kjøres på lesekopien telles også her
+    """
+
+    def __init__(self, statements: dict[str, str]) -> None:
+        self.statements = statements
+        self.first_uses: dict[str, int] = {}
+        self.repeat_uses: dict[str, int] = {}
+        self._prepared: set[str] = set() #Operasjoner som allerede er brukt på nåværende tilkobling
+        #Forespørslene, automatiseringen og oppvarmingen bruker samme repository fra hver sin tråd
+        self._lock = threading.Lock()
+
+    def sql(self, op: str) -> str:
+        """
+        Returnerer SQL teksten til operasjonen 'op' og oppdaterer tellerne
+        """
+        sql = self.statements[op]
+        with self._lock:
+            if op in self._prepared:
+                self.repeat_uses[op] = self.repeat_uses.get(op, 0) + 1
+            else:
+                self._prepared.add(op)
+                self.first_uses[op] = self.first_uses.get(op, 0) + 1
+        return sql
+
+    def connection_reset(self) -> None:
+        """
+        Kalles når tilkoblingen byttes ut, siden statement cache hører til tilkoblingen
+        """
+        with self._lock:
+            self._prepared.clear()
+
+    def usage(self) -> dict[str, dict[str, int]]:
+        """
+        Returnerer antall første og senere bruk per operasjon ('first_uses' og 'repeat_uses')
+        """
+        with self._lock:
+            return {op: {"first_uses": self.first_uses.get(op, 0), "repeat_uses": self.repeat_uses.get(op, 0)}
+                    for op in self.statements if op in self.first_uses}
+
 
 class SmartHouseRepository:
     """
@@ -8,35 +716,329 @@ class SmartHouseRepository:
     fra en SQLite database
     """
 
-    def __init__(self, file: str) -> None:
+    def __init__(self, file: str, slow_query_threshold: Optional[float] = None, explain_slow_queries: bool = False,
+                 statement_cache_size: int = DEFAULT_STATEMENT_CACHE_SIZE, snapshot_file: Optional[str] = None,
+                 ring_capacity: int = DEFAULT_RING_CAPACITY, max_ring_sensors: int = DEFAULT_MAX_RING_SENSORS,
+                 snapshot_delay: float = DEFAULT_SNAPSHOT_DELAY, replica_file: Optional[str] = None,
+                 replica_max_age: float = DEFAULT_MAX_AGE, migrate: bool = False) -> None:
         """
         Konstruktør for 'SmartHouse' klassen som initialiserer en ny instans av klassen
         Metoden tar imot et filnavn som parameter og oppretter en tilkobling til SQLite databasen
         som ligger i den angitte filen. Dette setter opp grunnlaget for videre Database manipulasjoner
+        Args:
+            file(str): Stien til databasefilen
+            slow_query_threshold(Optional[float]): Spørringer som bruker lengre tid enn dette (sekunder) logges som trege
+            explain_slow_queries(bool): Hvis True hentes 'EXPLAIN QUERY PLAN' for trege spørringer
+            statement_cache_size(int): Antall kompilerte spørringer sqlite3 holder på per tilkobling,
+                                       aldri færre enn antall operasjoner i 'STATEMENTS'
+            snapshot_file(Optional[str]): Fil for binært snapshot av huset, brukes av 'load_smarthouse'
+            ring_capacity(int): Antall nyeste målinger per sensor som holdes i minnet
+            max_ring_sensors(int): Maks antall sensorer med målinger i minnet, setter en øvre grense for minnebruken
+            snapshot_delay(float): Sekunder fra en endring av aktuatortilstand til snapshot skrives i bakgrunnen,
+                                   0 skriver snapshot med en gang
+            replica_file(Optional[str]): Fil for en lesekopi av databasen (':memory:' for en kopi i minnet) som
+                                         spørringene i 'ANALYTICS_STATEMENTS' kjøres på, ingen kopi hvis None
+            replica_max_age(float): Sekunder lesekopien kan henge etter databasen, se 'AnalyticsReplica'
+            migrate(bool): Hvis True migreres en database med eldre skjema. Ellers endres ikke filen
+                           av å bli åpnet, og en database som må migreres gir 'MigrationRequired'
+        Raises:
+            MigrationRequired: hvis databasen må migreres og 'migrate' ikke er satt
         """
         self.file = file #Lagrer filstien som en attributt i klassen
-
-        self.conn = sqlite3.connect(file, check_same_thread=False)
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self.stats = QueryStatistics()
+        self.statements = StatementRegistry(STATEMENTS)
+        self.statement_cache_size = max(statement_cache_size, len(STATEMENTS))
+        self.snapshot_file = snapshot_file
+        self.snapshot_delay = snapshot_delay
+        #Låsen sørger for at bare én tråd skriver snapshot om gangen, og at et eldre snapshot aldri erstatter et nyere
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_timer: Optional[threading.Timer] = None
+
+        #Huset som sist ble lastet med 'load_smarthouse', og cache med siste måling per sensor
+        #(sensor id -> (ts, value, unit)). Cachen er None til huset er lastet på denne måten.
+        self.house: Optional[SmartHouse] = None
+        self._latest: Optional[dict[str, tuple]] = None
+        self._measurement_rowid = 0 #Største rowid i measurements som er tatt med i '_latest'
+        self._data_version: Optional[int] = None #Siste 'PRAGMA data_version' sett av 'sync_with_database'
+        self._sync_lock = threading.RLock()
+        #Rowid til målinger satt inn av denne tilkoblingen som ennå ikke er passert av '_measurement_rowid'
+        self._own_rowids: set[int] = set()
+        #Største 'seq' i measurement_deletes som er tatt med, og slettinger gjort av denne tilkoblingen
+        #som ennå ikke er passert av '_delete_seq'
+        self._delete_seq = 0
+        self._own_deletes: set[int] = set()
+        #Funksjoner som kalles med (sensor, ts, value, unit) for hver ny måling, både fra denne
+        #prosessen og fra andre prosesser (oppdaget av 'sync_with_database')
+        self.reading_listeners: list[Callable[[str, str, float, Optional[str]], None]] = []
+        #Som 'reading_listeners', men for målinger som kommer for sent (eldre enn den nyeste målingen til
+        #sensoren). De endrer ikke nåverdien, så de går hit i stedet, f.eks. for å rette opp cachede perioder
+        self.late_listeners: list[Callable[[str, str, float, Optional[str]], None]] = []
+        self.lateness = LatenessStats()
+        #Funksjoner som kalles med (sensor, ts) når en måling slettes
+        self.delete_listeners: list[Callable[[str, str], None]] = []
+        #Versjonen til tilstanden per aktuator er rowid til siste endring i actuator_events. Loggen er bare
+        #innsetting, så versjonen øker ved hver endring og er den samme i alle prosessene som deler databasen
+        self._state_versions: dict[str, int] = {}
+        self._state_event_rowid = 0 #Største rowid i actuator_events som er tatt med i '_state_versions'
+        #Funksjoner som kalles med (aktuator, versjon) når tilstanden endres, fra denne eller andre prosesser
+        self.state_listeners: list[Callable[[str, int], None]] = []
+        #De nyeste målingene per sensor, brukes av 'get_reading_series' når huset er lastet med 'load_smarthouse'
+        self.recent = RecentReadings(ring_capacity, max_ring_sensors)
+        #Cache for 'calc_aggregates', brukes også bare når huset er lastet med 'load_smarthouse'
+        self.aggregates = AggregateCache()
+        #Cache for analysene per rom ('calc_avg_temperatures_in_room', 'calc_hours_with_humidity_above'), og rommet
+        #til hver sensor slik at en ny måling bare fjerner resultatene for sitt eget rom
+        self.analytics = RoomAnalyticsCache()
+        self._sensor_rooms: dict[str, int] = {}
+
+        #Oppslag mellom id (UUID) og heltallsnøkkel for enhetene, og mellom måleenhet og nøkkel.
+        #Id-ene oversettes til nøkler her i klassen, slik at resten av programmet bare ser id-ene
+        self._device_keys: dict[str, int] = {}
+        self._device_ids: dict[int, str] = {}
+        self._unit_keys: dict[str, int] = {}
+        #Nøkkelen til sensorer med målinger i komprimerte biter, slik at vanlige lesinger ikke trenger å sjekke bitene.
+        #Oppdateres av 'compact_measurements' og 'sync_with_database'
+        self._chunked: set[int] = set()
+
+        #Lesekopien lages først når en analysespørring kjøres
+        self.replica: Optional[AnalyticsReplica] = None
+        if replica_file:
+            self.replica = AnalyticsReplica(file, replica_file, replica_max_age, self.statement_cache_size)
+
+        self.conn = self._connect()
+        self._ensure_schema(migrate)
+        self._load_dictionaries()
 
     def __del__(self):
         self.conn.close()
+        if self.replica is not None:
+            self.replica.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.statements.connection_reset()
+        return sqlite3.connect(self.file, check_same_thread=False, cached_statements=self.statement_cache_size)
+
+    def _ensure_schema(self, migrate: bool) -> None:
+        """
+        Sjekker at databasen har skjemaet klassen bruker. Med 'migrate' opprettes tabellene og indeksene i
+        'SCHEMA' som mangler, og en database med id (UUID) i målingene migreres til heltallsnøkler
+        (se 'MIGRATE_SURROGATE_KEYS') og til unike målinger per (device, ts) (se 'MIGRATE_UNIQUE_READINGS').
+        En database som allerede er migrert skrives ikke til
+        """
+        if not self._needs_schema():
+            return
+        if not migrate:
+            raise MigrationRequired(f"{self.file} has an older schema, open it with migrate=True "
+                                    f"or run 'python -m smarthouse.persistence {self.file}'")
+        for needs_migration, migrate in ((self._needs_key_migration, self._migrate_keys),
+                                         (self._needs_unique_readings, self._migrate_unique_readings)):
+            if needs_migration():
+                #Skrivelåsen tas før det sjekkes på nytt, så bare én prosess migrerer
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if needs_migration():
+                        migrate()
+                    self.conn.commit()
+                except sqlite3.Error:
+                    self.conn.rollback()
+                    raise
+        self.conn.executescript(SCHEMA)
+
+    def _needs_schema(self) -> bool:
+        existing = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master")}
+        return not SCHEMA_OBJECTS <= existing or self._needs_key_migration() or self._needs_unique_readings()
+
+    def _needs_key_migration(self) -> bool:
+        columns = {row[1]: row[2] for row in self.conn.execute("PRAGMA table_info(measurements)")}
+        return columns.get("device", "").upper() == "TEXT"
+
+    def _migrate_keys(self) -> None:
+        """
+        Utfører migreringen til heltallsnøkler, én setning om gangen slik at alt skjer i transaksjonen som er åpen
+        """
+        orphans = self.conn.execute(
+            "SELECT COUNT(*) FROM measurements WHERE device NOT IN (SELECT id FROM devices)").fetchone()[0]
+        if orphans:
+            logger.warning("%d measurements from unknown devices are not migrated", orphans)
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        script = MIGRATE_SURROGATE_KEYS + SCHEMA
+        for table, (before, after) in MIGRATE_OWN_TABLES.items():
+            if table in tables:
+                script = before + script + after
+        for statement in script.split(";"):
+            if statement.strip():
+                self.conn.execute(statement)
+        logger.info("Migrated %s to integer device and unit keys", self.file)
+
+    def _needs_unique_readings(self) -> bool:
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(measurements)")}
+        unique = {row[1]: row[2] for row in self.conn.execute("PRAGMA index_list(measurements)")}
+        return "seq" not in columns or not unique.get("measurements_device_ts", 0)
+
+    def _migrate_unique_readings(self) -> None:
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(measurements)")}
+        if "seq" not in columns:
+            self.conn.execute("ALTER TABLE measurements ADD COLUMN seq INTEGER NULL")
+        removed = self.conn.execute("SELECT COUNT(*) - COUNT(DISTINCT device || ' ' || ts) FROM measurements").fetchone()[0]
+        for statement in MIGRATE_UNIQUE_READINGS.split(";"):
+            if statement.strip():
+                self.conn.execute(statement)
+        logger.info("Made measurements in %s unique per device and timestamp (%d duplicates removed)", self.file, removed)
+
+    def _load_dictionaries(self) -> None:
+        """
+        Fyller oppslagene for enheter, måleenheter og sensorer med komprimerte biter. Leses direkte fra
+        tilkoblingen som skjemaet, siden de hører til oppsettet av klassen og ikke til spørringene den gjør
+        """
+        for key, device in self.conn.execute(STATEMENTS["device_keys"]):
+            self._remember_device(key, device)
+        self._unit_keys = {unit: key for key, unit in self.conn.execute(STATEMENTS["all_units"])}
+        self._chunked = {row[0] for row in self.conn.execute(STATEMENTS["chunked_devices"])}
+
+    def _remember_device(self, key: int, device: str) -> None:
+        self._device_keys[device] = key
+        self._device_ids[key] = device
+
+    def _device_key(self, device: str) -> Optional[int]:
+        """
+        Slår opp heltallsnøkkelen til en enhet fra id-en, None hvis enheten ikke finnes
+        """
+        key = self._device_keys.get(device)
+        if key is None:
+            rows = self.run("device_key", (device,))
+            if rows:
+                key = rows[0][0]
+                self._remember_device(key, device)
+        return key
+
+    def _device_id(self, key: int) -> str:
+        """
+        Slår opp id-en til en enhet fra heltallsnøkkelen
+        """
+        device = self._device_ids.get(key)
+        if device is None:
+            device = self.run("device_id", (key,))[0][0]
+            self._remember_device(key, device)
+        return device
+
+    def _unit_key(self, unit: Optional[str], create: bool = False) -> Optional[int]:
+        """
+        Slår opp nøkkelen til en måleenhet, og legger den til i tabellen units hvis 'create' er satt
+        Returns:
+            Optional[int]: Nøkkelen, None for målinger uten enhet eller en ukjent enhet
+        """
+        if unit is None:
+            return None
+        key = self._unit_keys.get(unit)
+        if key is None:
+            rows = self.run("insert_unit" if create else "unit_key", (unit,))
+            if rows:
+                key = self._unit_keys[unit] = rows[0][0]
+        return key
 
     def cursor(self) -> sqlite3.Cursor:
         """
         Gir en 'rå SQLite cursor' for å intagere med databasen
         Når metoden kalles for å skaffe en cursor, er det viktig å huske
         å kalle 'commit/rollback' og 'close' selv etter ferdig med å utføre SQL spørringer
+        Merk at spørringer gjort direkte på cursoren ikke blir med i 'stats', bruk 'execute' for det
         """
         return self.conn.cursor()
 
 
+    def execute(self, sql: str, params: tuple | dict = ()) -> list[tuple]:
+        """
+        Instrumentert utførelse av en SQL spørring. Alle spørringer i klassen går gjennom denne metoden
+        slik at antall kjøringer, tidsbruk og antall rader blir registrert per spørringsform.
+        Spørringer som er tregere enn 'slow_query_threshold' logges, eventuelt med spørringsplan.
+        Args:
+            sql(str): SQL teksten som skal utføres
+            params(tuple | dict): Parametere til spørringen, posisjonelle eller navngitte
+        Returns:
+            list[tuple]: Alle radene spørringen returnerte (tom liste for INSERT/UPDATE/DELETE)
+        """
+        cursor = self.conn.cursor()
+        start = time.perf_counter()
+        try:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        duration = time.perf_counter() - start
+
+        self._record(sql, params, duration, len(rows))
+        return rows
+
+    def execute_many(self, sql: str, seq_of_params: list) -> int:
+        """
+        Instrumentert 'executemany', utfører samme spørring for hvert sett med parametere.
+        Returns:
+            int: Antall rader som ble endret
+        """
+        cursor = self.conn.cursor()
+        start = time.perf_counter()
+        try:
+            cursor.executemany(sql, seq_of_params)
+            rowcount = cursor.rowcount
+        finally:
+            cursor.close()
+        duration = time.perf_counter() - start
+
+        self._record(sql, seq_of_params[0] if seq_of_params else (), duration, 0)
+        return rowcount
+
+    def _record(self, sql: str, params: tuple | dict, duration: float, rows: int) -> None:
+        slow = self.slow_query_threshold is not None and duration > self.slow_query_threshold
+        stats = self.stats.record(sql, duration, rows, slow)
+        if slow:
+            self._log_slow_query(stats, sql, params, duration)
+
+    def run(self, op: str, params: tuple | dict = ()) -> list[tuple]:
+        """
+        Utfører den registrerte spørringen 'op' fra 'STATEMENTS' med gitte parametere.
+        Spørringer i 'ANALYTICS_STATEMENTS' kjøres på lesekopien hvis repository har en
+        """
+        if self.replica is not None and op in ANALYTICS_STATEMENTS:
+            sql = self.statements.sql(op)
+            start = time.perf_counter()
+            rows = self.replica.execute(sql, params)
+            self._record(sql, params, time.perf_counter() - start, len(rows))
+            return rows
+        return self.execute(self.statements.sql(op), params)
+
+    def run_many(self, op: str, seq_of_params: list) -> int:
+        """
+        Utfører den registrerte spørringen 'op' én gang per sett med parametere
+        """
+        return self.execute_many(self.statements.sql(op), seq_of_params)
+
+    def _log_slow_query(self, stats: QueryStats, sql: str, params: tuple | dict, duration: float) -> None:
+        """
+        Logger en treg spørring, og henter spørringsplanen hvis 'explain_slow_queries' er satt.
+        Planen gjør det lett å se fulle tabellskann (SCAN) og midlertidige sorteringer (USE TEMP B-TREE)
+        """
+        plan = None
+        if self.explain_slow_queries and sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            cursor = self.conn.cursor()
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+            cursor.close()
+            stats.last_plan = plan
+        logger.warning("Slow query (%.1f ms): %s%s", duration * 1000, stats.shape,
+                       f" plan={plan}" if plan else "")
+
+
     def reconnect(self):
         """
         Lukker den nåværende tilkoblingen til databasen og åpner en ny
         Metoden sikrer at tilkoblingen er frisk og uten tidligere potensielle tilstandsfeil
         """
         self.conn.close()
-        self.conn = sqlite3.connect(self.file)
+        self.conn = self._connect()
+        #data_version kan bare sammenlignes innenfor samme tilkobling
+        self._data_version = None
 
 
     
@@ -47,10 +1049,8 @@ class SmartHouseRepository:
         (som etasjer, rom og enheter) blir også hentet.
         """
         result = SmartHouse() #Oppretter et nytt smarthouse objekt som vil være fylt med data fra databasen
-        cursor = self.cursor()
 
-        cursor.execute('SELECT MAX(floor) from rooms;')
-        no_floors = cursor.fetchone()[0]
+        no_floors = self.run("max_floor")[0][0]
         floors = []
 
         #Løkke som oppretter etasjeobjekt basert på antall etasjer henter fra databasen
@@ -60,9 +1060,7 @@ class SmartHouseRepository:
 
         room_dict = {}
 
-        cursor.execute('SELECT id, floor, area, name from rooms;')
-
-        room_tuples = cursor.fetchall()
+        room_tuples = self.run("all_rooms")
 
         #Itererer gjennom hvert rom i tuppelen som er hentet fra databasen for å registrere hvert rom
         for room_tuple in room_tuples:
@@ -74,10 +1072,10 @@ class SmartHouseRepository:
             #Legger til det nye romobjektet i 'room_dict' ordboken med rom ID som nøkkel
             room_dict[room_tuple[0]] = room
 
-        cursor.execute('SELECT id, room, kind, category, supplier, product from devices;')
-        device_tuples = cursor.fetchall()
+        device_tuples = self.run("all_devices")
 
         for device_tuple in device_tuples:
+            self._remember_device(device_tuple[6], device_tuple[0])
 
             #Bruker room_dict for å finne romobjektet som korresponderer med rom ID som er lagret i device_tuple
             room = room_dict[device_tuple[1]]
@@ -97,12 +1095,23 @@ class SmartHouseRepository:
                 else:
                     result.register_device(room, Actuator(device_tuple[0], device_tuple[5], device_tuple[4], device_tuple[2]))
 
+        self._apply_states(result)
+
+        return result
+
+
+    def _apply_states(self, house: SmartHouse) -> None:
+        """
+        Setter tilstanden til alle aktuatorene i huset til det som er lagret i tabellen states
+        """
+        #Henter alle tilstander i én spørring i stedet for én spørring per aktuator
+        states = dict(self.run("all_states"))
+
         #Iterer først gjennom alle enhetene registrert i smarthus objektet
-        for dev in result.get_devices():
+        for dev in house.get_devices():
             if isinstance(dev, Actuator):
 
-                cursor.execute(f"SELECT state FROM states where device = '{dev.id}';")
-                state = cursor.fetchone()[0]
+                state = states.get(dev.id)
 
                 if state is None:
                     dev.turn_off()
@@ -114,8 +1123,319 @@ class SmartHouseRepository:
                 else:
                     dev.turn_on(float(state))
 
-        cursor.close()
-        return result
+
+    def load_smarthouse(self) -> SmartHouse:
+        """
+        Laster huset som 'load_smarthouse_deep', men bruker snapshot filen hvis den er satt og fortsatt gyldig.
+        Et snapshot er gyldig så lenge skjema og topologi (rom og enheter) er uendret. Aktuatortilstander
+        og siste målinger som er endret siden snapshot ble skrevet hentes inkrementelt (målinger med høyere rowid).
+        Metoden fyller også cachen med siste måling per sensor som 'get_latest_reading' bruker.
+        """
+        schema_cookie, change_counter = read_file_header(self.file)
+        topology = tuple(self.run("topology_fingerprint")[0])
+        snapshot = read_snapshot(self.snapshot_file, schema_cookie, topology) if self.snapshot_file else None
+
+        self._own_rowids.clear()
+        self._own_deletes.clear()
+        self.analytics.clear()
+        if snapshot is not None:
+            house = snapshot.house
+            self._index_rooms(house)
+            self._latest = snapshot.latest
+            self._measurement_rowid = snapshot.measurement_rowid
+            self._delete_seq = snapshot.delete_seq
+            self.recent.load(snapshot.recent)
+            #Uendret teller betyr at ingenting er skrevet til databasen siden snapshot ble laget
+            changed = snapshot.stamp.change_counter != change_counter
+            if changed:
+                self._apply_states(house)
+                self._catch_up_latest()
+                self._catch_up_deletes()
+        else:
+            house = self.load_smarthouse_deep()
+            self._index_rooms(house)
+            self._measurement_rowid = self.run("max_measurement_rowid")[0][0]
+            self._delete_seq = self.run("delete_log_bounds")[0][1]
+            self._load_recent()
+            changed = True
+        if self._state_event_rowid:
+            self._catch_up_state_versions()
+        else:
+            self._seed_state_versions()
+
+        self.house = house
+        self._data_version = self.run("data_version")[0][0]
+        #Telleren ble lest før innlastingen, så snapshot kan aldri bli merket som nyere enn innholdet
+        if changed and self.snapshot_file:
+            with self._snapshot_lock:
+                self._write_snapshot(schema_cookie, change_counter, topology)
+        return house
+
+
+    def _index_rooms(self, house: SmartHouse) -> None:
+        self._sensor_rooms = {d.id: d.room.db_id for d in house.get_devices()
+                              if d.is_sensor() and d.room is not None and d.room.db_id is not None}
+
+
+    def _load_recent(self) -> None:
+        """
+        Fyller ringbufferne med de nyeste målingene per sensor fra databasen, og cachen med den aller nyeste
+        """
+        self._latest = {}
+        rows: dict[str, list] = {}
+        for key, ts, value, unit in self.run("recent_readings", (self.recent.capacity,)):
+            rows.setdefault(self._device_id(key), []).append((ts, value, unit))
+        for device, readings in rows.items():
+            self._latest[device] = readings[0]
+            self.recent.put(device, readings)
+
+
+    def sync_with_database(self) -> bool:
+        """
+        Holder huset lastet med 'load_smarthouse' i synk med endringer gjort av andre prosesser
+        (f.eks. andre uvicorn workers). 'PRAGMA data_version' endres bare når en annen tilkobling
+        har committet endringer, så sjekken er billig når ingenting har skjedd. Ved endring leses
+        aktuatortilstandene på nytt og cachen med siste målinger oppdateres inkrementelt, både med nye
+        og slettede målinger.
+        Returns:
+            bool: True hvis databasen var endret og huset ble oppdatert
+        """
+        if self.house is None:
+            return False
+        with self._sync_lock:
+            version = self.run("data_version")[0][0]
+            if version == self._data_version:
+                return False
+            self._apply_states(self.house)
+            self._catch_up_state_versions()
+            if self._latest is not None:
+                self._catch_up_latest()
+                self._catch_up_deletes()
+            self._chunked = {row[0] for row in self.run("chunked_devices")}
+            self._data_version = version
+            return True
+
+
+    def _catch_up_state_versions(self) -> None:
+        """
+        Oppdaterer versjonen til aktuatorene med endringer logget etter '_state_event_rowid', og sier fra til
+        'state_listeners'. Kalles etter at tilstandene er lest, så en ny versjon aldri viser en gammel tilstand
+        """
+        with self._sync_lock:
+            changed = {}
+            for rowid, key in self.run("state_events_since", (self._state_event_rowid,)):
+                self._state_event_rowid = rowid
+                changed[self._device_id(key)] = rowid
+            self._state_versions.update(changed)
+        for actuator, version in changed.items():
+            for listener in self.state_listeners:
+                listener(actuator, version)
+
+
+    def _seed_state_versions(self) -> None:
+        """
+        Setter versjonene fra siste endring per aktuator første gang huset lastes, i stedet for å gå gjennom
+        hele loggen. Endringer logget etter spørringen har høyere rowid og tas med av '_catch_up_state_versions'
+        """
+        with self._sync_lock:
+            self._state_versions = {self._device_id(key): rowid for key, rowid in self.run("state_versions")}
+            self._state_event_rowid = max(self._state_versions.values(), default=0)
+
+
+    def state_version(self, actuator: str) -> int:
+        """
+        Returnerer versjonen til tilstanden til aktuatoren, 0 hvis tilstanden aldri er endret.
+        Versjonen øker hver gang tilstanden endres, og kan brukes som ETag eller for å vente på en endring
+        """
+        return self._state_versions.get(actuator, 0)
+
+
+    def _catch_up_latest(self) -> None:
+        """
+        Oppdaterer cachen med siste måling per sensor og ringbufferne med målinger lagt til etter '_measurement_rowid'.
+        Målinger denne tilkoblingen selv har satt inn er allerede tatt med, og hoppes over
+        """
+        with self._sync_lock:
+            for rowid, key, ts, value, unit in self.run("readings_since_rowid", (self._measurement_rowid,)):
+                self._measurement_rowid = rowid
+                if rowid in self._own_rowids:
+                    self._own_rowids.discard(rowid)
+                    continue
+                self._apply_reading(self._device_id(key), ts, value, unit)
+
+
+    def _catch_up_deletes(self) -> None:
+        """
+        Rydder i cachene for målinger andre prosesser har slettet etter '_delete_seq' (se 'measurement_deletes').
+        Slettinger gjort av denne tilkoblingen er allerede tatt med, og hoppes over. Har loggen allerede
+        mistet slettinger vi ikke har sett, lastes ringbufferne og cachen med siste måling på nytt
+        """
+        with self._sync_lock:
+            oldest, newest = self.run("delete_log_bounds")[0]
+            if newest <= self._delete_seq:
+                return
+            if oldest > self._delete_seq + 1:
+                self.recent.load({})
+                self._load_recent()
+                self.aggregates.clear()
+                self.analytics.clear()
+                self._own_deletes.clear()
+                self._delete_seq = newest
+                #Tidspunktene til slettingene er ukjente, en tom tekst er eldre enn alle tidsstempler
+                for sensor in self._device_keys:
+                    for listener in self.delete_listeners:
+                        listener(sensor, "")
+                return
+            for seq, key, ts, unit in self.run("deletes_since", (self._delete_seq,)):
+                self._delete_seq = seq
+                if seq in self._own_deletes:
+                    self._own_deletes.discard(seq)
+                    continue
+                self._forget_reading(self._device_id(key), key, ts, unit)
+
+
+    def _forget_reading(self, sensor: str, key: int, ts: str, unit: Optional[str]) -> None:
+        """
+        Fjerner en slettet måling fra cachene, og sier fra til 'delete_listeners'
+        """
+        #Ringbufferet lages på nytt fra databasen neste gang det trengs
+        self.recent.discard(sensor)
+        self._invalidate_results(sensor, ts, _ts_key(ts), unit)
+        for listener in self.delete_listeners:
+            listener(sensor, ts)
+
+        #Hvis den slettede målingen også var den siste, hentes ny siste måling til cachen
+        if self._latest is not None and self._latest.get(sensor, (None,))[0] == ts:
+            latest = self.run("latest_reading", (key,))
+            if latest:
+                self._latest[sensor] = latest[0]
+            else:
+                self._latest.pop(sensor, None)
+
+
+    def _log_delete(self, key: int, ts: str, unit_key: Optional[int]) -> int:
+        """
+        Logger en sletting i 'measurement_deletes' i den samme transaksjonen som selve slettingen.
+        Returnerer 'seq' til slettingen, som gis til '_own_delete' etter commit
+        """
+        seq = self.run("log_delete", (key, ts, unit_key))[0][0]
+        self.run("prune_deletes", (DELETE_LOG_SIZE,))
+        return seq
+
+
+    def _own_delete(self, seq: int) -> None:
+        #Slettingen er allerede tatt med i cachene, så '_catch_up_deletes' skal hoppe over den
+        with self._sync_lock:
+            if seq == self._delete_seq + 1:
+                self._delete_seq = seq
+            else:
+                self._own_deletes.add(seq)
+
+
+    def _own_reading(self, rowid: int) -> None:
+        #Følger målingen rett etter de vi allerede har sett kan '_measurement_rowid' flyttes fram,
+        #ellers huskes den slik at '_catch_up_latest' ikke tar den med to ganger
+        with self._sync_lock:
+            if rowid == self._measurement_rowid + 1:
+                self._measurement_rowid = rowid
+            else:
+                self._own_rowids.add(rowid)
+
+
+    def _apply_reading(self, sensor: str, ts: str, value: float, unit: Optional[str]) -> None:
+        """
+        Tar med en ny måling i cachen med siste måling og ringbufferet, og sier fra til 'reading_listeners'.
+        Den siste målingen er vannmerket til sensoren: en måling som er eldre kommer for sent, endrer ikke
+        cachen med siste måling, telles i 'lateness' og sendes til 'late_listeners'
+        """
+        key_ts = _ts_key(ts)
+        cached = self._latest.get(sensor)
+        late = cached is not None and key_ts < _ts_key(cached[0])
+        if late:
+            self.lateness.record(sensor, ts_to_epoch(_ts_key(cached[0])) - ts_to_epoch(key_ts))
+        else:
+            self._latest[sensor] = (ts, value, unit)
+        self.recent.add(sensor, ts, value, unit)
+        self._invalidate_results(sensor, ts, key_ts, unit)
+        for listener in self.late_listeners if late else self.reading_listeners:
+            listener(sensor, ts, value, unit)
+
+
+    def _invalidate_results(self, sensor: str, ts: str, key_ts: str, unit: Optional[str]) -> None:
+        """
+        Fjerner cachede aggregater og analyser en ny eller slettet måling endrer
+        """
+        self.aggregates.invalidate(unit, key_ts)
+        room = self._sensor_rooms.get(sensor)
+        if room is not None:
+            #Analysene sammenligner tidsstemplene slik de er lagret, så begge formene sjekkes
+            self.analytics.invalidate(room, key_ts)
+            if ts != key_ts:
+                self.analytics.invalidate(room, ts)
+
+
+    def save_snapshot(self) -> None:
+        """
+        Skriver snapshot av huset lastet med 'load_smarthouse' til 'snapshot_file'.
+        Telleren fra databasen leses før cachen og tilstandene oppdateres, slik at snapshot
+        aldri merkes som nyere enn innholdet det faktisk har
+        """
+        if not self.snapshot_file or self.house is None or self._latest is None:
+            return
+        with self._snapshot_lock:
+            schema_cookie, change_counter = read_file_header(self.file)
+            topology = tuple(self.run("topology_fingerprint")[0])
+            self._apply_states(self.house)
+            self._catch_up_latest()
+            self._write_snapshot(schema_cookie, change_counter, topology)
+
+
+    def schedule_snapshot(self) -> None:
+        """
+        Skriver snapshot etter 'snapshot_delay' sekunder i en bakgrunnstråd. Kall i mellomtiden
+        samles i den samme skrivingen, slik at mange endringer på rad ikke gir én skriving hver
+        """
+        if not self.snapshot_file or self.house is None:
+            return
+        if self.snapshot_delay <= 0:
+            self.save_snapshot()
+            return
+        with self._sync_lock:
+            if self._snapshot_timer is not None:
+                return
+            self._snapshot_timer = threading.Timer(self.snapshot_delay, self._scheduled_snapshot)
+            self._snapshot_timer.daemon = True
+            self._snapshot_timer.start()
+
+
+    def flush_snapshot(self) -> None:
+        """
+        Skriver et planlagt snapshot med en gang, i stedet for å vente på bakgrunnstråden
+        """
+        with self._sync_lock:
+            timer, self._snapshot_timer = self._snapshot_timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save_snapshot()
+
+
+    def _scheduled_snapshot(self) -> None:
+        with self._sync_lock:
+            self._snapshot_timer = None
+        try:
+            self.save_snapshot()
+        except (OSError, sqlite3.Error):
+            #Snapshot er bare en hurtigbuffer, huset lastes fra SQL hvis det mangler eller er utdatert
+            logger.warning("Writing snapshot %s failed", self.snapshot_file, exc_info=True)
+
+
+    def _write_snapshot(self, schema_cookie: int, change_counter: int, topology: tuple) -> None:
+        stamp = DatabaseStamp(schema_cookie, change_counter, topology)
+        #Innholdet pickles under synk låsen, så cachen ikke endres av andre tråder underveis
+        with self._sync_lock:
+            snapshot = Snapshot(stamp, self.house, self._latest, self._measurement_rowid, self.recent.rings(),
+                                self._delete_seq)
+            write_snapshot(self.snapshot_file, snapshot)
 
 
     def get_readings(self, sensor: str, limit_n: int | None) -> list[Measurement]:
@@ -127,30 +1447,199 @@ class SmartHouseRepository:
         returns:
         list[Measurement]: en liste med målingene forespurt, hvor hver måling er en instans av Measurement klassen
         """
-        cursor = self.cursor()
+        return self.get_reading_series(sensor, limit_n).to_measurements()
+
+
+    def get_reading_series(self, sensor: str, limit_n: int | None) -> MeasurementSeries:
+        """
+        Samme som 'get_readings', men returnerer målingene som en kompakt 'MeasurementSeries'
+        i stedet for en liste med pydantic objekter. Brukes for bulk lesing av lange historikker.
+        Når huset er lastet med 'load_smarthouse' hentes målingene fra ringbufferet til sensoren
+        hvis det dekker forespørselen, ellers fra databasen.
+        """
+        limit_n = limit_n or None #0 betyr ingen grense, som i spørringene under
+        if self._latest is not None:
+            rows = self._recent_readings(sensor, limit_n)
+            if rows is not None:
+                return MeasurementSeries.from_rows(rows)
+
+        return MeasurementSeries.from_rows(self._stored_readings(sensor, limit_n))
+
 
+    def _stored_readings(self, sensor: str, limit_n: int | None) -> list[tuple]:
+        """
+        Henter de 'limit_n' nyeste målingene (alle hvis None) som (ts, value, unit) fra databasen, nyeste først,
+        inkludert målinger i komprimerte biter. Biter dekodes bare til vi har nok målinger
+        """
+        key = self._device_key(sensor)
         #Utfører spørring i databasen basert på om en limit på antall målinger er satt eller ikke
         if limit_n:
-            cursor.execute("""\
-SELECT ts, value, unit 
-FROM measurements
-WHERE device = ?
-ORDER BY datetime(ts) DESC 
-LIMIT ?
-            """, (sensor, limit_n))
+            tuples = self.run("readings_limit", (key, limit_n))
+        else:
+            tuples = self.run("readings", (key,))
+
+        if key not in self._chunked:
+            return tuples
+        chunks, _, newest_chunk = self.run("chunk_bounds", (key,))[0]
+        if chunks == 0 or (limit_n and len(tuples) == limit_n and _ts_key(tuples[-1][0]) >= newest_chunk):
+            return tuples
+
+        merged = list(tuples)
+        for last_ts, points in self._chunk_readings(key):
+            if limit_n and len(merged) >= limit_n:
+                merged.sort(key=lambda r: _ts_key(r[0]), reverse=True)
+                del merged[limit_n:]
+                if last_ts < _ts_key(merged[-1][0]):
+                    break
+            merged.extend(points)
+        merged.sort(key=lambda r: _ts_key(r[0]), reverse=True)
+        return merged[:limit_n] if limit_n else merged
+
+
+    def _chunk_readings(self, key: int, lower: str = "", upper: str = "~"):
+        """
+        Dekoder de komprimerte bitene til en sensor (nøkkelen) som overlapper [lower, upper), nyeste bit først
+        Returns:
+            Iterator[tuple[str, list[tuple]]]: (siste tidsstempel i biten, målinger (ts, value, unit) i biten)
+        """
+        for start, unit, count, data, last_ts in self.run("device_chunks",
+                                                          {"device": key, "lower": lower, "upper": upper}):
+            points = [(epoch_to_ts(t), v, unit) for t, v in decode_chunk(start, data, count)]
+            yield last_ts, [p for p in points if lower <= p[0] < upper]
+
+
+    def _store_chunk(self, key: int, start: int, unit: Optional[int], points: list[tuple[int, float]]) -> None:
+        """
+        Erstatter den komprimerte biten (sensor, start, enhet), med nøkler for sensor og enhet, med 'points',
+        eller fjerner den hvis 'points' er tom. Committer ikke, slik at flere endringer kan gjøres i samme transaksjon
+        """
+        self.run("delete_chunk", (key, start, unit))
+        if points:
+            values = [v for _, v in points]
+            self.run("insert_chunk", (key, start, unit, epoch_to_ts(points[0][0]), epoch_to_ts(points[-1][0]),
+                                      len(points), sum(values), min(values), max(values),
+                                      encode_chunk(start, points)))
+
+
+    def compact_measurements(self, before: str, keep: Optional[int] = None) -> int:
+        """
+        Flytter målinger eldre enn døgnet 'before' ligger i over i komprimerte biter (se 'smarthouse.chunks'),
+        ett døgn per sensor og enhet. En måling koster da noen få bytes i stedet for en hel rad med sensor id
+        og tidsstempel som tekst. Alle lese- og analysemetodene tar med målingene i bitene, så resultatene er
+        de samme som før. Flyttingen skjer i én transaksjon. Plassen som frigjøres i databasefilen brukes
+        til nye rader, filen blir bare mindre etter 'VACUUM'.
+        Args:
+            before(str): Tidspunkt i ISO format, målinger fra døgn før dette døgnet kan komprimeres
+            keep(Optional[int]): Antall nyeste målinger per sensor som alltid blir liggende som rader,
+                                 standard er kapasiteten til ringbufferne slik at de kan fylles fra tabellen
+        Returns:
+            int: Antall målinger som ble flyttet
+        """
+        cutoff = epoch_to_ts(chunk_start(ts_to_epoch(normalize_timestamp(before))))
+        keep = self.recent.capacity if keep is None else keep
+
+        #Bare målinger med tidsstempel i formatet i databasen og tallverdi kan gjenskapes nøyaktig fra en bit
+        groups: dict[tuple, list] = {}
+        rowids = []
+        for rowid, device, ts, value, unit in self.run("compactable_readings", {"keep": keep, "cutoff": cutoff}):
+            if len(ts) != 19 or not isinstance(value, float):
+                continue
+            epoch = ts_to_epoch(ts)
+            if epoch_to_ts(epoch) != ts:
+                continue
+            groups.setdefault((device, chunk_start(epoch), unit), []).append((epoch, value))
+            rowids.append((rowid,))
+        if not rowids:
+            return 0
+
+        try:
+            for (device, start, unit), points in groups.items():
+                existing = self.run("chunk", (device, start, unit))
+                if existing:
+                    points = sorted(decode_chunk(start, existing[0][1], existing[0][0]) + points, key=lambda p: p[0])
+                self._store_chunk(device, start, unit, points)
+            self.run_many("delete_measurement_rowid", rowids)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self._chunked.update(device for device, _, _ in groups)
+        return len(rowids)
+
+
+    def get_meter_readings(self, meter: str, since: str = "", until: Optional[str] = None) -> list[tuple[str, float]]:
+        """
+        Henter (ts, value) for alle målinger fra en måler fra og med 'since' (og før 'until'), sortert etter tid,
+        inkludert målinger i komprimerte biter. Tidsstemplene er i formatet i databasen, også for
+        målinger lagret med 'T' eller brøkdeler av sekunder, og 'since' og 'until' må være i samme format
+        """
+        key = self._device_key(meter)
+        if until is None:
+            rows = self.run("meter_readings_since", {"device": key, "since": since})
         else:
-            cursor.execute("""\
-SELECT ts, value, unit 
-FROM measurements
-WHERE device = ?
-ORDER BY datetime(ts) DESC 
-            """, (sensor,))
-        tuples = cursor.fetchall()
+            rows = self.run("meter_readings_between", {"device": key, "since": since, "until": until})
+        if key not in self._chunked:
+            return rows
+        for _, points in self._chunk_readings(key, since, "~" if until is None else until):
+            rows.extend((ts, value) for ts, value, _ in points)
+        return sorted(rows, key=lambda r: r[0])
+
+
+    def watermark(self, sensor: str) -> Optional[str]:
+        """
+        Returnerer tidsstempelet til den nyeste målingen fra sensoren i formatet i databasen (vannmerket),
+        eller None hvis sensoren ikke har målinger. Målinger med eldre tidsstempel kommer for sent
+        """
+        if self._latest is not None:
+            cached = self._latest.get(sensor)
+            return _ts_key(cached[0]) if cached else None
+        latest = self.run("latest_reading", (self._device_key(sensor),))
+        return _ts_key(latest[0][0]) if latest else None
+
 
-        #Konverterer hver tuple til et instans av Measurement
-        result = [Measurement(timestamp=t[0], value=t[1], unit=t[2]) for t in tuples]
-        cursor.close()
-        return resul
+    def is_late(self, sensor: str, ts: str) -> bool:
+        """
+        Sjekker om en måling med tidsstempel 'ts' kommer for sent, dvs. er eldre enn vannmerket til sensoren
+        """
+        watermark = self.watermark(sensor)
+        return watermark is not None and _ts_key(ts) < watermark
+
+
+    def _recent_readings(self, sensor: str, limit_n: int | None) -> list[tuple] | None:
+        """
+        Henter de nyeste målingene fra ringbufferet, og lager ringbufferet fra databasen hvis sensoren ikke har et
+        """
+        rows = self.recent.newest(sensor, limit_n)
+        if rows is None and not self.recent.has(sensor):
+            writes = self.recent.writes
+            self.recent.put(sensor, self._stored_readings(sensor, self.recent.capacity), writes)
+            rows = self.recent.newest(sensor, limit_n)
+        return rows
+
+
+    def get_window_stats(self, sensor: str, n: int) -> dict | None:
+        """
+        Beregner antall, gjennomsnitt, minimum og maksimum av de 'n' nyeste målingene fra en sensor
+        Returns:
+            dict | None: Statistikken, eller None hvis sensoren ikke har målinger
+        """
+        values = self.recent.newest_values(sensor, n) if self._latest is not None else None
+        if values is not None:
+            if not values:
+                return None
+            return {"count": len(values), "mean": sum(values) / len(values), "min": min(values), "max": max(values)}
+
+        key = self._device_key(sensor)
+        if key in self._chunked:
+            values = [row[1] for row in self._stored_readings(sensor, n)]
+            if not values:
+                return None
+            return {"count": len(values), "mean": sum(values) / len(values), "min": min(values), "max": max(values)}
+
+        count, mean, low, high = self.run("window_stats", (key, n))[0]
+        if count == 0:
+            return None
+        return {"count": count, "mean": mean, "min": low, "max": high}
 
 
     def delete_oldest_reading(self, sensor: str) -> Measurement | None:
@@ -162,24 +1651,27 @@ ORDER BY datetime(ts) DESC
             Measurement| None: returnerer den slettede målingen som en Measurement-instans, eller None hvis ingen måling funnet
         """
 
-        c = self.cursor()
-        query = """\
-SELECT ts, value, unit FROM measurements WHERE device = ? ORDER BY datetime(ts) ASC LIMIT 1
-        """
-        c.execute(query, (sensor,)) #Utfører spørringen med sensor ID som parameter
-        tup = c.fetchone()
+        key = self._device_key(sensor)
+        rows = self.run("oldest_reading", (key,)) #Utfører spørringen med sensor ID som parameter
+        tup = rows[0] if rows else None
+        #Den eldste målingen kan ligge i en komprimert bit, da fjernes den fra biten
+        chunk = self.run("oldest_chunk", (key,)) if key in self._chunked else None
+        if chunk and (tup is None or chunk[0][5] < _ts_key(tup[0])):
+            start, unit_key, unit, count, data, _ = chunk[0]
+            points = decode_chunk(start, data, count)
+            tup = (epoch_to_ts(points[0][0]), points[0][1], unit)
+            self._store_chunk(key, start, unit_key, points[1:])
+            seq = self._log_delete(key, tup[0], unit_key)
+            self.conn.commit()
+        elif tup:
+            #Sletter målingen fra databasen, (device, ts) er unik så bare denne ene raden slettes
+            self.run("delete_reading", (key, tup[0]))
+            seq = self._log_delete(key, tup[0], self._unit_key(tup[2]))
+            self.conn.commit()
         #Sjekker om det faktisk ble funnet en måling
         if tup:
-            #Definerer ny SQL spørring for å slette målingen fra databasen
-            query = f"""
-    DELETE FROM measurements
-    WHERE device = ?
-    AND ts = ?
-            """
-            c.execute(query, (sensor, tup[0]))
-            self.conn.commit()
-
-        c.close()
+            self._own_delete(seq)
+            self._forget_reading(sensor, key, tup[0], tup[2])
 
         #Returnerer den slettede målingen som en Measurement-instans hvis en måling ble funnet og slettet
         if tup:
@@ -188,25 +1680,80 @@ SELECT ts, value, unit FROM measurements WHERE device = ? ORDER BY datetime(ts)
             return None
 
 
-    def insert_measurement(self, sensor: str, measurement: Measurement) -> None:
+    def insert_measurement(self, sensor: str, measurement: Measurement, seq: Optional[int] = None) -> bool:
         """
-        Metoden legger til en ny måling for en gitt sensor
+        Metoden legger til en ny måling for en gitt sensor. Lagringen er idempotent: en måling med samme
+        tidsstempel som en lagret måling for sensoren (f.eks. et nytt forsøk fra en klient) lagres ikke på nytt
         Args:
             sensor(str): ID til sensor som målingen tilhører
             measurement(Measurement): En instans av Measurement klassen som inneholder dataene som skal legges inn
-        Result:
-              Utfører en INSERT operasjon i databasen for å legge til målingen
+            seq(Optional[int]): Sekvensnummer fra klienten. En måling med høyere sekvensnummer enn den lagrede
+                                målingen med samme tidsstempel erstatter den (en korrigert verdi)
+        Returns:
+            bool: True hvis målingen ble lagret, False hvis den allerede fantes
         """
+        return self.insert_measurements(sensor, [measurement], [seq]) == 1
 
-        query = f"""
-INSERT INTO measurements (device, ts, value, unit) VALUES (?, ?, ?, ?)
-        """
-        c = self.cursor()
-        #Utfører INSERT spørringen med de faktiske verdiene som skal legges inn
-        c.execute(query, (sensor, measurement.timestamp, measurement.value, measurement.unit))
 
-        self.conn.commit()
-        c.close()
+    def insert_measurements(self, sensor: str, measurements: list[Measurement],
+                            seqs: Optional[list[Optional[int]]] = None) -> int:
+        """
+        Legger til mange målinger for en sensor i én transaksjon. Målinger med samme tidsstempel i bunken
+        slås sammen først (den med høyest sekvensnummer, ellers den første, beholdes), og deretter lagres
+        de som 'insert_measurement'.
+        Args:
+            sensor(str): ID til sensor som målingene tilhører
+            measurements(list[Measurement]): Målingene
+            seqs(Optional[list[Optional[int]]]): Sekvensnummer per måling, se 'insert_measurement'
+        Returns:
+            int: Antall målinger som ble lagret
+        Raises:
+            ValueError: hvis sensoren ikke finnes
+        """
+        key = self._device_key(sensor)
+        if key is None:
+            raise ValueError(f"unknown device: {sensor}")
+
+        #Ett forsøk per tidsstempel, i tidsrekkefølge slik at ringbufferet kan ta dem med etter hverandre
+        batch: dict[str, tuple[Measurement, Optional[int]]] = {}
+        for measurement, seq in zip(measurements, seqs or [None] * len(measurements)):
+            kept = batch.get(measurement.timestamp)
+            if kept is None or (seq is not None and (kept[1] is None or seq > kept[1])):
+                batch[measurement.timestamp] = (measurement, seq)
+        batch = dict(sorted(batch.items(), key=lambda item: _ts_key(item[0])))
+
+        stored = []
+        try:
+            for ts, (measurement, seq) in batch.items():
+                unit_key = self._unit_key(measurement.unit, create=True)
+                rows = self.run("insert_measurement", (key, ts, measurement.value, unit_key, seq))
+                replaced = None
+                if not rows and seq is not None:
+                    #Samme tidsstempel finnes, et høyere sekvensnummer erstatter målingen. Den gamle slettes
+                    #og logges, slik at andre prosesser også fjerner den fra cachene sine
+                    old_rowid, old_seq, old_unit_key, old_unit = self.run("measurement_at", (key, ts))[0]
+                    if old_seq is None or seq > old_seq:
+                        self.run("delete_measurement_rowid", (old_rowid,))
+                        replaced = (self._log_delete(key, ts, old_unit_key), old_unit)
+                        rows = self.run("insert_measurement", (key, ts, measurement.value, unit_key, seq))
+                if rows:
+                    stored.append((rows[0][0], measurement, replaced))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        #Oppdaterer cachen med siste måling hvis den nye målingen er nyere, og ringbufferet til sensoren.
+        #En erstattet måling fjernes først, som ved 'delete_oldest_reading'
+        with self._sync_lock:
+            for rowid, measurement, replaced in stored:
+                if replaced is not None:
+                    self._own_delete(replaced[0])
+                    self._forget_reading(sensor, key, measurement.timestamp, replaced[1])
+                if self._latest is not None:
+                    self._own_reading(rowid)
+                    self._apply_reading(sensor, measurement.timestamp, measurement.value, measurement.unit)
+        return len(stored)
 
 
     def get_latest_reading(self, sensor) -> Optional[Measurement]:
@@ -219,17 +1766,13 @@ INSERT INTO measurements (device, ts, value, unit) VALUES (?, ?, ?, ?)
             Optional[Measurement] Returnerer en Measurement-instans som representerer den siste målingen
                                  eller None hvis ingen målinger er tilgjengelig
         """
-        #SQL spørring hvor resultatet sortert etter ts, i synkende rekkefølge for å få siste måling som første rad
-        query = f"""
-SELECT ts, value, unit from measurements m 
-WHERE device = '{sensor.id}'
-order by ts desc 
-limit 1;
-        """
-        c = self.cursor()
+        #Bruker cachen med siste måling hvis huset er lastet med 'load_smarthouse'
+        if self._latest is not None:
+            cached = self._latest.get(sensor.id)
+            return Measurement(timestamp=cached[0], value=float(cached[1]), unit=cached[2]) if cached else None
 
-        c.execute(query)
-        result = c.fetchall()
+        #SQL spørring hvor resultatet sortert etter ts, i synkende rekkefølge for å få siste måling som første rad
+        result = self.run("latest_reading", (self._device_key(sensor.id),))
 
         #Hvis resultatet fra spørringen er en tom liste returnerer da None og lukker cursor
         if len(result) == 0:
@@ -238,40 +1781,224 @@ limit 1;
         #Så lenge resultatet ikke er en liste med null rader, oppretter da en Measurement-instans
         #fra den første raden i resultatet
         m = Measurement(timestamp=result[0][0],value=float(result[0][1]),unit=result[0][2])
-        c.close()
         return m
 
-    def update_actuator_state(self, actuator):
+    def apply_actuator_states(self, changes: list[tuple[Actuator, str | float]], source: Optional[str] = None) -> None:
+        """
+        Setter tilstanden til aktuatorene i minnet og lagrer dem i én transaksjon. Alt skjer under '_sync_lock',
+        så endepunktene og automatiseringen (egen tråd) ikke endrer de samme objektene samtidig, og versjonene
+        og loggen i 'actuator_events' stemmer med tilstanden i minnet.
+        Hvis lagringen feiler settes tilstandene i minnet tilbake.
+        Args:
+            changes(list[tuple[Actuator, str | float]]): Aktuatorene og tilstanden de skal få
+            source(Optional[str]): Hvem som gjorde endringen, lagres i loggen
+        """
+        with self._sync_lock:
+            previous = [(actuator, actuator.state) for actuator, _ in changes]
+            for actuator, state in changes:
+                apply_target_state(actuator, state)
+            try:
+                self.update_actuator_states([actuator for actuator, _ in changes], source)
+            except sqlite3.Error:
+                #Lagringen i databasen feilet og ble rullet tilbake, så tilstandene i minnet settes også tilbake
+                for actuator, state in previous:
+                    actuator.state = state
+                raise
+
+    def update_actuator_state(self, actuator, source: Optional[str] = None):
         """
         Metoden lagrer tilstanden til den gitte aktuatoren i databasen
         Args:
             actuator: Bruker spesifiserer hvilken Aktuator ID som skal oppdateres,
             bruker her en instans Actuator-klassen
+            source(Optional[str]): Hvem som gjorde endringen, lagres i loggen
         Result:
               Tilstanden til den gitte aktuatoren oppdateres i database
         """
         #Sjekker at den gitte aktuatoren faktisk er en instans av Aktuator klassen
         if isinstance(actuator, Actuator):
-            s = 'NULL'
+            self.update_actuator_states([actuator], source)
 
-            #Sjekker og konverterer aktuator tilstand til en streng som er egnet for SQL spørringen
-            if isinstance(actuator.state, float):
-                s = str(actuator.state)
-            elif actuator.state is True:
-                s = '1.0'
 
-            #Definerer så SQL spørringen for å oppdatere tabellen states (tilstand) til aktuatoren i databasen
-            query = f"""
-UPDATE states 
-SET state = {s}
-WHERE device = '{actuator.id}'; 
+    def update_actuator_states(self, actuators: list[Actuator], source: Optional[str] = None) -> None:
+        """
+        Lagrer tilstanden til flere aktuatorer i én transaksjon (én commit), i stedet for én per aktuator.
+        Endringene logges i 'actuator_events' i den samme transaksjonen.
+        Hvis lagringen feiler rulles hele transaksjonen tilbake.
+        Args:
+            actuators(list[Actuator]): Aktuatorene som skal lagres
+            source(Optional[str]): Hvem som gjorde endringen, lagres i loggen
         """
-            c = self.cursor()
-            c.execute(query)
+        ts = datetime.now().strftime(TIMESTAMP_FORMAT)
+        params = []
+        for actuator in actuators:
+            s = None
+
+            #Sjekker og konverterer aktuator tilstand til en verdi som er egnet for SQL spørringen
+            if isinstance(actuator.state, float):
+                s = actuator.state
+            elif actuator.state is True:
+                s = 1.0
+            params.append((s, self._device_key(actuator.id)))
+
+        if not params:
+            return
+        try:
+            self.run_many("log_state_change", [{"device": d, "ts": ts, "new": s, "source": source} for s, d in params])
+            #Oppdaterer tabellen states (tilstand) til aktuatorene i databasen
+            self.run_many("update_state", params)
             #Utfører commit for å commite endring til database, så tilstand blir lagret i db
             self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+        #Oppdaterer versjonene. Har andre prosesser også endret databasen, leses tilstandene deres inn først,
+        #ellers er de eneste nye endringene i loggen våre egne
+        with self._sync_lock:
+            if not self.sync_with_database():
+                self._catch_up_state_versions()
+
+        #Snapshot skrives på nytt i bakgrunnen når tilstanden til en aktuator endres. Tilstandene er allerede
+        #lagret, så en feil med snapshot (bare en hurtigbuffer) logges i stedet for å nå den som kalte
+        if self.house is not None:
+            try:
+                self.schedule_snapshot()
+            except (OSError, sqlite3.Error):
+                logger.warning("Writing snapshot %s failed", self.snapshot_file, exc_info=True)
+
+
+    def get_state_timeline(self, actuator: str, from_ts: Optional[str] = None, until_ts: Optional[str] = None) -> list[tuple]:
+        """
+        Henter tilstandsendringene til en aktuator i et tidsrom [from_ts, until_ts)
+        Args:
+            actuator(str): ID til aktuatoren
+            from_ts(Optional[str]): Start på tidsrommet (ISO format), ingen nedre grense hvis None
+            until_ts(Optional[str]): Slutt på tidsrommet (ISO format), ingen øvre grense hvis None
+        Returns:
+            list[tuple]: Endringer sortert etter tid, på formen (ts, gammel tilstand, ny tilstand, kilde)
+        """
+        lower = normalize_timestamp(from_ts) if from_ts else "0000-01-01 00:00:00"
+        upper = normalize_timestamp(until_ts) if until_ts else "9999-12-31 23:59:59"
+        return self.run("state_timeline", {"device": self._device_key(actuator), "lower": lower, "upper": upper})
+
+
+    def calc_duty_cycle(self, actuator: str, from_ts: str, until_ts: str, period: str = "day") -> list[tuple]:
+        """
+        Beregner hvor lenge en aktuator var påslått i hver periode (time eller dag) i tidsrommet [from_ts, until_ts).
+        Hele beregningen gjøres i SQL, og bare loggradene til aktuatoren i tidsrommet leses (via indeksen).
+        Args:
+            actuator(str): ID til aktuatoren
+            from_ts(str): Start på tidsrommet (ISO format)
+            until_ts(str): Slutt på tidsrommet (ISO format)
+            period(str): 'hour' eller 'day'
+        Returns:
+            list[tuple]: En rad per periode på formen (start, slutt, sekunder påslått, andel påslått)
+        """
+        if period not in DUTY_CYCLE_PERIODS:
+            raise ValueError(f"unknown period: {period}")
+        lower = normalize_timestamp(from_ts)
+        upper = normalize_timestamp(until_ts)
+        if lower >= upper:
+            return []
+        rows = self.run("duty_cycle", {"device": self._device_key(actuator), "lower": lower, "upper": upper,
+                                       "step": DUTY_CYCLE_PERIODS[period]})
+        result = []
+        for start, stop, on_seconds in rows:
+            length = (datetime.fromisoformat(stop) - datetime.fromisoformat(start)).total_seconds()
+            result.append((start, stop, int(on_seconds), on_seconds / length if length else 0.0))
+        return result
+
 
-            c.close()
+    def get_rules(self) -> list[Rule]:
+        """
+        Henter alle automatiseringsreglene som er lagret i databasen
+        """
+        return [Rule(rule_id, sensor, op, threshold, actuator, parse_state(state), aggregate, window,
+                     parse_state(else_state) if else_state is not None else None)
+                for rule_id, sensor, aggregate, window, op, threshold, actuator, state, else_state
+                in self.run("all_rules")]
+
+
+    def add_rule(self, rule: Rule) -> int:
+        """
+        Lagrer en ny automatiseringsregel
+        Returns:
+            int: ID til den nye regelen
+        """
+        sensor, actuator = self._device_key(rule.sensor), self._device_key(rule.actuator)
+        if sensor is None or actuator is None:
+            raise ValueError(f"unknown device: {rule.sensor if sensor is None else rule.actuator}")
+        rows = self.run("insert_rule", (sensor, rule.aggregate, rule.window, rule.operator, rule.threshold,
+                                        actuator, str(rule.state),
+                                        None if rule.else_state is None else str(rule.else_state)))
+        self.conn.commit()
+        rule.id = rows[0][0]
+        return rule.id
+
+
+    def delete_rule(self, rule_id: int) -> bool:
+        """
+        Sletter en automatiseringsregel, returnerer True hvis regelen fantes
+        """
+        deleted = self.run("delete_rule", (rule_id,))
+        self.conn.commit()
+        return len(deleted) > 0
+
+
+    def calc_aggregates(self, unit: str, scope: str = "room", from_ts: Optional[str] = None,
+                        until_ts: Optional[str] = None) -> list[Aggregate]:
+        """
+        Beregner antall, gjennomsnitt, min og maks for alle målinger med en gitt enhet i et tidsrom,
+        gruppert per rom, per etasje eller for hele huset. Alle rom beregnes i én gruppert spørring,
+        og resultatet caches til det kommer en ny måling med samme enhet innenfor tidsrommet.
+        Args:
+            unit(str): Enheten til målingene, f.eks. '°C', '%' eller 'kWh'
+            scope(str): 'room', 'floor' eller 'house'
+            from_ts(Optional[str]): Start på tidsrommet (ISO format), ingen nedre grense hvis None
+            until_ts(Optional[str]): Slutt på tidsrommet (ISO format, ikke inkludert), ingen øvre grense hvis None
+        Returns:
+            list[Aggregate]: Ett aggregat per rom eller etasje som har målinger, eller ett for huset
+        """
+        lower = normalize_timestamp(from_ts) if from_ts else None
+        upper = normalize_timestamp(until_ts) if until_ts else None
+        key = (unit, lower, upper)
+        rows = self.aggregates.get(key) if self._latest is not None else None
+        if rows is None:
+            params = {"unit": self._unit_key(unit), "lower": lower, "upper": upper}
+            rows = self.run("unit_aggregates", params)
+            if self._chunked:
+                rows += self.run("chunk_aggregates", params)
+                #Biter som bare delvis er innenfor tidsrommet dekodes, 'group_aggregates' slår sammen rader for samme rom
+                for room, floor, start, count, data in self.run("partial_chunk_aggregates", params):
+                    values = [v for t, v in decode_chunk(start, data, count)
+                              if (lower is None or epoch_to_ts(t) >= lower) and (upper is None or epoch_to_ts(t) < upper)]
+                    if values:
+                        rows.append((room, floor, len(values), sum(values), min(values), max(values)))
+            if self._latest is not None and self._cacheable_analytics():
+                self.aggregates.put(key, rows)
+        return group_aggregates(rows, scope)
+
+
+    def _cached_analytics(self, key: tuple):
+        """
+        Henter et cachet resultat for en analyse per rom. Cachen brukes bare når huset er lastet med
+        'load_smarthouse', siden det er da nye målinger fjerner utdaterte resultater
+        """
+        return self.analytics.get(key) if self._latest is not None else None
+
+
+    def _cache_analytics(self, key: tuple, result) -> None:
+        if self._latest is not None and self._cacheable_analytics():
+            self.analytics.put(key, result)
+
+
+    def _cacheable_analytics(self) -> bool:
+        """
+        Resultater fra en lesekopi som henger etter databasen caches ikke, siden en måling som kom etter
+        kopien allerede har fjernet de berørte resultatene fra cachen. Sjekkes etter spørringen
+        """
+        return self.replica is None or self.replica.is_current()
 
 
     def calc_avg_temperatures_in_room(self, room, from_date: Optional[str] = None, until_date: Optional[str] = None) -> dict:
@@ -288,31 +2015,27 @@ WHERE device = '{actuator.id}';
         result = {}
         #Sjekker at 'room' faktisk er en instans av Room og at den har en gyldig database ID
         if isinstance(room, Room) and room.db_id is not None:
-            lower_bound_pred = "" #Vil inneholde SQL kode for start dato
-            upper_bound_pred = "" #Vil inneholde SQL kode for slutt dato
+            lower_bound = None #Vil inneholde start tidspunkt
+            upper_bound = None #Vil inneholde slutt tidspunkt
 
-            #Setter SQL koden for startdato/sluttdato hvis den er oppgitt og ikke None
+            #Setter start/slutt tidspunkt hvis dato er oppgitt og ikke None
             if from_date is not None:
-                lower_bound_pred = f"AND ts >= '{from_date} 00:00:00'"
+                lower_bound = f"{from_date} 00:00:00"
 
             if until_date is not None:
-                upper_bound_pred = f"AND ts <= '{until_date} 23:59:59'"
+                upper_bound = f"{until_date} 23:59:59"
 
-            query = f"""
-    SELECT STRFTIME('%Y-%m-%d', DATETIME(ts)), avg(value) 
-    FROM devices d 
-    INNER join measurements m ON m.device = d.id 
-    WHERE d.room = {room.db_id} AND m.unit = '°C' {lower_bound_pred} {upper_bound_pred}
-    GROUP BY STRFTIME('%Y-%m-%d', DATETIME(ts)) ;
-            """
+            key = (room.db_id, "avg_temperatures", lower_bound, upper_bound)
+            cached = self._cached_analytics(key)
+            if cached is not None:
+                return dict(cached)
 
-            cursor = self.cursor()
-            cursor.execute(query)
-            query_result = cursor.fetchall()
+            query_result = self.run("avg_temperatures", {"room": room.db_id, "lower": lower_bound, "upper": upper_bound})
 
             #Iterer over resultatet og legger til hver dato og dens gj.snitt temperatur i resultat ordboken
             for row in query_result:
                 result[row[0]] = float(row[1])
+            self._cache_analytics(key, dict(result))
 
         return result
 
@@ -332,32 +2055,60 @@ WHERE device = '{actuator.id}';
         #Sjekker at input objekt 'room' faktisk er en instans av 'Room' klassen og at det har en gyldig database ID
         if isinstance(room, Room) and room.db_id is not None:
 
-            query = f"""
-SELECT  STRFTIME('%H', DATETIME(m.ts)) AS hours
-FROM measurements m 
-INNER JOIN devices d ON m.device = d.id 
-INNER JOIN rooms r ON r.id = d.room 
-WHERE 
-r.id = {room.db_id} 
-AND m.unit = '%' 
-AND DATE(m.ts) = DATE('{date}')
-AND m.value > (
-	SELECT AVG(value) 
-	FROM measurements m 
-	INNER JOIN devices d on d.id = m.device
-	WHERE d.room = 4 AND DATE(ts) = DATE('{date}'))
-GROUP BY hours 
-HAVING COUNT(m.value) > 3; 
-            """
-
-            cursor = self.cursor()
-            cursor.execute(query)
-            #Iterer over resultatet og legger timene til resultatlisten
-            for h in cursor.fetchall():
-                result.append(int(h[0])) #Konverterer timen fra streng til heltall og legger den til i listen
+            #Cachen gjelder hele døgnet, og brukes bare for datoer som kan tolkes
+            try:
+                day = normalize_timestamp(date)[:10]
+                key = (room.db_id, "humidity_hours", f"{day} 00:00:00", f"{day} 23:59:59")
+            except ValueError:
+                key = None
+            cached = self._cached_analytics(key) if key else None
+            if cached is not None:
+                return list(cached)
+
+            chunks = self._room_chunks_on(room.db_id, date) if self._chunked else None
+            if chunks:
+                result = self._humidity_hours_with_chunks(room.db_id, date, chunks)
+            else:
+                query_result = self.run("humidity_hours", {"room": room.db_id, "date": date})
+
+                #Iterer over resultatet og legger timene til resultatlisten
+                for h in query_result:
+                    result.append(int(h[0])) #Konverterer timen fra streng til heltall og legger den til i listen
+            if key:
+                self._cache_analytics(key, list(result))
         return result
 
 
+    def _room_chunks_on(self, room_id: int, date: str) -> list[tuple]:
+        """
+        Henter de komprimerte bitene for sensorene i et rom som dekker døgnet 'date'
+        """
+        try:
+            start = ts_to_epoch(normalize_timestamp(date)[:10])
+        except ValueError:
+            return []
+        return self.run("room_chunks_on_day", {"room": room_id, "start": start})
+
+
+    def _humidity_hours_with_chunks(self, room_id: int, date: str, chunks: list[tuple]) -> list:
+        """
+        Samme beregning som spørringen 'humidity_hours', for dager der noen av målingene ligger i komprimerte biter
+        """
+        readings = list(self.run("room_readings_on_date", {"room": room_id, "date": date}))
+        for start, unit, count, data in chunks:
+            readings.extend((epoch_to_ts(t), v, unit) for t, v in decode_chunk(start, data, count))
+        if not readings:
+            return []
+        #Gjennomsnittet er for alle målingene i rommet den dagen, som i spørringen
+        average = sum(r[1] for r in readings) / len(readings)
+        counts: dict[int, int] = {}
+        for ts, value, unit in readings:
+            if unit == "%" and value > average:
+                hour = int(ts[11:13])
+                counts[hour] = counts.get(hour, 0) + 1
+        return sorted(h for h, c in counts.items() if c > 3)
+
+
 
 
 
@@ -370,4 +2121,7 @@ HAVING COUNT(m.value) > 3;
  #Filtrerer målingene til de som er over gjennomsnittet for dagen
 
 
-
+if __name__ == "__main__":
+    import sys
+    for database in sys.argv[1:]:
+        migrate_database(database)
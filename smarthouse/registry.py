@@ -0,0 +1,285 @@
+import logging
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+from smarthouse.alerting import AlertMonitor
+from smarthouse.automation import RuleEngine
+from smarthouse.domain import SmartHouse
+from smarthouse.energy import EnergyAnalytics
+from smarthouse.persistence import SmartHouseRepository
+from smarthouse.replica import DEFAULT_REPLICA_FILE
+from smarthouse.statewatch import StateWatch
+
+logger = logging.getLogger(__name__)
+
+#Id til huset som serveres under de gamle '/smarthouse/...' rutene
+DEFAULT_HOUSE_ID = "default"
+
+#Standard minnebudsjett (bytes) for alle innlastede hus til sammen
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+#Lovlige hus id'er, hindrer at en id kan brukes til å peke på filer utenfor datamappen
+_HOUSE_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class HouseNotFound(KeyError):
+    """
+    Kastes når det ikke finnes en database for en gitt hus id
+    """
+
+
+def estimate_house_size(house: SmartHouse) -> int:
+    """
+    Grovt estimat av hvor mange bytes et innlastet hus bruker i minnet,
+    summerer størrelsen av etasjer, rom og enheter med tilhørende strenger
+    Args:
+        house(SmartHouse): Huset som skal estimeres
+    Returns:
+        int: Estimert antall bytes
+    """
+    size = sys.getsizeof(house) + sys.getsizeof(house.floors)
+    for floor in house.floors:
+        size += sys.getsizeof(floor) + sys.getsizeof(floor.rooms)
+        for room in floor.rooms:
+            size += sys.getsizeof(room) + sys.getsizeof(room.devices) + sys.getsizeof(room.room_name)
+            for device in room.devices:
+                size += sys.getsizeof(device)
+                size += sum(sys.getsizeof(s) for s in (device.id, device.model_name, device.supplier, device.device_type))
+    return size
+
+
+def default_repository(file: str) -> SmartHouseRepository:
+    """
+    Lager et repository for en databasefil, med snapshot fil ved siden av databasen og en lesekopi
+    for analysespørringene (aggregater, energi, historikk og romanalyser), se 'AnalyticsReplica'.
+    Serveren migrerer databasene den får, så et hus med en eldre database kan brukes med en gang
+    """
+    return SmartHouseRepository(file, snapshot_file=file + ".snapshot", replica_file=DEFAULT_REPLICA_FILE,
+                                migrate=True)
+
+
+def house_file_resolver(data_dir: Path, default_file: Path) -> Callable[[str], Optional[str]]:
+    """
+    Lager en funksjon som finner databasefilen til et hus.
+    Standard huset bruker 'default_file', mens andre hus ligger som '<data_dir>/houses/<id>.sql'
+    """
+    def resolve(house_id: str) -> Optional[str]:
+        if house_id == DEFAULT_HOUSE_ID:
+            return str(default_file.absolute())
+        if not _HOUSE_ID.match(house_id):
+            return None
+        candidate = data_dir / "houses" / f"{house_id}.sql"
+        return str(candidate.absolute()) if candidate.exists() else None
+    return resolve
+
+
+class LoadedHouse:
+    """
+    Et innlastet hus: repository (databasetilkobling), den innlastede objektstrukturen,
+    automatiseringsreglene, varslingen, energianalysen og venting på tilstandsendringer for huset
+    """
+
+    def __init__(self, house_id: str, repo: SmartHouseRepository, house: SmartHouse) -> None:
+        self.house_id = house_id
+        self.repo = repo
+        self.house = house
+        #Ringbufferne med de nyeste målingene regnes med i minnebruken til huset. De fylles etter hvert
+        #som huset brukes, og registeret holder 'size' oppdatert (se 'HouseRegistry._resized')
+        self.size = estimate_house_size(house) + repo.recent.memory_used()
+        #En lesekopi i minnet er omtrent like stor som databasefilen
+        if repo.replica is not None and repo.replica.file == ":memory:":
+            self.size += os.path.getsize(repo.file)
+        self.automation = RuleEngine(repo.get_rules())
+        #Varslingen får alle nye målinger, også de som er satt inn av andre prosesser
+        self.alerts = AlertMonitor([d.id for d in house.get_devices() if d.is_sensor()])
+        repo.reading_listeners.append(lambda sensor, ts, value, unit: self.alerts.observe(sensor, value))
+        self.energy = EnergyAnalytics(repo)
+        #Long-polling på tilstanden til aktuatorene vekkes når tilstanden endres
+        self.states = StateWatch()
+        repo.state_listeners.append(self.states.changed)
+
+    def sync(self) -> None:
+        """
+        Synkroniserer huset med endringer gjort av andre prosesser, og laster reglene på nytt hvis noe er endret
+        """
+        if self.repo.sync_with_database():
+            self.automation.load(self.repo.get_rules())
+
+
+class HouseRegistry:
+    """
+    Register som holder oversikt over mange hus. Et hus lastes først inn når det brukes første gang,
+    og de minst nylig brukte husene kastes ut (LRU) når det samlede minnebudsjettet er brukt opp.
+    Budsjettet gjelder alle husene til sammen, inkludert ringbufferne som vokser etter innlastingen.
+    """
+
+    def __init__(self, resolve: Callable[[str], Optional[str]], memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 repository_factory: Callable[[str], SmartHouseRepository] = default_repository) -> None:
+        """
+        Args:
+            resolve(Callable): Funksjon som gir databasefilen til en hus id, eller None hvis huset ikke finnes
+            memory_budget(int): Maks antall bytes (estimert) for alle innlastede hus
+            repository_factory(Callable): Lager et repository fra en databasefil
+        """
+        self.resolve = resolve
+        self.memory_budget = memory_budget
+        self.repository_factory = repository_factory
+        self._houses: OrderedDict[str, LoadedHouse] = OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def get(self, house_id: str) -> LoadedHouse:
+        """
+        Henter et hus, og laster det inn fra databasen hvis det ikke allerede er i minnet
+        Raises:
+            HouseNotFound: hvis det ikke finnes noen database for huset
+        """
+        with self._lock:
+            entry = self._houses.get(house_id)
+            if entry is not None:
+                self._houses.move_to_end(house_id) #Markerer huset som nylig brukt
+                return entry
+            load_lock = self._load_locks.setdefault(house_id, threading.Lock())
+
+        #Lasting skjer utenfor hovedlåsen slik at andre hus kan brukes imens,
+        #mens låsen per hus hindrer at samme hus lastes inn to ganger samtidig
+        with load_lock:
+            with self._lock:
+                entry = self._houses.get(house_id)
+                if entry is not None:
+                    return entry
+            try:
+                entry = self._load(house_id)
+            except Exception:
+                with self._lock:
+                    self._load_locks.pop(house_id, None)
+                raise
+            with self._lock:
+                self._houses[house_id] = entry
+                self._used += entry.size
+                self._load_locks.pop(house_id, None)
+                self._evict(keep=house_id)
+            return entry
+
+    def _load(self, house_id: str) -> LoadedHouse:
+        file = self.resolve(house_id)
+        if file is None:
+            raise HouseNotFound(house_id)
+        repo = self.repository_factory(file)
+        entry = LoadedHouse(house_id, repo, repo.load_smarthouse())
+        repo.recent.on_resize = lambda delta: self._resized(entry, delta)
+        return entry
+
+    def _resized(self, entry: LoadedHouse, delta: int) -> None:
+        """
+        Oppdaterer minnebruken når ringbufferne til et hus vokser eller krymper,
+        og kaster ut andre hus hvis det samlede budsjettet er brukt opp
+        """
+        with self._lock:
+            entry.size += delta
+            if self._houses.get(entry.house_id) is entry:
+                self._used += delta
+                if delta > 0:
+                    self._evict(keep=entry.house_id)
+
+    def _evict(self, keep: str) -> None:
+        """
+        Kaster ut de minst nylig brukte husene til vi er innenfor budsjettet.
+        Huset 'keep' kastes aldri ut, selv om det alene er større enn budsjettet.
+        Tilkoblingen lukkes ikke eksplisitt, siden en forespørsel fortsatt kan bruke den,
+        den lukkes når repository objektet ikke lenger er referert.
+        """
+        while self._used > self.memory_budget and len(self._houses) > 1:
+            oldest_id = next(iter(self._houses))
+            if oldest_id == keep:
+                self._houses.move_to_end(oldest_id)
+                continue
+            self._pop(oldest_id)
+
+    def _pop(self, house_id: str) -> bool:
+        entry = self._houses.pop(house_id, None)
+        if entry is None:
+            return False
+        self._used -= entry.size
+        return True
+
+    def evict(self, house_id: str) -> bool:
+        """
+        Fjerner et hus fra minnet, returnerer True hvis huset var innlastet
+        """
+        with self._lock:
+            return self._pop(house_id)
+
+    def loaded(self) -> list[str]:
+        """
+        Returnerer id'ene til husene som er i minnet, minst nylig brukt først
+        """
+        with self._lock:
+            return list(self._houses)
+
+    def flush_snapshots(self) -> None:
+        """
+        Skriver snapshot som venter i bakgrunnen for alle innlastede hus, f.eks. før serveren stopper
+        """
+        with self._lock:
+            entries = list(self._houses.values())
+        for entry in entries:
+            entry.repo.flush_snapshot()
+
+    @property
+    def memory_used(self) -> int:
+        return self._used
+
+
+class HouseWarmer:
+    """
+    Laster inn en liste med hus i en bakgrunnstråd, slik at serveren kan ta imot forespørsler
+    med en gang og rapportere når husene er 'varme' (innlastet)
+    """
+
+    def __init__(self, registry: HouseRegistry, house_ids: list[str]) -> None:
+        self.registry = registry
+        #Status per hus: 'pending', 'loading', 'ready' eller 'failed'
+        self.status: dict[str, str] = {house_id: "pending" for house_id in house_ids}
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="house-warmer", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stop(self) -> None:
+        """
+        Avbryter innlastingen og venter på tråden. Et hus som er under innlasting lastes ferdig,
+        resten blir stående som 'pending'
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        for house_id in self.status:
+            if self._stopped.is_set():
+                return
+            self.status[house_id] = "loading"
+            try:
+                self.registry.get(house_id)
+                self.status[house_id] = "ready"
+            except Exception:
+                logger.exception("Loading house %s failed", house_id)
+                self.status[house_id] = "failed"
+
+    @property
+    def ready(self) -> bool:
+        return all(s == "ready" for s in self.status.values())
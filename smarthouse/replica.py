@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from smarthouse.snapshot import read_file_header
+
+"""
+Lesekopi av databasen for tunge analysespørringer (historikk, døgn- og romanalyser, aggregater).
+Kopien lages med SQLite sitt backup API fra en skrivebeskyttet tilkobling, og spørringene kjører på
+kopiens egen tilkobling. En lang analysespørring holder da verken tilkoblingen eller leselåsen til
+databasen, så innsetting av målinger går som normalt mens rapporter kjører.
+
+Kopien oppdateres før en spørring hvis databasen er endret siden forrige kopi ('file change counter' i
+filheaderen) og kopien er eldre enn 'max_age' sekunder. Med jevn innsetting av målinger blir det da én kopi
+av databasen per 'max_age' sekunder (standard 'DEFAULT_MAX_AGE'), i stedet for én per rapport, og rapportene
+kan henge så mye etter. Med 'max_age' 0 ser spørringene alltid de siste endringene, men da tar hver spørring
+etter en endring en kopi av hele databasen. Selve kopien holder leselåsen bare mens sidene kopieres.
+"""
+
+#Standard maks alder (sekunder) på kopien når databasen er endret
+DEFAULT_MAX_AGE = 5.0
+
+#Standard fil for kopien som brukes av serveren (se 'registry.default_repository'), i minnet
+DEFAULT_REPLICA_FILE = ":memory:"
+
+
+class AnalyticsReplica:
+    """
+    Kopi av en databasefil i minnet (standard) eller i en egen fil, med én tilkobling for analysespørringer
+    """
+
+    def __init__(self, source_file: str, file: str = ":memory:", max_age: float = DEFAULT_MAX_AGE,
+                 cached_statements: int = 128) -> None:
+        """
+        Args:
+            source_file(str): Databasefilen som kopieres
+            file(str): Filen kopien skrives til, ':memory:' holder kopien i minnet
+            max_age(float): Sekunder en kopi brukes etter at databasen er endret, før den lages på nytt
+            cached_statements(int): Størrelsen på 'statement cache' til tilkoblingen til kopien
+        """
+        self.source_file = source_file
+        self.file = file
+        self.max_age = max_age
+        self.cached_statements = cached_statements
+        self.refreshes = 0 #Antall ganger kopien er laget
+        self._conn: Optional[sqlite3.Connection] = None
+        self._counter: Optional[tuple[int, int]] = None #Filheaderen til databasen da kopien ble laget
+        self._refreshed = 0.0
+        #Én spørring eller oppdatering av kopien om gangen, tilkoblingen til databasen berøres ikke
+        self._lock = threading.Lock()
+
+    def _refresh_if_stale(self) -> None:
+        counter = read_file_header(self.source_file)
+        if self._conn is not None and (counter == self._counter or time.monotonic() - self._refreshed < self.max_age):
+            return
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.file, check_same_thread=False, cached_statements=self.cached_statements)
+        #Headeren er lest før kopien, så en endring underveis gjør at kopien lages på nytt neste gang
+        source = sqlite3.connect(f"file:{self.source_file}?mode=ro", uri=True)
+        try:
+            source.backup(self._conn)
+        finally:
+            source.close()
+        self._counter = counter
+        self._refreshed = time.monotonic()
+        self.refreshes += 1
+
+    def is_current(self) -> bool:
+        """
+        Sier om kopien har alle endringene i databasen, dvs. at resultater fra den kan caches
+        """
+        return self._conn is not None and read_file_header(self.source_file) == self._counter
+
+    def execute(self, sql: str, params: tuple | dict = ()) -> list[tuple]:
+        """
+        Utfører en lesespørring på kopien, og oppdaterer kopien først hvis den er for gammel
+        """
+        with self._lock:
+            self._refresh_if_stale()
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._counter = None
@@ -0,0 +1,274 @@
+import copy
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+"""
+Ringbuffere med fast kapasitet for de siste verdiene fra en sensor.
+Verdiene ligger i en 'array' av flyttall, så minnebruken er kjent (8 bytes per plass) og
+en ny verdi overskriver den eldste uten at noe flyttes eller allokeres.
+'RecentReadings' holder de siste målingene per sensor, slik at '/values?n=' ikke må gå til databasen.
+"""
+
+
+class RingBuffer:
+    """
+    Holder de siste 'capacity' verdiene, med løpende sum slik at gjennomsnittet er O(1)
+    """
+    __slots__ = ("capacity", "_values", "_next", "_count", "_sum", "_appends")
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._values = array("d", bytes(8 * capacity))
+        self._next = 0 #Indeksen neste verdi skrives til
+        self._count = 0
+        self._sum = 0.0
+        self._appends = 0 #Antall innsettinger siden summen sist ble regnet helt på nytt
+
+    def append(self, value: float) -> None:
+        if self._count == self.capacity:
+            self._sum -= self._values[self._next]
+        else:
+            self._count += 1
+        self._values[self._next] = value
+        self._sum += value
+        self._next = (self._next + 1) % self.capacity
+
+        #Den løpende summen får små avrundingsfeil over tid, så den regnes på nytt en gang per runde
+        self._appends += 1
+        if self._appends >= self.capacity:
+            self._appends = 0
+            self._sum = sum(self)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[float]:
+        """
+        Går gjennom verdiene fra eldste til nyeste
+        """
+        start = (self._next - self._count) % self.capacity
+        for i in range(self._count):
+            yield self._values[(start + i) % self.capacity]
+
+    @property
+    def full(self) -> bool:
+        return self._count == self.capacity
+
+    def last(self) -> float:
+        if self._count == 0:
+            raise IndexError("empty ring buffer")
+        return self._values[(self._next - 1) % self.capacity]
+
+    def mean(self) -> float:
+        if self._count == 0:
+            raise IndexError("empty ring buffer")
+        return self._sum / self._count
+
+    def min(self) -> float:
+        return min(self)
+
+    def max(self) -> float:
+        return max(self)
+
+
+#Omtrentlig antall bytes for ett tidsstempel (streng på 19 tegn) og én plass i et 'ReadingRing'
+_TIMESTAMP_BYTES = 68
+_SLOT_BYTES = 8 + 2 * 8
+
+
+class ReadingRing(RingBuffer):
+    """
+    Ringbuffer med de siste målingene fra én sensor: verdi, tidsstempel og enhet på samme plass.
+    Målingene må komme i stigende tidsrekkefølge. 'complete' sier om ringen inneholder alle
+    målingene til sensoren (den har aldri vært full), og ikke bare de nyeste.
+    """
+    __slots__ = ("timestamps", "units", "complete")
+
+    def __init__(self, capacity: int) -> None:
+        super().__init__(capacity)
+        self.timestamps: list[str | None] = [None] * capacity
+        self.units: list[str | None] = [None] * capacity
+        self.complete = True
+
+    def _push(self, timestamp: str, value: float, unit: str | None) -> None:
+        if self.full:
+            self.complete = False
+        i = self._next
+        self.timestamps[i] = timestamp
+        self.units[i] = unit
+        self.append(value)
+
+    def add(self, timestamp: str, value: float, unit: str | None) -> bool:
+        """
+        Legger til en ny måling
+        Returns:
+            bool: False hvis målingen er eldre enn den nyeste i ringen, da er ringen ikke lenger riktig
+        """
+        if self._count and timestamp < self.timestamps[(self._next - 1) % self.capacity]:
+            return False
+        self._push(timestamp, value, unit)
+        return True
+
+    def covers(self, n: int | None) -> bool:
+        """
+        Sjekker om de 'n' nyeste målingene (alle hvis None) kan hentes fra ringen
+        """
+        return self.complete or (n is not None and n <= self._count)
+
+    def newest(self, n: int | None = None) -> list[tuple]:
+        """
+        Returnerer de 'n' nyeste målingene (alle hvis None) som (ts, value, unit), nyeste først
+        """
+        count = self._count if n is None else min(n, self._count)
+        result = []
+        for k in range(1, count + 1):
+            i = (self._next - k) % self.capacity
+            result.append((self.timestamps[i], self._values[i], self.units[i]))
+        return result
+
+    def newest_values(self, n: int) -> list[float]:
+        count = min(n, self._count)
+        return [self._values[(self._next - k) % self.capacity] for k in range(1, count + 1)]
+
+    def nbytes(self) -> int:
+        return self.capacity * _SLOT_BYTES + self._count * _TIMESTAMP_BYTES
+
+
+class RecentReadings:
+    """
+    De siste målingene per sensor i minnet, et 'ReadingRing' per sensor med fast kapasitet.
+    Antall sensorer med ring er begrenset av 'max_sensors', de minst nylig brukte kastes ut
+    først, slik at minnebruken aldri blir mer enn ca. 'max_sensors' fulle ringer.
+    Minnebruken holdes oppdatert etter hvert som ringene lages og fylles, og 'on_resize' kalles
+    med endringen (bytes), f.eks. slik at et register over mange hus kan holde et felles budsjett.
+    """
+
+    def __init__(self, capacity: int, max_sensors: int) -> None:
+        self.capacity = capacity
+        self.max_sensors = max_sensors
+        self._rings: OrderedDict[str, ReadingRing] = OrderedDict()
+        self._lock = threading.Lock()
+        self.writes = 0 #Økes for hver endring, se 'put'
+        self._nbytes = 0
+        self.on_resize: Callable[[int], None] | None = None
+
+    def _resized(self, delta: int) -> None:
+        #Kalles etter at låsen er sluppet, slik at den som lytter kan ta sine egne låser
+        if delta and self.on_resize is not None:
+            self.on_resize(delta)
+
+    def _trim(self) -> int:
+        #Kaster ut de minst nylig brukte ringene over 'max_sensors', returnerer antall bytes som ble frigjort
+        freed = 0
+        while len(self._rings) > self.max_sensors:
+            freed += self._rings.popitem(last=False)[1].nbytes()
+        return freed
+
+    def _get(self, sensor: str) -> ReadingRing | None:
+        ring = self._rings.get(sensor)
+        if ring is not None:
+            self._rings.move_to_end(sensor)
+        return ring
+
+    def has(self, sensor: str) -> bool:
+        with self._lock:
+            return sensor in self._rings
+
+    def newest(self, sensor: str, n: int | None) -> list[tuple] | None:
+        """
+        Returnerer de 'n' nyeste målingene til sensoren (alle hvis None), nyeste først,
+        eller None hvis sensoren ikke har en ring som dekker forespørselen
+        """
+        with self._lock:
+            ring = self._get(sensor)
+            if ring is None or not ring.covers(n):
+                return None
+            return ring.newest(n)
+
+    def newest_values(self, sensor: str, n: int) -> list[float] | None:
+        """
+        Som 'newest', men bare verdiene
+        """
+        with self._lock:
+            ring = self._get(sensor)
+            if ring is None or not ring.covers(n):
+                return None
+            return ring.newest_values(n)
+
+    def put(self, sensor: str, rows: list[tuple], writes: int | None = None) -> None:
+        """
+        Lager ringen til en sensor fra rader (ts, value, unit) hentet fra databasen, nyeste først.
+        Er det like mange rader som kapasiteten kan det finnes eldre målinger, og ringen er ikke komplett.
+        Args:
+            writes(int | None): Verdien av 'writes' før radene ble hentet. Er noe endret siden,
+                                kan radene være utdatert og ringen lages ikke
+        """
+        ring = ReadingRing(self.capacity)
+        for ts, value, unit in reversed(rows[:self.capacity]):
+            ring._push(ts, value, unit)
+        ring.complete = len(rows) < self.capacity
+        with self._lock:
+            if writes is not None and writes != self.writes:
+                return
+            old = self._rings.get(sensor)
+            delta = ring.nbytes() - (old.nbytes() if old is not None else 0)
+            self._rings[sensor] = ring
+            self._rings.move_to_end(sensor)
+            delta -= self._trim()
+            self._nbytes += delta
+        self._resized(delta)
+
+    def add(self, sensor: str, timestamp: str, value: float, unit: str | None) -> None:
+        """
+        Legger en ny måling inn i ringen til sensoren, hvis sensoren har en ring.
+        Kommer målingen i feil rekkefølge fjernes ringen, og den lages på nytt fra databasen ved neste lesing
+        """
+        with self._lock:
+            self.writes += 1
+            ring = self._rings.get(sensor)
+            if ring is None:
+                return
+            before = ring.nbytes()
+            if ring.add(timestamp, value, unit):
+                delta = ring.nbytes() - before
+            else:
+                del self._rings[sensor]
+                delta = -before
+            self._nbytes += delta
+        self._resized(delta)
+
+    def discard(self, sensor: str) -> None:
+        with self._lock:
+            self.writes += 1
+            ring = self._rings.pop(sensor, None)
+            delta = -ring.nbytes() if ring is not None else 0
+            self._nbytes += delta
+        self._resized(delta)
+
+    def rings(self) -> dict[str, ReadingRing]:
+        """
+        Returnerer en kopi av alle ringene, f.eks. for å skrive dem til et snapshot
+        """
+        with self._lock:
+            return copy.deepcopy(dict(self._rings))
+
+    def load(self, rings: dict[str, ReadingRing]) -> None:
+        """
+        Erstatter alle ringene, f.eks. med ringene fra et snapshot. Ringer med annen kapasitet hoppes over
+        """
+        with self._lock:
+            self.writes += 1
+            self._rings = OrderedDict((s, r) for s, r in rings.items() if r.capacity == self.capacity)
+            self._trim()
+            nbytes = sum(r.nbytes() for r in self._rings.values())
+            delta = nbytes - self._nbytes
+            self._nbytes = nbytes
+        self._resized(delta)
+
+    def memory_used(self) -> int:
+        with self._lock:
+            return self._nbytes
@@ -0,0 +1,109 @@
+import io
+import itertools
+import json
+from typing import Any
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from smarthouse.domain import MeasurementSeries
+
+"""
+Serialiseringslag for API'et. I stedet for å gå rekursivt gjennom objektene med 'jsonable_encoder'
+kodes pydantic modeller med pydantic sin egen (kompilerte) JSON serialisering, og målinger i en
+'MeasurementSeries' skrives rett fra kolonnene til utdata (se 'encode_series'), uten å lage et
+'Measurement' objekt eller en ordbok per måling.
+orjson brukes hvis det er installert, ellers faller vi tilbake til standardbiblioteket sitt 'json'.
+"""
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson er valgfritt
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """
+    Hjelpefunksjon som gjør om typer json-biblioteket ikke kjenner til noe som kan serialiseres
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, MeasurementSeries):
+        return series_rows(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+#JSON koding av en streng med anførselstegn, C implementasjonen fra standardbiblioteket når den finnes
+_encode_str = json.encoder.encode_basestring
+
+#Én måling uten enheten, som kommer ferdig kodet fra 'encode_series'
+_ROW = '{"timestamp":%s,"value":%r%s'.__mod__
+
+#Antall målinger som kodes om gangen før de skrives til bufferet
+SERIES_CHUNK = 1024
+
+
+def encode_series(series: MeasurementSeries) -> bytes:
+    """
+    Koder en serie som en JSON liste på samme form som 'Measurement', ved å skrive kolonnene (ts, value, unit)
+    rett til en buffer, 'SERIES_CHUNK' målinger om gangen. Det lages ingen ordbok per måling, og bare én bit
+    av den kodede teksten finnes som streng om gangen. Enhetene er internert i serien, så hver enhet kodes én gang
+    """
+    units = {unit: ',"unit":' + ("null" if unit is None else _encode_str(unit)) + "}" for unit in set(series.units)}
+    rows = zip(map(_encode_str, series.timestamps), series.values, map(units.__getitem__, series.units))
+    out = io.BytesIO()
+    out.write(b"[")
+    separator = b""
+    while True:
+        chunk = ",".join(map(_ROW, itertools.islice(rows, SERIES_CHUNK)))
+        if not chunk:
+            break
+        out.write(separator)
+        out.write(chunk.encode("utf-8"))
+        separator = b","
+    out.write(b"]")
+    result = out.getvalue()
+    #NaN og uendelig finnes ikke i JSON, og blir null som i orjson. Inne i en kodet streng står et
+    #anførselstegn alltid som \", så mønsteret kan bare treffe selve verdiene
+    if b'"value":nan' in result or b'"value":inf' in result or b'"value":-inf' in result:
+        for bad in (b'"value":nan', b'"value":inf', b'"value":-inf'):
+            result = result.replace(bad, b'"value":null')
+    return result
+
+
+def series_rows(series: MeasurementSeries) -> list[dict]:
+    """
+    Gjør om en serie til en liste med enkle ordbøker, på samme form som 'Measurement'.
+    Brukes bare for en serie inne i annet innhold, en serie alene kodes med 'encode_series'
+    """
+    return [{"timestamp": ts, "value": value, "unit": unit}
+            for ts, value, unit in zip(series.timestamps, series.values, series.units)]
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialiserer innholdet til JSON bytes.
+    Args:
+        content(Any): pydantic modell, 'MeasurementSeries', lister av disse eller vanlige python verdier
+    Returns:
+        bytes: JSON kodet innhold
+    """
+    if isinstance(content, BaseModel):
+        return content.model_dump_json().encode("utf-8")
+    if isinstance(content, list) and content and all(isinstance(x, BaseModel) for x in content):
+        return b"[" + b",".join(x.model_dump_json().encode("utf-8") for x in content) + b"]"
+    if isinstance(content, MeasurementSeries):
+        return encode_series(content)
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """
+    JSON respons som bruker 'dumps' over i stedet for 'jsonable_encoder' + json.dumps
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
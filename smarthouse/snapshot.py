@@ -0,0 +1,115 @@
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from typing import Optional
+
+from smarthouse.domain import SmartHouse
+
+"""
+Binært snapshot av et innlastet 'SmartHouse' (topologi, aktuatortilstander, siste måling og ringbufferne
+med de nyeste målingene per sensor),
+slik at nye prosesser slipper å bygge objektstrukturen rad for rad fra SQL ved oppstart.
+
+Filformat: et fast header (se '_HEADER') etterfulgt av en pickle av innholdet.
+Headeren kan valideres uten å lese resten av filen, og inneholder et stempel fra databasen:
+- 'schema cookie' og 'file change counter' fra SQLite sin egen filheader
+  (den vedvarende utgaven av 'PRAGMA schema_version'/'PRAGMA data_version'),
+- et fingeravtrykk av topologien (antall og største rowid i rooms og devices).
+Snapshot filer skrives og leses kun av denne prosessen/tjenesten, pickle er derfor trygt her.
+"""
+
+MAGIC = b"SHSNAP"
+FORMAT_VERSION = 3
+
+#magic, formatversjon, schema cookie, change counter, topologi fingeravtrykk (4 tall), største målings-rowid,
+#største 'seq' i loggen over slettede målinger
+_HEADER = struct.Struct(">6sHII4qqq")
+
+
+class DatabaseStamp:
+    """
+    Stempel som sier hvilken tilstand av databasen et snapshot ble laget fra
+    """
+
+    def __init__(self, schema_cookie: int, change_counter: int, topology: tuple[int, int, int, int]) -> None:
+        self.schema_cookie = schema_cookie
+        self.change_counter = change_counter
+        self.topology = topology
+
+
+def read_file_header(file: str) -> tuple[int, int]:
+    """
+    Leser 'file change counter' (offset 24) og 'schema cookie' (offset 40) fra SQLite sin filheader.
+    Telleren økes hver gang en transaksjon endrer databasen (i rollback journal modus)
+    Returns:
+        tuple[int, int]: (schema cookie, change counter)
+    """
+    with open(file, "rb") as f:
+        header = f.read(100)
+    change_counter, = struct.unpack_from(">I", header, 24)
+    schema_cookie, = struct.unpack_from(">I", header, 40)
+    return schema_cookie, change_counter
+
+
+class Snapshot:
+    """
+    Innholdet i et snapshot etter innlasting
+    """
+
+    def __init__(self, stamp: DatabaseStamp, house: SmartHouse, latest: dict, measurement_rowid: int,
+                 recent: Optional[dict] = None, delete_seq: int = 0) -> None:
+        self.stamp = stamp
+        self.house = house
+        self.latest = latest #sensor id -> (ts, value, unit)
+        self.measurement_rowid = measurement_rowid
+        self.recent = recent if recent is not None else {} #sensor id -> ReadingRing
+        self.delete_seq = delete_seq
+
+
+def write_snapshot(path: str, snapshot: Snapshot) -> None:
+    """
+    Skriver snapshot til fil. Skrives først til en midlertidig fil som så byttes inn,
+    slik at andre prosesser aldri leser et halvskrevet snapshot
+    """
+    stamp = snapshot.stamp
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, stamp.schema_cookie, stamp.change_counter,
+                          *stamp.topology, snapshot.measurement_rowid, snapshot.delete_seq)
+    payload = pickle.dumps((snapshot.house, snapshot.latest, snapshot.recent), protocol=pickle.HIGHEST_PROTOCOL)
+    #Unikt navn på den midlertidige filen, så tråder og prosesser som skriver samtidig ikke deler fil
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_snapshot(path: str, schema_cookie: int, topology: tuple[int, int, int, int]) -> Optional[Snapshot]:
+    """
+    Leser et snapshot hvis det finnes og fortsatt er gyldig for databasen.
+    Filen mappes inn i minnet, og headeren sjekkes før resten av innholdet leses.
+    Returns:
+        Optional[Snapshot]: Snapshot, eller None hvis filen mangler, har feil format eller er utdatert
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            magic, version, cookie, counter, r_count, r_max, d_count, d_max, rowid, delete_seq = _HEADER.unpack_from(m, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+            #Endret skjema eller topologi betyr at snapshot er utdatert, og huset må lastes fra SQL
+            if cookie != schema_cookie or (r_count, r_max, d_count, d_max) != tuple(topology):
+                return None
+            house, latest, recent = pickle.loads(m[_HEADER.size:])
+    return Snapshot(DatabaseStamp(cookie, counter, (r_count, r_max, d_count, d_max)), house, latest, rowid, recent,
+                    delete_seq)
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable
+
+"""
+Venting på endringer i tilstanden til aktuatorer, for long-polling ('GET /actuator/{uuid}/current?wait=..&since=..').
+Endringer kommer fra tråder (endepunktene og synkroniseringen kjører i threadpool), mens forespørslene som venter
+er coroutines i event loop. 'StateWatch' får beskjed via 'state_listeners' til repository og vekker de som venter
+på aktuatoren med 'call_soon_threadsafe', så en endring i samme prosess sees med en gang.
+Endringer fra andre prosesser (uvicorn workers) sees først når huset synkroniseres, derfor synkroniserer
+den som venter huset med jevne mellomrom ('sync_interval').
+"""
+
+#Sekunder mellom hver synkronisering med databasen mens en forespørsel venter
+DEFAULT_SYNC_INTERVAL = 1.0
+
+
+class StateWatch:
+    """
+    Holder oversikt over forespørsler som venter på en ny versjon av tilstanden til en aktuator
+    """
+
+    def __init__(self, sync_interval: float = DEFAULT_SYNC_INTERVAL) -> None:
+        self.sync_interval = sync_interval
+        self._waiters: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+        self._lock = threading.Lock()
+
+    def changed(self, actuator: str, version: int) -> None:
+        """
+        Vekker alle som venter på aktuatoren. Kalles fra hvilken som helst tråd (se 'state_listeners')
+        """
+        with self._lock:
+            waiters = self._waiters.pop(actuator, ())
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, version)
+
+    def waiting(self, actuator: str) -> int:
+        with self._lock:
+            return len(self._waiters.get(actuator, ()))
+
+    async def wait(self, actuator: str, since: int, timeout: float, version: Callable[[], int],
+                   sync: Callable[[], Awaitable[None]]) -> int:
+        """
+        Venter til versjonen til aktuatoren er en annen enn 'since', eller til 'timeout' sekunder har gått
+        Args:
+            actuator(str): ID til aktuatoren
+            since(int): Versjonen den som spør allerede har
+            timeout(float): Maks antall sekunder å vente
+            version(Callable): Gir gjeldende versjon
+            sync(Callable): Synkroniserer huset med endringer fra andre prosesser
+        Returns:
+            int: Versjonen når ventingen er over, lik 'since' hvis ingenting er endret
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            future = loop.create_future()
+            waiter = (loop, future)
+            with self._lock:
+                self._waiters.setdefault(actuator, set()).add(waiter)
+            try:
+                #Sjekker etter at vi er registrert, så en endring rett før ikke går tapt
+                current = version()
+                remaining = deadline - loop.time()
+                if current != since or remaining <= 0:
+                    return current
+                try:
+                    return await asyncio.wait_for(future, min(remaining, self.sync_interval))
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._lock:
+                    waiters = self._waiters.get(actuator)
+                    if waiters is not None:
+                        waiters.discard(waiter)
+                        if not waiters:
+                            del self._waiters[actuator]
+            await sync()
+
+
+def _resolve(future: asyncio.Future, version: int) -> None:
+    if not future.done():
+        future.set_result(version)
@@ -0,0 +1,32 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from smarthouse.persistence import migrate_database
+
+DB_FILE = Path(__file__).parent / "../data/db.sql"
+
+
+class DatabaseCopyTest(unittest.TestCase):
+    """
+    Base for tests that write to the database: every test gets its own copy of data/db.sql
+    in a temporary directory ('self.file'), which is removed after the test. The copy is migrated
+    to the current schema unless 'migrate' is False, the bundled file itself is never touched
+    """
+    db_file = DB_FILE
+    migrate = True
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # cleanups run after tearDown, so subclasses can close their repositories there first
+        self.addCleanup(self.tmp.cleanup)
+        self.data_dir = Path(self.tmp.name)
+        self.file = str(self.copy_database("db.sql"))
+        if self.migrate:
+            migrate_database(self.file)
+
+    def copy_database(self, name: str) -> Path:
+        target = self.data_dir / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(self.db_file, target)
+        return target
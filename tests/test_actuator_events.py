@@ -0,0 +1,89 @@
+import unittest
+from smarthouse.persistence import STATEMENTS, SmartHouseRepository
+from db_copy import DatabaseCopyTest
+
+
+class ActuatorEventTest(DatabaseCopyTest):
+    plug = "1a66c3d6-22b2-446e-bf5c-eb5b9d1a8c79"
+    bulb = "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"
+
+    def setUp(self):
+        super().setUp()
+        self.repo = SmartHouseRepository(self.file)
+
+    def tearDown(self):
+        del self.repo
+
+    def log(self, device, *events):
+        self.repo.cursor().executemany(
+            "INSERT INTO actuator_events (device, ts, old, new, source) "
+            "VALUES ((SELECT key FROM devices WHERE id = ?), ?, ?, ?, 'test')",
+            [(device, ts, old, new) for ts, old, new in events])
+        self.repo.conn.commit()
+
+    def test_state_versions(self):
+        self.log(self.plug, ("2024-01-01 10:00:00", None, 1.0), ("2024-01-01 11:00:00", 1.0, None))
+        self.log(self.bulb, ("2024-01-01 10:30:00", None, 1.0))
+        plug_version, bulb_version = 2, 3
+        queries = []
+        self.repo.conn.set_trace_callback(queries.append)
+        house = self.repo.load_smarthouse()
+        self.repo.conn.set_trace_callback(None)
+        # seeded with the newest change per actuator, without reading the whole log
+        self.assertEqual((plug_version, bulb_version, 0), (self.repo.state_version(self.plug),
+                         self.repo.state_version(self.bulb), self.repo.state_version("no-such-device")))
+        self.assertFalse([sql for sql in queries if "rowid > " in sql])
+
+        changes = []
+        self.repo.state_listeners.append(lambda *args: changes.append(args))
+        plug = house.get_device_by_id(self.plug)
+        plug.turn_on()
+        self.repo.update_actuator_state(plug)
+        self.assertEqual([(self.plug, bulb_version + 1)], changes)
+        self.assertEqual(bulb_version + 1, self.repo.state_version(self.plug))
+
+    def test_state_changes_are_logged(self):
+        h = self.repo.load_smarthouse_deep()
+        plug = h.get_device_by_id(self.plug)
+        bulb = h.get_device_by_id(self.bulb)
+        plug.turn_on()
+        bulb.turn_on(0.5)
+        self.repo.update_actuator_states([plug, bulb], source="test")
+        # unchanged state is not logged again
+        self.repo.update_actuator_state(plug, source="test")
+        plug.turn_off()
+        self.repo.update_actuator_state(plug)
+
+        timeline = self.repo.get_state_timeline(self.plug)
+        self.assertEqual([(None, 1.0, "test"), (1.0, None, None)], [row[1:] for row in timeline])
+        self.assertEqual([(None, 0.5)], [row[1:3] for row in self.repo.get_state_timeline(self.bulb)])
+        self.assertEqual([], self.repo.get_state_timeline(self.plug, "2000-01-01", "2000-01-02"))
+
+    def test_duty_cycle(self):
+        self.log(self.plug,
+                 ("2024-02-01 06:00:00", None, 1.0),
+                 ("2024-02-01 18:00:00", 1.0, None),
+                 ("2024-02-02 22:00:00", None, 1.0),
+                 ("2024-02-03 04:00:00", 1.0, None))
+        result = self.repo.calc_duty_cycle(self.plug, "2024-02-01", "2024-02-04")
+        self.assertEqual([("2024-02-01 00:00:00", "2024-02-02 00:00:00", 12 * 3600, 0.5),
+                          ("2024-02-02 00:00:00", "2024-02-03 00:00:00", 2 * 3600, 2 / 24),
+                          ("2024-02-03 00:00:00", "2024-02-04 00:00:00", 4 * 3600, 4 / 24)], result)
+
+        # the state at the start of the range comes from the last change before it
+        hours = self.repo.calc_duty_cycle(self.plug, "2024-02-01T17:30", "2024-02-01T19:00", "hour")
+        self.assertEqual([1800, 0], [on for _, _, on, _ in hours])
+        self.assertEqual("2024-02-01 18:30:00", hours[1][0])
+
+        # no events at all: the current state is used
+        self.assertEqual([(0, 0.0)], [r[2:] for r in self.repo.calc_duty_cycle(self.bulb, "2024-02-01", "2024-02-02")])
+        self.assertRaises(ValueError, self.repo.calc_duty_cycle, self.plug, "2024-02-01", "2024-02-02", "week")
+
+    def test_timeline_uses_index(self):
+        plan = self.repo.cursor().execute("EXPLAIN QUERY PLAN " + STATEMENTS["state_timeline"],
+                                          {"device": 1, "lower": "", "upper": "9"}).fetchall()
+        self.assertIn("actuator_events_device_ts", " ".join(row[-1] for row in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from smarthouse.domain import Measurement
+from smarthouse.persistence import STATEMENTS, SmartHouseRepository, statement_shape
+from db_copy import DatabaseCopyTest
+
+
+class AggregateTest(DatabaseCopyTest):
+    humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+    temperature = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+
+    def setUp(self):
+        super().setUp()
+        self.repo = SmartHouseRepository(self.file)
+
+    def tearDown(self):
+        del self.repo
+
+    def queries(self):
+        stats = self.repo.stats.by_shape.get(statement_shape(STATEMENTS["unit_aggregates"]))
+        return stats.count if stats else 0
+
+    def test_scopes(self):
+        h = self.repo.load_smarthouse_deep()
+        rooms = self.repo.calc_aggregates("°C", "room", "2024-01-28", "2024-01-31")
+        by_room = {a.id: a for a in rooms}
+        room = next(r for r in h.get_rooms() if r.db_id in by_room)
+        daily = self.repo.calc_avg_temperatures_in_room(room, "2024-01-28", "2024-01-30")
+        self.assertGreater(len(daily), 0)
+
+        floors = self.repo.calc_aggregates("°C", "floor", "2024-01-28", "2024-01-31")
+        house = self.repo.calc_aggregates("°C", "house", "2024-01-28", "2024-01-31")
+        self.assertEqual(1, len(house))
+        self.assertEqual(sum(a.count for a in rooms), house[0].count)
+        self.assertEqual(sum(a.count for a in floors), house[0].count)
+        self.assertAlmostEqual(sum(a.total for a in rooms) / house[0].count, house[0].mean)
+        self.assertEqual(min(a.min for a in floors), house[0].min)
+        self.assertEqual([], self.repo.calc_aggregates("°C", "house", "2000-01-01", "2000-01-02"))
+        self.assertRaises(ValueError, self.repo.calc_aggregates, "°C", "street")
+
+    def test_cache_invalidated_on_ingest(self):
+        self.repo.load_smarthouse()
+        before = self.repo.calc_aggregates("%", "house", "2024-01-01", "2025-01-01")[0]
+        self.repo.calc_aggregates("%", "room", "2024-01-01", "2025-01-01")
+        self.repo.calc_aggregates("%", "house", "2030-01-01", "2031-01-01")
+        self.assertEqual(2, self.queries())
+
+        # outside the cached range of the first query, only the 2030 entry is dropped
+        self.repo.insert_measurement(self.humidity, Measurement(timestamp="2030-06-01 00:00:00", value=1.0, unit="%"))
+        self.repo.calc_aggregates("%", "house", "2024-01-01", "2025-01-01")
+        self.assertEqual(2, self.queries())
+        self.assertEqual(1, self.repo.calc_aggregates("%", "house", "2030-01-01", "2031-01-01")[0].count)
+        self.assertEqual(3, self.queries())
+
+        self.repo.insert_measurement(self.humidity, Measurement(timestamp="2024-06-01 00:00:00", value=1.0, unit="%"))
+        after = self.repo.calc_aggregates("%", "house", "2024-01-01", "2025-01-01")[0]
+        self.assertEqual(before.count + 1, after.count)
+        self.assertEqual(4, self.queries())
+
+    def test_iso_timestamps(self):
+        self.repo.load_smarthouse()
+        before = self.repo.calc_aggregates("%", "house", "2030-01-01", "2030-01-02")
+        self.assertEqual([], before)
+        # stored with 'T' and fractions of a second, still inside [2030-01-01, 2030-01-02)
+        self.repo.insert_measurement(self.humidity, Measurement(timestamp="2030-01-01T23:30:00.5", value=1.0, unit="%"))
+        self.assertEqual(1, self.repo.calc_aggregates("%", "house", "2030-01-01", "2030-01-02")[0].count)
+        self.assertEqual([], self.repo.calc_aggregates("%", "house", "2030-01-01T23:31", "2030-01-03"))
+        # a cached empty result is dropped by the next reading in the same format
+        self.repo.insert_measurement(self.humidity, Measurement(timestamp="2030-01-02T10:00:00", value=2.0, unit="%"))
+        self.assertEqual(1, self.repo.calc_aggregates("%", "house", "2030-01-01T23:31", "2030-01-03")[0].count)
+
+    def test_room_analytics_cached(self):
+        h = self.repo.load_smarthouse()
+        bath = h.get_device_by_id(self.humidity).room
+        room = h.get_device_by_id(self.temperature).room
+
+        def queries():
+            return {op: self.repo.stats.by_shape[statement_shape(STATEMENTS[op])].count
+                    for op in ("avg_temperatures", "humidity_hours")}
+
+        days = self.repo.calc_avg_temperatures_in_room(room, "2024-01-26", "2024-01-28")
+        hours = self.repo.calc_hours_with_humidity_above(bath, "2024-01-27")
+        self.assertEqual(days, self.repo.calc_avg_temperatures_in_room(room, "2024-01-26", "2024-01-28"))
+        self.assertEqual(hours, self.repo.calc_hours_with_humidity_above(bath, "2024-01-27T00:00"))
+        self.assertEqual({"avg_temperatures": 1, "humidity_hours": 1}, queries())
+        # the cached result is not shared with the caller
+        self.repo.calc_avg_temperatures_in_room(room, "2024-01-26", "2024-01-28").clear()
+
+        # outside the cached range, or in another room, nothing is recomputed
+        self.repo.insert_measurement(self.temperature, Measurement(timestamp="2024-01-29 12:00:00", value=5.0, unit="°C"))
+        self.repo.insert_measurement(self.humidity, Measurement(timestamp="2024-01-28 12:00:00", value=5.0, unit="%"))
+        self.assertEqual(days, self.repo.calc_avg_temperatures_in_room(room, "2024-01-26", "2024-01-28"))
+        self.repo.calc_hours_with_humidity_above(bath, "2024-01-27")
+        self.assertEqual({"avg_temperatures": 1, "humidity_hours": 1}, queries())
+
+        # a late reading inside the range
+        self.repo.insert_measurement(self.temperature, Measurement(timestamp="2024-01-28 23:59:59", value=5.0, unit="°C"))
+        self.assertLess(self.repo.calc_avg_temperatures_in_room(room, "2024-01-26", "2024-01-28")["2024-01-28"],
+                        days["2024-01-28"])
+        self.assertEqual({"avg_temperatures": 2, "humidity_hours": 1}, queries())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from smarthouse.alerting import AlertMonitor
+
+
+class AlertMonitorTest(unittest.TestCase):
+    sensor = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+
+    def kinds(self, monitor, now):
+        return sorted(a.kind for a in monitor.active_alerts(now=now))
+
+    def test_running_statistics(self):
+        monitor = AlertMonitor(heartbeat_timeout=None)
+        values = [40.0, 42.0, 44.0, 46.0]
+        for v in values:
+            monitor.observe(self.sensor, v, now=0)
+        stats = monitor.stats(self.sensor)
+        self.assertAlmostEqual(43.0, stats.mean)
+        self.assertAlmostEqual(2.5819888974716, stats.std)
+        self.assertEqual(4, stats.count)
+
+    def test_outlier_and_stuck(self):
+        monitor = AlertMonitor(min_samples=10, stuck_after=5, heartbeat_timeout=None)
+        for i in range(20):
+            monitor.observe(self.sensor, 50.0 + (i % 3), now=i)
+        self.assertEqual([], self.kinds(monitor, 20))
+        monitor.observe(self.sensor, 90.0, now=21)
+        self.assertEqual(["outlier"], self.kinds(monitor, 21))
+        # a normal reading clears the outlier, the same value five times means the sensor is stuck
+        for i in range(5):
+            monitor.observe(self.sensor, 51.0, now=22 + i)
+        self.assertEqual(["stuck"], self.kinds(monitor, 30))
+        monitor.observe(self.sensor, 52.0, now=31)
+        self.assertEqual([], self.kinds(monitor, 31))
+
+    def test_slow_drift_is_not_an_outlier(self):
+        monitor = AlertMonitor(heartbeat_timeout=None)
+        values = [20.0 + (i % 3) * 0.1 for i in range(200)]
+        # the temperature then rises slowly by 10 degrees, far outside the spread of the whole history
+        values += [20.0 + (i % 3) * 0.1 + 0.05 * i for i in range(200)]
+        far_from_mean = 0
+        for i, v in enumerate(values):
+            stats = monitor.stats(self.sensor)
+            if stats is not None and stats.count >= 30 and abs(v - stats.mean) > 4 * stats.std:
+                far_from_mean += 1
+            monitor.observe(self.sensor, v, now=i)
+            self.assertEqual([], self.kinds(monitor, i), i)
+        # compared with the mean of the whole history, the start of the rise would have been reported
+        self.assertGreater(far_from_mean, 10)
+        self.assertAlmostEqual(values[-1], monitor.stats(self.sensor).ewma, delta=1.0)
+        # a sudden jump from the current level is still reported
+        monitor.observe(self.sensor, 40.0, now=400)
+        self.assertEqual(["outlier"], self.kinds(monitor, 400))
+
+    def test_heartbeat(self):
+        monitor = AlertMonitor([self.sensor], heartbeat_timeout=60)
+        monitor.observe(self.sensor, 1.0, now=1000)
+        self.assertEqual([], self.kinds(monitor, 1050))
+        alerts = monitor.active_alerts(now=1100)
+        self.assertEqual([("heartbeat", 1060)], [(a.kind, a.since) for a in alerts])
+        monitor.observe(self.sensor, 2.0, now=1101)
+        self.assertEqual([], self.kinds(monitor, 1101))
+
+
+if __name__ == '__main__':
+    unittest.main()
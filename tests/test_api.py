@@ -0,0 +1,242 @@
+import sqlite3
+import threading
+import time
+import unittest
+from fastapi.testclient import TestClient
+from smarthouse.api import create_app
+from smarthouse.persistence import SmartHouseRepository
+from smarthouse.registry import HouseRegistry, house_file_resolver
+from db_copy import DatabaseCopyTest
+
+
+class ApiTest(DatabaseCopyTest):
+
+    def setUp(self):
+        # every test gets its own copy of the database, so writes do not touch data/db.sql
+        super().setUp()
+        self.registry = HouseRegistry(house_file_resolver(self.data_dir, self.data_dir / "db.sql"))
+        self.app = create_app(self.registry)
+
+    def test_startup_is_lazy_and_ready_when_warm(self):
+        self.assertEqual([], self.registry.loaded())
+        with TestClient(self.app) as client:
+            self.app.state.warmer.join()
+            response = client.get("/ready")
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({"default": "ready"}, response.json()["houses"])
+            self.assertEqual(12, client.get("/smarthouse").json()["no_rooms"])
+
+    def test_unknown_house(self):
+        with TestClient(self.app) as client:
+            response = client.get("/house/unknown/smarthouse")
+            self.assertEqual(404, response.status_code)
+            self.assertEqual({"reason": "house with id not found"}, response.json())
+
+    def test_batch_actuator_command(self):
+        with TestClient(self.app) as client:
+            response = client.post("/smarthouse/actuator/batch", json={"state": "running", "floor": 2})
+            self.assertEqual(200, response.status_code)
+            results = response.json()
+            # smart plug, dehumidifier and light bulb are the actuators on the second floor
+            self.assertEqual(3, len(results))
+            self.assertTrue(all(r["status"] == "ok" and r["state"] == "running" for r in results))
+
+            response = client.post("/smarthouse/actuator/batch", json={
+                "state": "off", "ids": ["6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28", "no-such-device"]})
+            self.assertEqual({"no-such-device": "not_found", "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28": "ok"},
+                             {r["id"]: r["status"] for r in response.json()})
+            self.assertEqual(400, client.post("/smarthouse/actuator/batch", json={"state": "off"}).status_code)
+
+            # ids outside the room/floor/type selection are reported instead of silently left out
+            response = client.post("/smarthouse/actuator/batch", json={
+                "state": "running", "floor": 1, "ids": ["6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"]})
+            self.assertEqual([{"id": "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28", "status": "not_matched", "state": None}],
+                             response.json())
+
+        # the states were persisted
+        repo = self.registry.get("default").repo
+        h = repo.load_smarthouse_deep()
+        self.assertTrue(h.get_device_by_id("1a66c3d6-22b2-446e-bf5c-eb5b9d1a8c79").is_active())
+        self.assertFalse(h.get_device_by_id("6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28").is_active())
+
+    def test_batch_keeps_states_when_snapshot_fails(self):
+        bulb = "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"
+        with TestClient(self.app) as client:
+            self.app.state.warmer.join()
+            house = self.registry.get("default")
+            # the states are committed, writing the snapshot afterwards fails
+            house.repo.snapshot_delay = 0
+            house.repo.snapshot_file = str(self.data_dir / "missing" / "db.sql.snapshot")
+            with self.assertLogs("smarthouse.persistence", "WARNING"):
+                response = client.post("/smarthouse/actuator/batch", json={"state": "running", "ids": [bulb]})
+            self.assertEqual("ok", response.json()[0]["status"])
+            self.assertTrue(house.house.get_device_by_id(bulb).is_active())
+            self.assertTrue(house.repo.load_smarthouse_deep().get_device_by_id(bulb).is_active())
+
+    def test_measurement_retries(self):
+        sensor = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+        reading = {"timestamp": "2024-05-02 12:00:00", "value": 21.5, "unit": "°C"}
+        with TestClient(self.app) as client:
+            self.assertEqual(201, client.post(f"/smarthouse/sensor/{sensor}/current", json=reading).status_code)
+            # a retry of the same reading is acknowledged, but not stored twice
+            response = client.post(f"/smarthouse/sensor/{sensor}/current", json=reading)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(reading, response.json())
+            count = len(client.get(f"/smarthouse/sensor/{sensor}/values").json())
+
+            response = client.post(f"/smarthouse/sensor/{sensor}/values", json=[
+                reading, {**reading, "timestamp": "2024-05-02 12:01:00"}, {**reading, "timestamp": "2024-05-02 12:01:00"}])
+            self.assertEqual(201, response.status_code)
+            self.assertEqual({"inserted": 1, "duplicates": 2}, response.json())
+            self.assertEqual(count + 1, len(client.get(f"/smarthouse/sensor/{sensor}/values").json()))
+
+    def test_late_reading_is_not_evaluated(self):
+        humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+        dehumidifier = "9e5b8274-4e77-4e4e-80d2-b40d648ea02a"
+        with TestClient(self.app) as client:
+            client.post("/smarthouse/automation/rule", json={
+                "sensor": humidity, "operator": ">", "threshold": 60.0, "actuator": dehumidifier, "state": "running"})
+            current = client.get(f"/smarthouse/sensor/{humidity}/current").json()
+            response = client.post(f"/smarthouse/sensor/{humidity}/current",
+                                   json={"timestamp": "2024-01-29 15:30:31", "value": 80.0, "unit": "%"})
+            self.assertEqual(201, response.status_code)
+            self.app.state.automation.drain()
+            self.assertEqual(current, client.get(f"/smarthouse/sensor/{humidity}/current").json())
+            self.assertEqual([], client.get(f"/smarthouse/actuator/{dehumidifier}/history").json())
+            self.assertEqual({"late": 1, "avg_lag": 1770.0, "max_lag": 1770.0},
+                             client.get(f"/smarthouse/sensor/{humidity}/lateness").json())
+
+    def test_automation_rule(self):
+        humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+        dehumidifier = "9e5b8274-4e77-4e4e-80d2-b40d648ea02a"
+        with TestClient(self.app) as client:
+            response = client.post("/smarthouse/automation/rule", json={
+                "sensor": humidity, "operator": ">", "threshold": 60.0,
+                "actuator": dehumidifier, "state": "running", "else_state": "off"})
+            self.assertEqual(201, response.status_code)
+            rule_id = response.json()["id"]
+            self.assertEqual(404, client.post("/smarthouse/automation/rule", json={
+                "sensor": dehumidifier, "operator": ">", "threshold": 1.0,
+                "actuator": dehumidifier, "state": "off"}).status_code)
+
+            for minute, value in enumerate((50.0, 65.0)):
+                client.post(f"/smarthouse/sensor/{humidity}/current",
+                            json={"timestamp": f"2024-05-02 12:0{minute}:00", "value": value, "unit": "%"})
+            self.app.state.automation.drain()
+            self.assertEqual({"state": "running"}, client.get(f"/smarthouse/actuator/{dehumidifier}/current").json())
+            history = client.get(f"/smarthouse/actuator/{dehumidifier}/history").json()
+            self.assertEqual(["automation"], [e["source"] for e in history])
+
+            self.assertEqual(204, client.delete(f"/smarthouse/automation/rule/{rule_id}").status_code)
+            self.assertEqual([], client.get("/smarthouse/automation/rule").json())
+
+    def test_automation_goes_through_repository(self):
+        humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+        dehumidifier = "9e5b8274-4e77-4e4e-80d2-b40d648ea02a"
+        with TestClient(self.app) as client:
+            client.post("/smarthouse/automation/rule", json={
+                "sensor": humidity, "operator": ">", "threshold": 60.0, "actuator": dehumidifier, "state": "running"})
+            house = self.registry.get("default")
+            version = house.repo.state_version(dehumidifier)
+            notified = []
+            house.repo.state_listeners.append(lambda actuator, v: notified.append(actuator))
+            client.post(f"/smarthouse/sensor/{humidity}/current",
+                        json={"timestamp": "2024-05-02 12:00:00", "value": 65.0, "unit": "%"})
+            self.app.state.automation.drain()
+            self.assertTrue(house.house.get_device_by_id(dehumidifier).is_active())
+            self.assertGreater(house.repo.state_version(dehumidifier), version)
+            self.assertIn(dehumidifier, notified)
+
+    def test_failed_state_change_is_restored(self):
+        bulb = "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"
+        with TestClient(self.app) as client:
+            self.app.state.warmer.join()
+            house = self.registry.get("default")
+            device = house.house.get_device_by_id(bulb)
+
+            def fail(*args, **kwargs):
+                raise sqlite3.OperationalError("database is locked")
+            house.repo.run_many = fail
+            with self.assertRaises(sqlite3.OperationalError):
+                house.repo.apply_actuator_states([(device, "running")], source="automation")
+            self.assertFalse(device.is_active())
+            self.assertEqual([], client.get(f"/smarthouse/actuator/{bulb}/history").json())
+
+    def test_energy_rejects_invalid_timestamps(self):
+        meter = "a2f8690f-2b3a-43cd-90b8-9deea98b42a7"
+        with TestClient(self.app) as client:
+            for url in (f"/smarthouse/energy/{meter}", f"/smarthouse/energy/{meter}/peaks", "/smarthouse/energy/rooms"):
+                for params in ({"from_ts": "yesterday"}, {"to_ts": "2024-13-01"}):
+                    response = client.get(url, params=params)
+                    self.assertEqual(400, response.status_code, (url, params))
+                    self.assertEqual({"reason": "invalid timestamp"}, response.json())
+                self.assertEqual(200, client.get(url, params={"from_ts": "2024-01-28", "to_ts": "2024-01-29"}).status_code)
+
+    def test_conditional_actuator_state(self):
+        bulb = "/smarthouse/actuator/6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28/"
+        with TestClient(self.app) as client:
+            response = client.get(bulb + "current")
+            self.assertEqual({"state": "off"}, response.json())
+            etag = response.headers["ETag"]
+            response = client.get(bulb + "current", headers={"If-None-Match": etag})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(b"", response.content)
+
+            client.put(bulb, json={"state": "running"})
+            response = client.get(bulb + "current", headers={"If-None-Match": etag})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({"state": "running"}, response.json())
+            self.assertNotEqual(etag, response.headers["ETag"])
+            # setting the same state again is not a change
+            client.put(bulb, json={"state": "running"})
+            self.assertEqual(304, client.get(bulb + "current",
+                                             headers={"If-None-Match": response.headers["ETag"]}).status_code)
+
+    def test_long_poll_actuator_state(self):
+        bulb = "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"
+        url = f"/smarthouse/actuator/{bulb}/current"
+        with TestClient(self.app) as client:
+            etag = client.get(url).headers["ETag"]
+            version = int(etag.strip('"'))
+            # nothing happens before the timeout
+            started = time.monotonic()
+            response = client.get(url, params={"wait": 0.2, "since": version}, headers={"If-None-Match": etag})
+            self.assertEqual(304, response.status_code)
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+            # an older version is answered at once
+            self.assertEqual({"state": "off"}, client.get(url, params={"wait": 30, "since": version - 1}).json())
+
+            house = self.registry.get("default")
+            result = {}
+            waiting = threading.Thread(target=lambda: result.update(response=client.get(
+                url, params={"wait": 30, "since": version}, headers={"If-None-Match": etag})))
+            started = time.monotonic()
+            waiting.start()
+            while not house.states.waiting(bulb):
+                time.sleep(0.01)
+            client.put(f"/smarthouse/actuator/{bulb}/", json={"state": "running"})
+            waiting.join()
+            self.assertLess(time.monotonic() - started, 5)
+            self.assertEqual({"state": "running"}, result["response"].json())
+            self.assertEqual(f'"{house.repo.state_version(bulb)}"', result["response"].headers["ETag"])
+
+            # a change made by another worker is seen when the waiting request syncs
+            house.states.sync_interval = 0.05
+            etag = result["response"].headers["ETag"]
+            waiting = threading.Thread(target=lambda: result.update(response=client.get(
+                url, params={"wait": 30, "since": int(etag.strip('"'))})))
+            waiting.start()
+            while not house.states.waiting(bulb):
+                time.sleep(0.01)
+            other = SmartHouseRepository(str(self.data_dir / "db.sql"))
+            device = other.load_smarthouse().get_device_by_id(bulb)
+            device.turn_off()
+            other.update_actuator_state(device, source="test")
+            waiting.join(10)
+            self.assertEqual({"state": "off"}, result["response"].json())
+            self.assertNotEqual(etag, result["response"].headers["ETag"])
+            del other
+
+
+if __name__ == '__main__':
+    unittest.main()
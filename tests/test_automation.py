@@ -0,0 +1,56 @@
+import os
+import unittest
+from unittest import mock
+from smarthouse.automation import AutomationWorker, Rule, RuleEngine
+from smarthouse.ringbuffer import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_overwrites_oldest(self):
+        buffer = RingBuffer(3)
+        for v in (1.0, 2.0, 3.0, 4.0, 5.0):
+            buffer.append(v)
+        self.assertEqual([3.0, 4.0, 5.0], list(buffer))
+        self.assertTrue(buffer.full)
+        self.assertEqual(5.0, buffer.last())
+        self.assertAlmostEqual(4.0, buffer.mean())
+        self.assertEqual((3.0, 5.0), (buffer.min(), buffer.max()))
+        self.assertRaises(IndexError, RingBuffer(2).mean)
+
+
+class RuleEngineTest(unittest.TestCase):
+    humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+    dehumidifier = "9e5b8274-4e77-4e4e-80d2-b40d648ea02a"
+
+    def test_rules_fire_on_change(self):
+        rule = Rule(1, self.humidity, ">", 60.0, self.dehumidifier, "running", else_state="off")
+        engine = RuleEngine([rule])
+        self.assertEqual([], engine.evaluate(self.humidity, 50.0))
+        self.assertEqual([(rule, "running")], engine.evaluate(self.humidity, 65.0))
+        # still above the threshold, nothing new to do
+        self.assertEqual([], engine.evaluate(self.humidity, 70.0))
+        self.assertEqual([(rule, "off")], engine.evaluate(self.humidity, 55.0))
+        # readings from other sensors are not evaluated against the rule
+        self.assertEqual([], engine.evaluate("some-other-sensor", 99.0))
+
+    def test_window_average(self):
+        rule = Rule(1, self.humidity, ">=", 60.0, self.dehumidifier, 0.5, aggregate="avg", window=3)
+        engine = RuleEngine([rule])
+        self.assertEqual([], engine.evaluate(self.humidity, 40.0) + engine.evaluate(self.humidity, 60.0))
+        self.assertEqual([(rule, 0.5)], engine.evaluate(self.humidity, 80.0))
+        self.assertRaises(ValueError, Rule, 2, self.humidity, "==", 1.0, self.dehumidifier, "off")
+
+
+class AutomationWorkerTest(unittest.TestCase):
+
+    def test_warns_about_several_workers(self):
+        worker = AutomationWorker()
+        with mock.patch.dict(os.environ, {"WEB_CONCURRENCY": "4"}):
+            with self.assertLogs("smarthouse.automation", "WARNING"):
+                worker.start()
+        worker.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
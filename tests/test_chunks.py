@@ -0,0 +1,73 @@
+import random
+import unittest
+from smarthouse.chunks import CHUNK_SECONDS, chunk_start, decode_chunk, encode_chunk, epoch_to_ts, ts_to_epoch
+from smarthouse.energy import EnergyAnalytics
+from smarthouse.persistence import SmartHouseRepository
+from db_copy import DatabaseCopyTest
+
+
+class ChunkCodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = random.Random(7)
+        start = chunk_start(ts_to_epoch("2024-01-28 14:00:00"))
+        self.assertEqual("2024-01-28 00:00:00", epoch_to_ts(start))
+        for _ in range(50):
+            times = sorted(rng.randrange(start, start + CHUNK_SECONDS) for _ in range(rng.randint(1, 300)))
+            values = [rng.choice([21.5, round(rng.uniform(-30, 30), 1), rng.random() * 1e6, -0.0, float("inf")])
+                      for _ in times]
+            points = list(zip(times, values))
+            self.assertEqual(points, decode_chunk(start, encode_chunk(start, points), len(points)))
+
+    def test_regular_series_is_compact(self):
+        # hourly readings with one decimal, like the humidity sensors
+        start = chunk_start(ts_to_epoch("2024-01-28 00:00:00"))
+        points = [(start + 60 * i, round(40 + (i % 7) * 0.1, 1)) for i in range(1440)]
+        data = encode_chunk(start, points)
+        self.assertEqual(points, decode_chunk(start, data, len(points)))
+        # a row costs ~70 bytes (uuid, timestamp text, value and unit)
+        self.assertLess(len(data) / len(points), 7)
+
+
+class CompactionTest(DatabaseCopyTest):
+    sensor = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+    meter = "a2f8690f-2b3a-43cd-90b8-9deea98b42a7"
+
+    def setUp(self):
+        super().setUp()
+        self.repo = SmartHouseRepository(self.file)
+        self.house = self.repo.load_smarthouse_deep()
+
+    def tearDown(self):
+        del self.repo
+
+    def results(self):
+        repo = self.repo
+        sensors = [d.id for d in self.house.get_devices() if d.is_sensor()]
+        return {
+            "readings": {s: repo.get_reading_series(s, None).to_measurements() for s in sensors},
+            "limited": repo.get_reading_series(self.sensor, 300).to_measurements(),
+            "window": repo.get_window_stats(self.sensor, 500),
+            "aggregates": [(a.id, a.count, round(a.total, 6), a.min, a.max)
+                           for unit in ("%", "°C", "kWh")
+                           for a in repo.calc_aggregates(unit, "room", "2024-01-25T12:00", "2024-02-01")],
+            "temperatures": [repo.calc_avg_temperatures_in_room(r) for r in self.house.get_rooms()],
+            "humidity": [repo.calc_hours_with_humidity_above(r, day) for r in self.house.get_rooms()
+                         for day in ("2024-01-25", "2024-01-26", "2024-01-27")],
+            "energy": EnergyAnalytics(repo).consumption_by_period(self.meter, "hour"),
+        }
+
+    def test_results_unchanged(self):
+        before = self.results()
+        moved = self.repo.compact_measurements("2024-01-28", keep=10)
+        self.assertGreater(moved, 1000)
+        self.assertEqual(0, self.repo.compact_measurements("2024-01-28", keep=10))
+        after = self.results()
+        for key in before:
+            self.assertEqual(before[key], after[key], key)
+
+    def test_delete_oldest_from_chunk(self):
+        oldest = self.repo.get_reading_series(self.sensor, None).to_measurements()[-2:]
+        self.repo.compact_measurements("2024-02-01", keep=10)
+        self.assertEqual(oldest[1], self.repo.delete_oldest_reading(self.sensor))
+        self.assertEqual(oldest[0], self.repo.get_reading_series(self.sensor, None).to_measurements()[-1])
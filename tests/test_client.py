@@ -0,0 +1,194 @@
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import requests
+
+# the client scripts import each other as top-level modules, like when they are run from client/
+sys.path.insert(0, str(Path(__file__).parent.parent / "client"))
+
+from api_client import SmartHouseClient
+from dashboard_worker import DashboardWorker
+from messaging import SensorMeasurement
+from spool import MeasurementSpool
+
+SENSOR = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+
+
+def reading(i):
+    m = SensorMeasurement(str(i))
+    m.timestamp = f"2024-06-01 10:00:{i:02d}"
+    return m
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+class SpoolTest(unittest.TestCase):
+
+    def test_oldest_first_per_sensor(self):
+        spool = MeasurementSpool(":memory:", 10)
+        for i in range(3):
+            spool.append(SENSOR, {"value": i})
+        spool.append("other", {"value": 9})
+        batch = spool.peek(SENSOR, 2)
+        self.assertEqual([{"value": 0}, {"value": 1}], [m for _, m in batch])
+        spool.remove([id for id, _ in batch])
+        self.assertEqual([{"value": 2}], [m for _, m in spool.peek(SENSOR, 10)])
+        self.assertEqual({SENSOR, "other"}, set(spool.sensors()))
+        self.assertEqual(1, spool.count("other"))
+
+    def test_full_spool_drops_oldest(self):
+        spool = MeasurementSpool(":memory:", 3)
+        with self.assertLogs(level="WARNING"):
+            for i in range(5):
+                spool.append(SENSOR, {"value": i})
+        self.assertEqual([2, 3, 4], [m["value"] for _, m in spool.peek(SENSOR, 10)])
+        self.assertEqual(2, spool.dropped)
+
+    def test_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file = str(Path(tmp) / "measurements.spool")
+            spool = MeasurementSpool(file, 10)
+            spool.append(SENSOR, {"value": 1})
+            spool.close()
+            spool = MeasurementSpool(file, 10)
+            self.assertEqual([{"value": 1}], [m for _, m in spool.peek(SENSOR, 10)])
+            spool.close()
+
+
+class FlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = SmartHouseClient(spool_file=":memory:", batch_size=2)
+        self.sent = []
+        self.failures = []
+        self.client.request = self.request
+
+    def tearDown(self):
+        self.client.close()
+
+    def request(self, method, path, **kwargs):
+        self.sent.append([m["value"] for m in kwargs["json"]])
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def add(self, n):
+        for i in range(n):
+            self.client.add_measurement(SENSOR, reading(i))
+
+    def test_batches_are_removed_after_success(self):
+        self.add(5)
+        self.assertEqual(5, self.client.flush())
+        self.assertEqual([["0", "1"], ["2", "3"], ["4"]], self.sent)
+        self.assertEqual(0, self.client.pending(SENSOR))
+
+    def test_connection_error_stops_and_keeps(self):
+        self.add(5)
+        self.client.request = self.fail_second
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(2, self.client.flush(SENSOR))
+        # the first batch was accepted, the second is kept and nothing more is tried
+        self.assertEqual([["0", "1"], ["2", "3"]], self.sent)
+        self.assertEqual(3, self.client.pending(SENSOR))
+        self.client.request = self.request
+        self.assertEqual(3, self.client.flush(SENSOR))
+        self.assertEqual(0, self.client.pending(SENSOR))
+
+    def fail_second(self, method, path, **kwargs):
+        self.request(method, path, **kwargs)
+        if len(self.sent) == 2:
+            raise requests.ConnectionError("down")
+
+    def test_rejected_batch_is_dropped(self):
+        self.add(3)
+        self.failures = [http_error(422)]
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(1, self.client.flush(SENSOR))
+        self.assertEqual([["0", "1"], ["2"]], self.sent)
+        self.assertEqual(0, self.client.pending(SENSOR))
+
+    def test_retryable_status_keeps_batch(self):
+        for status in (408, 429, 503):
+            self.sent.clear()
+            self.add(3)
+            self.failures = [http_error(status)]
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(0, self.client.flush(SENSOR))
+            self.assertEqual([["0", "1"]], self.sent, status)
+            self.assertEqual(3, self.client.pending(SENSOR), status)
+            self.assertEqual(3, self.client.flush(SENSOR))
+
+
+class FakeRoot:
+    """
+    Stands in for the Tk root: 'after' callbacks run when 'update' is called, on the test thread
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def after(self, ms, callback, *args):
+        self.jobs.append((time.monotonic() + ms / 1000, callback, args))
+
+    def update(self, seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            now = time.monotonic()
+            due = [job for job in self.jobs if job[0] <= now]
+            self.jobs = [job for job in self.jobs if job[0] > now]
+            for _, callback, args in due:
+                callback(*args)
+            time.sleep(0.005)
+
+
+class DashboardWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = FakeRoot()
+        self.worker = DashboardWorker(self.root, workers=2, poll_interval=5)
+
+    def tearDown(self):
+        self.worker.close()
+
+    def test_rapid_jobs_are_coalesced(self):
+        release = threading.Event()
+        calls, shown, threads = [], [], []
+
+        def job(i):
+            def call():
+                calls.append(i)
+                release.wait(5)
+                return i
+            return call
+
+        for i in range(10):
+            self.worker.submit("bulb", job(i), lambda result: (shown.append(result),
+                                                               threads.append(threading.current_thread())))
+        release.set()
+        self.root.update(0.3)
+        # the job already running, then only the latest one
+        self.assertEqual([0, 9], calls)
+        self.assertEqual([0, 9], shown)
+        self.assertTrue(all(t is threading.current_thread() for t in threads))
+
+    def test_failed_request_does_not_block_key(self):
+        def fail():
+            raise requests.ConnectionError("down")
+        shown = []
+        with self.assertLogs(level="WARNING"):
+            self.worker.submit("sensor", fail, shown.append)
+            self.root.update(0.1)
+        self.worker.submit("sensor", lambda: 21.5, shown.append)
+        self.root.update(0.1)
+        self.assertEqual([21.5], shown)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+from array import array
+from datetime import datetime
+from smarthouse.domain import Measurement
+from smarthouse.energy import EnergyAnalytics, consumption, period_start
+from smarthouse.persistence import STATEMENTS, SmartHouseRepository, statement_shape
+from db_copy import DatabaseCopyTest
+
+
+class EnergyTest(DatabaseCopyTest):
+    meter = "a2f8690f-2b3a-43cd-90b8-9deea98b42a7"
+    now = datetime(2024, 1, 29, 12)
+
+    def setUp(self):
+        super().setUp()
+        self.repo = SmartHouseRepository(self.file)
+        self.repo.load_smarthouse()
+
+    def tearDown(self):
+        del self.repo
+
+    def test_consumption(self):
+        self.assertEqual(array("d", [0.0, 2.0, 3.0, 1.0]), consumption(array("d", [10, 12, 15, 1]), True))
+        self.assertEqual(array("d", [1.0, 2.0]), consumption(array("d", [11, 13]), True, previous=10))
+        self.assertEqual(array("d", [1.0, 2.0]), consumption(array("d", [1, 2]), False))
+        self.assertEqual("2024-01-01 00:00:00", period_start("2024-01-28T14:30:00", "month"))
+
+    def test_periods_and_peaks(self):
+        energy = EnergyAnalytics(self.repo)
+        days = energy.consumption_by_period(self.meter, "day", now=self.now)
+        self.assertEqual(1, len(days))
+        self.assertEqual("2024-01-28 00:00:00", days[0][0])
+        self.assertAlmostEqual(128.6, days[0][1])
+        hours = energy.consumption_by_period(self.meter, "hour", "2024-01-28 20:00", "2024-01-28 22:00", now=self.now)
+        self.assertEqual([("2024-01-28 20:00:00", 11.7), ("2024-01-28 21:00:00", 12.6)], hours)
+
+        peaks = energy.peak_hours(self.meter, 2)
+        self.assertEqual([("2024-01-28 22:00:00", 14.9), ("2024-01-28 23:00:00", 13.7)], peaks["top_hours"])
+        self.assertEqual(22, peaks["peak_hour_of_day"])
+
+    def test_closed_periods_are_cached(self):
+        energy = EnergyAnalytics(self.repo)
+        shape = statement_shape(STATEMENTS["meter_readings_since"])
+        energy.consumption_by_period(self.meter, "day", now=self.now)
+        rows_read = self.repo.stats.by_shape[shape].rows
+        energy.consumption_by_period(self.meter, "day", now=self.now)
+        self.assertEqual(rows_read, self.repo.stats.by_shape[shape].rows)
+
+        # a late reading in a closed period invalidates the cache
+        self.repo.insert_measurement(self.meter, Measurement(timestamp="2024-01-28 13:00:00", value=1.4, unit="kWh"))
+        self.assertAlmostEqual(130.0, energy.consumption_by_period(self.meter, "day", now=self.now)[0][1])
+
+    def test_late_reading_recomputes_its_period(self):
+        for cumulative in (False, True):
+            energy = EnergyAnalytics(self.repo, cumulative=cumulative)
+            before = energy.consumption_by_period(self.meter, "hour", now=self.now)
+            shape = statement_shape(STATEMENTS["meter_readings_between"])
+            read = self.repo.stats.by_shape[shape].rows if shape in self.repo.stats.by_shape else 0
+
+            ts = f"2024-01-28 2{int(cumulative)}:30:00"
+            self.repo.insert_measurement(self.meter, Measurement(timestamp=ts, value=50.0, unit="kWh"))
+            after = energy.consumption_by_period(self.meter, "hour", now=self.now)
+            self.assertEqual(after, EnergyAnalytics(self.repo, cumulative).consumption_by_period(self.meter, "hour",
+                                                                                                 now=self.now))
+            self.assertNotEqual(before, after)
+            # only the changed hour, and for a cumulative meter the next hour with readings, is read again
+            self.assertEqual(3 if cumulative else 2, self.repo.stats.by_shape[shape].rows - read)
+            changed = [b[0] for a, b in zip(after, before) if a != b]
+            self.assertEqual([ts[:13] + ":00:00"] + (["2024-01-28 22:00:00"] if cumulative else []), changed)
+
+    def test_iso_timestamps(self):
+        energy = EnergyAnalytics(self.repo)
+        self.repo.insert_measurement(self.meter, Measurement(timestamp="2024-01-29T10:15:00.25", value=5.0, unit="kWh"))
+        first = energy.consumption_by_period(self.meter, "hour", "2024-01-29", now=datetime(2024, 1, 29, 12))
+        self.assertEqual([("2024-01-29 10:00:00", 5.0)], first)
+        # the reading is in a closed hour, reading again from 12:00 must not count it twice
+        later = energy.consumption_by_period(self.meter, "hour", "2024-01-29", now=datetime(2024, 1, 29, 13))
+        self.assertEqual(first, later)
+
+    def test_date_only_bounds(self):
+        energy = EnergyAnalytics(self.repo)
+        hours = energy.consumption_by_period(self.meter, "hour", "2024-01-28", "2024-01-29", now=self.now)
+        self.assertEqual(hours, energy.consumption_by_period(self.meter, "hour", now=self.now))
+        self.assertAlmostEqual(128.6, sum(kwh for _, kwh in hours))
+
+
+if __name__ == '__main__':
+    unittest.main()
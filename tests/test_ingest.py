@@ -0,0 +1,107 @@
+import sqlite3
+import unittest
+from smarthouse.domain import Measurement
+from smarthouse.persistence import SmartHouseRepository
+from db_copy import DatabaseCopyTest
+
+
+class IngestTest(DatabaseCopyTest):
+    # few enough readings for all of them to fit in the sensor's ring
+    sensor = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+
+    def setUp(self):
+        super().setUp()
+        self.repo = SmartHouseRepository(self.file)
+        self.house = self.repo.load_smarthouse()
+
+    def tearDown(self):
+        del self.repo
+
+    def reading(self, ts="2024-05-02 12:00:00", value=21.5):
+        return Measurement(timestamp=ts, value=value, unit="°C")
+
+    def stored(self):
+        return self.repo.conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+
+    def aggregates(self):
+        return [(a.id, a.count, a.total) for a in self.repo.calc_aggregates("°C", "room", "2024-05-01", "2024-05-03")]
+
+    def test_retry_is_ignored(self):
+        self.assertTrue(self.repo.insert_measurement(self.sensor, self.reading()))
+        count, aggregates, readings = self.stored(), self.aggregates(), self.repo.get_readings(self.sensor, None)
+        received = []
+        self.repo.reading_listeners.append(lambda *args: received.append(args))
+
+        self.assertFalse(self.repo.insert_measurement(self.sensor, self.reading(value=30.0)))
+        self.assertFalse(self.repo.insert_measurement(self.sensor, self.reading(), seq=None))
+        self.assertEqual(count, self.stored())
+        self.assertEqual(aggregates, self.aggregates())
+        self.assertEqual(readings, self.repo.get_readings(self.sensor, None))
+        self.assertEqual([], received)
+
+    def test_newer_seq_corrects_reading(self):
+        other = SmartHouseRepository(self.file)
+        other_house = other.load_smarthouse()
+        self.assertTrue(self.repo.insert_measurement(self.sensor, self.reading(), seq=1))
+        self.assertFalse(self.repo.insert_measurement(self.sensor, self.reading(value=30.0), seq=1))
+        count = self.stored()
+
+        self.assertTrue(self.repo.insert_measurement(self.sensor, self.reading(value=22.0), seq=2))
+        self.assertEqual(count, self.stored())
+        self.assertEqual(22.0, self.repo.get_readings(self.sensor, 1)[0].value)
+        self.assertEqual(22.0, self.repo.get_latest_reading(self.house.get_device_by_id(self.sensor)).value)
+        # an older sequence number does not undo the correction
+        self.assertFalse(self.repo.insert_measurement(self.sensor, self.reading(value=21.0), seq=1))
+        self.assertEqual(22.0, self.repo.get_readings(self.sensor, 1)[0].value)
+
+        # another worker picks up the correction without keeping the replaced value
+        self.assertTrue(other.sync_with_database())
+        self.assertEqual(22.0, other.get_latest_reading(other_house.get_device_by_id(self.sensor)).value)
+        self.assertEqual(self.repo.get_readings(self.sensor, None), other.get_readings(self.sensor, None))
+        del other
+
+    def test_batch_is_deduplicated(self):
+        count = self.stored()
+        batch = [self.reading("2024-05-02 12:01:00", 2.0), self.reading("2024-05-02 12:00:00", 1.0),
+                 self.reading("2024-05-02 12:01:00", 3.0), self.reading("2024-05-02 12:01:00", 4.0)]
+        self.assertEqual(2, self.repo.insert_measurements(self.sensor, batch, [None, None, 5, 4]))
+        self.assertEqual(count + 2, self.stored())
+        self.assertEqual([("2024-05-02 12:01:00", 3.0), ("2024-05-02 12:00:00", 1.0)],
+                         [(m.timestamp, m.value) for m in self.repo.get_readings(self.sensor, 2)])
+        # replaying the same batch stores nothing
+        self.assertEqual(0, self.repo.insert_measurements(self.sensor, batch, [None, None, 5, 4]))
+        self.assertEqual(count + 2, self.stored())
+
+    def test_late_reading_keeps_current_value(self):
+        sensor = self.house.get_device_by_id(self.sensor)
+        current = self.repo.get_latest_reading(sensor)
+        received, late = [], []
+        self.repo.reading_listeners.append(lambda *args: received.append(args))
+        self.repo.late_listeners.append(lambda *args: late.append(args))
+
+        # an hour behind the newest reading, and a late one in the ISO format
+        self.repo.insert_measurement(self.sensor, self.reading("2024-05-01 15:29:59", 30.0))
+        self.repo.insert_measurement(self.sensor, self.reading("2024-05-01T16:29:58", 31.0))
+        self.assertEqual(current, self.repo.get_latest_reading(sensor))
+        self.assertTrue(self.repo.is_late(self.sensor, "2024-05-01 16:00:00"))
+        self.assertEqual("2024-05-01 16:29:59", self.repo.watermark(self.sensor))
+        self.assertEqual([], received)
+        self.assertEqual([30.0, 31.0], [args[2] for args in late])
+        self.assertEqual({"late": 2, "avg_lag": 1800.5, "max_lag": 3600}, self.repo.lateness.get(self.sensor))
+        # the late readings are stored and part of the series
+        self.assertIn(self.reading("2024-05-01 15:29:59", 30.0), self.repo.get_readings(self.sensor, None))
+
+        self.repo.insert_measurement(self.sensor, self.reading("2024-05-02 12:00:00", 22.0))
+        self.assertEqual(22.0, self.repo.get_latest_reading(sensor).value)
+        self.assertEqual(1, len(received))
+
+    def test_duplicates_are_rejected_by_the_database(self):
+        key = self.repo.run("device_key", (self.sensor,))[0][0]
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.repo.conn.execute("INSERT INTO measurements (device, ts, value) VALUES (?, '2024-01-26 00:00:00', 1)",
+                                   (key,))
+        self.repo.conn.rollback()
+
+
+if __name__ == '__main__':
+    unittest.main()
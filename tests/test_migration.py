@@ -0,0 +1,164 @@
+import sqlite3
+import unittest
+from smarthouse.chunks import chunk_start, encode_chunk, ts_to_epoch
+from smarthouse.domain import Measurement
+from smarthouse.persistence import MigrationRequired, SmartHouseRepository, migrate_database
+from db_copy import DatabaseCopyTest
+
+# The tables as they were before the migration, with device ids and units as text. The bundled
+# database may already have been migrated by another test opening it, so it is turned back first.
+LEGACY = """
+CREATE TABLE devices_legacy (id TEXT NOT NULL, room INT NOT NULL, kind TEXT NOT NULL, category TEXT NOT NULL,
+    supplier TEXT NULL, product TEXT NULL, PRIMARY KEY (id), FOREIGN KEY (room) REFERENCES rooms(id));
+INSERT INTO devices_legacy SELECT id, room, kind, category, supplier, product FROM devices ORDER BY key;
+CREATE TABLE measurements_legacy (device text not null, ts text not null, value float not null, unit text null);
+INSERT INTO measurements_legacy (rowid, device, ts, value, unit)
+SELECT m.rowid, d.id, m.ts, m.value, u.unit FROM measurements m
+INNER JOIN devices d ON d.key = m.device LEFT JOIN units u ON u.key = m.unit;
+CREATE TABLE states_legacy (device TEXT NOT NULL, state REAL, PRIMARY KEY (device));
+INSERT INTO states_legacy SELECT d.id, s.state FROM states s INNER JOIN devices d ON d.key = s.device;
+DROP TABLE states;
+DROP TABLE measurements;
+DROP TABLE devices;
+DROP TABLE actuator_events;
+DROP TABLE automation_rules;
+DROP TABLE measurement_chunks;
+DROP TABLE units;
+ALTER TABLE devices_legacy RENAME TO devices;
+ALTER TABLE measurements_legacy RENAME TO measurements;
+ALTER TABLE states_legacy RENAME TO states;
+"""
+
+LEGACY_OWN_TABLES = """
+CREATE TABLE actuator_events (device TEXT NOT NULL, ts TEXT NOT NULL, old REAL, new REAL, source TEXT NULL);
+CREATE INDEX actuator_events_device_ts ON actuator_events (device, ts);
+CREATE TABLE automation_rules (id INTEGER PRIMARY KEY, sensor TEXT NOT NULL, aggregate TEXT NOT NULL,
+    window_size INT NOT NULL, operator TEXT NOT NULL, threshold REAL NOT NULL, actuator TEXT NOT NULL,
+    state TEXT NOT NULL, else_state TEXT NULL);
+CREATE TABLE measurement_chunks (device TEXT NOT NULL, chunk_start INTEGER NOT NULL, unit TEXT NULL,
+    first_ts TEXT NOT NULL, last_ts TEXT NOT NULL, count INTEGER NOT NULL, total REAL NOT NULL, min REAL NOT NULL,
+    max REAL NOT NULL, data BLOB NOT NULL);
+CREATE UNIQUE INDEX measurement_chunks_device_start ON measurement_chunks (device, chunk_start, unit);
+"""
+
+
+class KeyMigrationTest(DatabaseCopyTest):
+    migrate = False
+    sensor = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+    plug = "1a66c3d6-22b2-446e-bf5c-eb5b9d1a8c79"
+
+    def setUp(self):
+        super().setUp()
+        conn = sqlite3.connect(self.file)
+        columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(measurements)")}
+        if columns["device"].upper() != "TEXT":
+            conn.executescript(LEGACY)
+        self.before = conn.execute("SELECT rowid, device, ts, value, unit FROM measurements ORDER BY rowid").fetchall()
+        self.states = conn.execute("SELECT device, state FROM states ORDER BY device").fetchall()
+        self.newest = conn.execute("SELECT ts FROM measurements WHERE device = ? ORDER BY datetime(ts) DESC LIMIT 1",
+                                   (self.sensor,)).fetchone()[0]
+        conn.close()
+
+    def columns(self, repo, table):
+        return {row[1]: row[2] for row in repo.conn.execute(f"PRAGMA table_info({table})")}
+
+    def test_opening_does_not_migrate(self):
+        with open(self.file, "rb") as f:
+            before = f.read()
+        with self.assertRaises(MigrationRequired):
+            SmartHouseRepository(self.file)
+        with open(self.file, "rb") as f:
+            self.assertEqual(before, f.read())
+        migrate_database(self.file)
+        # a migrated database is opened without writing to it
+        with open(self.file, "rb") as f:
+            migrated = f.read()
+        repo = SmartHouseRepository(self.file)
+        repo.load_smarthouse()
+        del repo
+        with open(self.file, "rb") as f:
+            self.assertEqual(migrated, f.read())
+
+    def test_all_data_migrates(self):
+        repo = SmartHouseRepository(self.file, migrate=True)
+        self.assertEqual("INTEGER", self.columns(repo, "measurements")["device"])
+        self.assertEqual("INTEGER", self.columns(repo, "measurements")["unit"])
+        self.assertEqual("INTEGER", self.columns(repo, "states")["device"])
+        after = repo.conn.execute("""
+            SELECT m.rowid, d.id, m.ts, m.value, u.unit FROM measurements m
+            INNER JOIN devices d ON d.key = m.device LEFT JOIN units u ON u.key = m.unit
+            ORDER BY m.rowid""").fetchall()
+        self.assertEqual(self.before, after)
+        self.assertEqual(self.states, sorted(repo.run("all_states")))
+        # the repository still speaks device ids
+        self.assertEqual(self.newest, repo.get_readings(self.sensor, 1)[0].timestamp)
+        del repo
+
+        # opening the migrated database again leaves it as it is
+        repo = SmartHouseRepository(self.file, migrate=True)
+        self.assertEqual(self.before[-1][0], repo.run("max_measurement_rowid")[0][0])
+        repo.insert_measurement(self.sensor, Measurement(timestamp="2024-02-01 00:00:00", value=1.0, unit="lux"))
+        self.assertEqual("lux", repo.get_readings(self.sensor, 1)[0].unit)
+        self.assertEqual(1, repo.conn.execute("SELECT COUNT(*) FROM units WHERE unit = 'lux'").fetchone()[0])
+        with self.assertRaises(ValueError):
+            repo.insert_measurement("unknown", Measurement(timestamp="2024-02-01 00:00:00", value=1.0, unit="lux"))
+        del repo
+
+    def test_own_tables_migrate(self):
+        conn = sqlite3.connect(self.file)
+        conn.executescript(LEGACY_OWN_TABLES)
+        start = chunk_start(ts_to_epoch("2024-01-01 00:00:00"))
+        points = [(start + 3600, 40.0), (start + 7200, 41.5)]
+        conn.execute("INSERT INTO measurement_chunks VALUES (?, ?, '%', ?, ?, 2, 81.5, 40.0, 41.5, ?)",
+                     (self.sensor, start, "2024-01-01 01:00:00", "2024-01-01 02:00:00", encode_chunk(start, points)))
+        conn.execute("INSERT INTO actuator_events VALUES (?, '2024-02-01 10:00:00', NULL, 1.0, 'test')", (self.plug,))
+        conn.execute("INSERT INTO automation_rules VALUES (7, ?, 'last', 1, '>', 20.0, ?, 'running', NULL)",
+                     (self.sensor, self.plug))
+        conn.commit()
+        conn.close()
+
+        repo = SmartHouseRepository(self.file, migrate=True)
+        for table, column in (("measurement_chunks", "device"), ("actuator_events", "device"),
+                              ("automation_rules", "sensor"), ("automation_rules", "actuator")):
+            self.assertEqual("INTEGER", self.columns(repo, table)[column], table)
+        oldest = repo.get_readings(self.sensor, None)[-2:]
+        self.assertEqual([("2024-01-01 02:00:00", 41.5), ("2024-01-01 01:00:00", 40.0)],
+                         [(m.timestamp, m.value) for m in oldest])
+        self.assertEqual([("2024-02-01 10:00:00", None, 1.0, "test")], repo.get_state_timeline(self.plug))
+        rule = repo.get_rules()[0]
+        self.assertEqual((7, self.sensor, self.plug), (rule.id, rule.sensor, rule.actuator))
+        del repo
+
+    def test_duplicate_readings_are_removed(self):
+        conn = sqlite3.connect(self.file)
+        conn.execute("INSERT INTO measurements (device, ts, value, unit) VALUES (?, ?, 99.0, '%')",
+                     (self.sensor, self.newest))
+        conn.commit()
+        conn.close()
+
+        repo = SmartHouseRepository(self.file, migrate=True)
+        self.assertEqual(len(self.before), repo.conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0])
+        # the first copy is kept
+        self.assertNotEqual(99.0, repo.get_readings(self.sensor, 1)[0].value)
+        self.assertIn("seq", self.columns(repo, "measurements"))
+        self.assertFalse(repo.insert_measurement(self.sensor, repo.get_readings(self.sensor, 1)[0]))
+        del repo
+
+    def test_migrated_database_gets_unique_readings(self):
+        # a database from before the readings were unique per timestamp, with the surrogate keys in place
+        repo = SmartHouseRepository(self.file, migrate=True)
+        key = repo.run("device_key", (self.sensor,))[0][0]
+        repo.conn.executescript("""
+            DROP INDEX measurements_device_ts;
+            CREATE INDEX measurements_device_ts ON measurements (device, ts);
+            ALTER TABLE measurements DROP COLUMN seq;""")
+        repo.conn.execute("INSERT INTO measurements (device, ts, value) VALUES (?, ?, 99.0)", (key, self.newest))
+        repo.conn.commit()
+        del repo
+
+        repo = SmartHouseRepository(self.file, migrate=True)
+        self.assertEqual(len(self.before), repo.conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0])
+        self.assertIn("seq", self.columns(repo, "measurements"))
+        self.assertEqual(1, {row[1]: row[2] for row in repo.conn.execute("PRAGMA index_list(measurements)")}
+                         ["measurements_device_ts"])
+        del repo
@@ -1,10 +1,16 @@
+import threading
 import unittest
-from smarthouse.persistence import SmartHouseRepository
-from pathlib import Path
+from smarthouse.persistence import STATEMENTS, QueryStatistics, SmartHouseRepository, StatementRegistry
+from db_copy import DatabaseCopyTest
 
-class SmartHouseTest(unittest.TestCase):
-    file = Path(__file__).parent / "../data/db.sql"
-    repo = SmartHouseRepository(file)
+class SmartHouseTest(DatabaseCopyTest):
+
+    def setUp(self):
+        super().setUp()
+        self.repo = SmartHouseRepository(self.file)
+
+    def tearDown(self):
+        del self.repo
 
     def test_cursor(self):
         c = self.repo.cursor()
@@ -13,6 +19,61 @@ class SmartHouseTest(unittest.TestCase):
         self.assertEqual(12, len(rooms))
         c.close()
 
+    def test_query_statistics(self):
+        repo = SmartHouseRepository(self.file, slow_query_threshold=0.0, explain_slow_queries=True)
+        with self.assertLogs("smarthouse.persistence", "WARNING"):
+            repo.get_readings("3d87e5c0-8716-4b0b-9c67-087eaaed7b45", 5)
+            repo.get_readings("a2f8690f-2b3a-43cd-90b8-9deea98b42a7", 5)
+        report = repo.stats.report()
+        self.assertEqual(1, len(report))
+        self.assertEqual(2, report[0]["count"])
+        self.assertEqual(10, report[0]["rows"])
+        # the device lookup uses the measurements index, while ORDER BY datetime(ts) still needs
+        # a temporary sort, both visible in the captured plan
+        self.assertTrue(any("measurements_device_ts" in step for step in report[0]["last_plan"]))
+        self.assertTrue(any("TEMP B-TREE" in step for step in report[0]["last_plan"]))
+
+    def test_query_statistics_threads_and_cte(self):
+        stats = QueryStatistics()
+        sql = "SELECT * FROM measurements WHERE device = 1"
+        threads = [threading.Thread(target=lambda: [stats.record(sql, 0.001, 1, False) for _ in range(1000)])
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(8000, stats.report()[0]["count"])
+        self.assertEqual(8000, stats.report()[0]["rows"])
+
+        repo = SmartHouseRepository(self.file, slow_query_threshold=0.0, explain_slow_queries=True)
+        with self.assertLogs("smarthouse.persistence", "WARNING"):
+            repo.execute("WITH r AS (SELECT id FROM rooms) SELECT COUNT(*) FROM r")
+        cte = [r for r in repo.stats.report() if r["shape"].startswith("WITH")]
+        self.assertTrue(cte[0]["last_plan"])
+
+    def test_statement_reuse(self):
+        repo = SmartHouseRepository(self.file)
+        h = repo.load_smarthouse_deep()
+        for d in h.get_devices():
+            repo.get_latest_reading(d)
+        usage = repo.statements.usage()
+        # the latest reading query is used for the first time once, and again for every other device
+        self.assertEqual(1, usage["latest_reading"]["first_uses"])
+        self.assertEqual(len(h.get_devices()) - 1, usage["latest_reading"]["repeat_uses"])
+        repo.reconnect()
+        repo.get_latest_reading(h.get_devices()[0])
+        self.assertEqual(2, repo.statements.usage()["latest_reading"]["first_uses"])
+
+    def test_statement_usage_threads(self):
+        registry = StatementRegistry(STATEMENTS)
+        threads = [threading.Thread(target=lambda: [registry.sql("latest_reading") for _ in range(1000)])
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual({"first_uses": 1, "repeat_uses": 7999}, registry.usage()["latest_reading"])
+
     # Testing that the device structure is loaded correctly
 
     def test_basic_no_of_rooms(self):
@@ -46,6 +107,15 @@ class SmartHouseTest(unittest.TestCase):
         self.assertEqual('2024-01-29 16:00:01', self.repo.get_latest_reading(humidity_sensor).timestamp)
 
 
+    def test_intermediate_reading_series(self):
+        series = self.repo.get_reading_series("3d87e5c0-8716-4b0b-9c67-087eaaed7b45", 10)
+        readings = self.repo.get_readings("3d87e5c0-8716-4b0b-9c67-087eaaed7b45", 10)
+        self.assertEqual(10, len(series))
+        self.assertEqual(readings, series.to_measurements())
+        # the unit string is stored once and shared by every reading in the series
+        self.assertTrue(all(u is series.units[0] for u in series.units))
+
+
     def test_intermediate_save_actuator_state(self):
         h = self.repo.load_smarthouse_deep()
         oven = h.get_device_by_id("8d4e4c98-21a9-4d1e-bf18-523285ad90f6")
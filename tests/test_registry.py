@@ -0,0 +1,70 @@
+import unittest
+from smarthouse.registry import DEFAULT_HOUSE_ID, HouseNotFound, HouseRegistry, HouseWarmer, house_file_resolver
+from db_copy import DatabaseCopyTest
+
+
+class HouseRegistryTest(DatabaseCopyTest):
+
+    def setUp(self):
+        super().setUp()
+        for house_id in ("a", "b", "c"):
+            self.copy_database(f"houses/{house_id}.sql")
+        self.resolve = house_file_resolver(self.data_dir, self.data_dir / "houses" / "a.sql")
+
+    def test_lazy_loading(self):
+        registry = HouseRegistry(self.resolve)
+        self.assertEqual([], registry.loaded())
+        entry = registry.get("b")
+        self.assertEqual(14, len(entry.house.get_devices()))
+        self.assertIs(entry, registry.get("b"))
+        self.assertEqual(["b"], registry.loaded())
+        self.assertEqual(14, len(registry.get(DEFAULT_HOUSE_ID).house.get_devices()))
+
+    def test_unknown_house(self):
+        registry = HouseRegistry(self.resolve)
+        self.assertRaises(HouseNotFound, registry.get, "missing")
+        self.assertRaises(HouseNotFound, registry.get, "../a")
+
+    def test_lru_eviction(self):
+        registry = HouseRegistry(self.resolve)
+        size = registry.get("a").size
+        registry.memory_budget = 2 * size
+        registry.get("b")
+        registry.get("a")  # 'b' is now the least recently used house
+        registry.get("c")
+        self.assertEqual(["a", "c"], registry.loaded())
+        self.assertEqual(2 * size, registry.memory_used)
+
+    def test_ring_growth_counts_against_budget(self):
+        registry = HouseRegistry(self.resolve)
+        a = registry.get("a")
+        b = registry.get("b")
+        registry.memory_budget = registry.memory_used + 1024
+        for device in a.house.get_devices():
+            if device.is_sensor():
+                a.repo.get_readings(device.id, None)
+        # filling the rings of house 'a' pushes the registry over budget, and 'b' is evicted
+        self.assertEqual(["a"], registry.loaded())
+        self.assertEqual(a.size, registry.memory_used)
+        self.assertGreater(a.size, b.size)
+
+    def test_warmer_stops(self):
+        registry = HouseRegistry(self.resolve)
+        warmer = HouseWarmer(registry, ["a", "b"])
+        warmer.start()
+        warmer.stop()
+        # a house that was loading when the warmer stopped is finished, nothing is loaded afterwards
+        loaded = registry.loaded()
+        self.assertEqual([h for h in ("a", "b") if warmer.status[h] == "ready"], loaded)
+        self.assertTrue(all(s in ("ready", "pending") for s in warmer.status.values()))
+        self.assertEqual(loaded, registry.loaded())
+
+        cancelled = HouseWarmer(registry, ["c"])
+        cancelled.stop()
+        cancelled.start()
+        cancelled.join()
+        self.assertEqual({"c": "pending"}, cancelled.status)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from smarthouse.domain import Measurement
+from smarthouse.persistence import STATEMENTS, SmartHouseRepository, statement_shape
+from smarthouse.registry import default_repository
+from smarthouse.replica import DEFAULT_MAX_AGE
+from db_copy import DatabaseCopyTest
+
+
+class ReplicaTest(DatabaseCopyTest):
+    humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+
+    def setUp(self):
+        super().setUp()
+        self.plain = SmartHouseRepository(self.file)
+        # a copy that is refreshed on every query after a write
+        self.repo = SmartHouseRepository(self.file, replica_file=":memory:", replica_max_age=0)
+        self.house = self.repo.load_smarthouse()
+        # every statement sent to the main connection
+        self.main = []
+        self.repo.conn.set_trace_callback(self.main.append)
+
+    def tearDown(self):
+        del self.repo
+        del self.plain
+
+    def room_of(self, sensor):
+        return self.house.get_device_by_id(sensor).room
+
+    def results(self, repo):
+        room = self.room_of(self.humidity)
+        return (repo.calc_hours_with_humidity_above(room, "2024-01-27"),
+                [repo.calc_avg_temperatures_in_room(r, "2024-01-20", "2024-02-01") for r in self.house.get_rooms()],
+                repo.get_reading_series(self.humidity, None).to_measurements(),
+                [(a.id, a.count, a.total) for a in repo.calc_aggregates("%", "room")])
+
+    def test_analytics_run_on_the_replica(self):
+        self.assertEqual(self.results(self.plain), self.results(self.repo))
+        analytics = [statement_shape(STATEMENTS[op]) for op in ("humidity_hours", "avg_temperatures", "unit_aggregates")]
+        self.assertFalse([sql for sql in self.main if statement_shape(sql) in analytics])
+        # the queries are still counted in the statistics
+        self.assertTrue(all(shape in self.repo.stats.by_shape for shape in analytics))
+        self.assertEqual(1, self.repo.replica.refreshes)
+
+    def test_replica_follows_writes(self):
+        room = self.room_of(self.humidity)
+        before = self.repo.calc_hours_with_humidity_above(room, "2024-01-27")
+        # readings far above the day's average in an hour that had none above it
+        hour = next(h for h in range(24) if h not in before)
+        for minute in range(5):
+            self.plain.insert_measurement(self.humidity, Measurement(
+                timestamp=f"2024-01-27 {hour:02d}:{minute:02d}:30", value=99.0, unit="%"))
+        self.assertTrue(self.repo.sync_with_database())
+        self.assertIn(hour, self.repo.calc_hours_with_humidity_above(room, "2024-01-27"))
+        self.assertEqual(2, self.repo.replica.refreshes)
+        # no writes, no new copy
+        self.repo.calc_hours_with_humidity_above(room, "2024-01-27")
+        self.assertEqual(2, self.repo.replica.refreshes)
+
+    def test_lagging_replica_is_not_cached(self):
+        repo = SmartHouseRepository(self.file, replica_file=str(self.data_dir / "replica.sql"), replica_max_age=3600)
+        repo.load_smarthouse()
+        before = repo.calc_aggregates("%", "house")[0].count
+        # a current copy is cached as usual
+        self.assertEqual(1, len(repo.aggregates._entries))
+        self.plain.insert_measurement(self.humidity, Measurement(timestamp="2024-02-01 00:00:00", value=1.0, unit="%"))
+        self.assertTrue(repo.sync_with_database())
+        # the copy is not refreshed for an hour, and the lagging result is not kept in the aggregate cache
+        self.assertEqual(before, repo.calc_aggregates("%", "house")[0].count)
+        self.assertEqual(0, len(repo.aggregates._entries))
+        self.assertEqual(1, repo.replica.refreshes)
+        repo.replica.max_age = 0
+        self.assertEqual(before + 1, repo.calc_aggregates("%", "house")[0].count)
+        self.assertEqual(1, len(repo.aggregates._entries))
+        del repo
+
+    def test_server_uses_a_replica(self):
+        repo = default_repository(self.file)
+        self.assertIsNotNone(repo.replica)
+        self.assertEqual(DEFAULT_MAX_AGE, repo.replica.max_age)
+        self.assertGreater(DEFAULT_MAX_AGE, 0)
+        del repo
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from smarthouse.domain import Measurement
+from smarthouse.persistence import STATEMENTS, SmartHouseRepository, statement_shape
+from smarthouse.ringbuffer import ReadingRing, RecentReadings
+from db_copy import DatabaseCopyTest
+
+
+class ReadingRingTest(unittest.TestCase):
+
+    def test_newest_first(self):
+        ring = ReadingRing(3)
+        for i in range(4):
+            self.assertTrue(ring.add(f"2024-01-0{i + 1} 00:00:00", float(i), "%"))
+        self.assertEqual([("2024-01-04 00:00:00", 3.0, "%"), ("2024-01-03 00:00:00", 2.0, "%")], ring.newest(2))
+        self.assertFalse(ring.complete)
+        self.assertTrue(ring.covers(3))
+        self.assertFalse(ring.covers(4))
+        self.assertFalse(ring.covers(None))
+        # older than the newest reading
+        self.assertFalse(ring.add("2024-01-01 00:00:00", 9.0, "%"))
+
+    def test_store_is_bounded(self):
+        store = RecentReadings(capacity=2, max_sensors=2)
+        for sensor in ("a", "b", "c"):
+            store.put(sensor, [("2024-01-01 00:00:00", 1.0, None)])
+        self.assertIsNone(store.newest("a", 1))
+        self.assertEqual(1, len(store.newest("c", None)))
+        store.add("c", "2023-12-31 00:00:00", 2.0, None)
+        self.assertFalse(store.has("c"))
+
+    def test_memory_is_tracked(self):
+        store = RecentReadings(capacity=3, max_sensors=2)
+        changes = []
+        store.on_resize = changes.append
+
+        def actual():
+            return sum(r.nbytes() for r in store.rings().values())
+
+        store.put("a", [("2024-01-01 00:00:00", 1.0, None)])
+        store.put("b", [])
+        for i in range(5):
+            store.add("b", f"2024-01-0{i + 1} 00:00:00", float(i), None)
+        store.put("c", [("2024-01-01 00:00:00", 1.0, None)])  # 'a' is evicted
+        store.add("c", "2023-01-01 00:00:00", 1.0, None)  # out of order, 'c' is dropped
+        store.discard("b")
+        store.load({"d": ReadingRing(3)})
+        self.assertEqual(actual(), store.memory_used())
+        self.assertEqual(store.memory_used(), sum(changes))
+
+
+class RecentReadingsRepositoryTest(DatabaseCopyTest):
+    humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+
+    def setUp(self):
+        super().setUp()
+
+    def db_reads(self, repo):
+        stats = repo.stats.by_shape.get(statement_shape(STATEMENTS["readings_limit"]))
+        return stats.count if stats else 0
+
+    def test_values_served_from_ring(self):
+        repo = SmartHouseRepository(self.file, ring_capacity=50)
+        expected = repo.get_readings(self.humidity, 20)
+        repo.load_smarthouse()
+        reads = self.db_reads(repo)
+        self.assertEqual(expected, repo.get_readings(self.humidity, 20))
+        self.assertEqual(reads, self.db_reads(repo))
+
+        repo.insert_measurement(self.humidity, Measurement(timestamp="2030-01-01 00:00:00", value=42.0, unit="%"))
+        self.assertEqual(42.0, repo.get_readings(self.humidity, 1)[0].value)
+        self.assertEqual({"count": 1, "mean": 42.0, "min": 42.0, "max": 42.0}, repo.get_window_stats(self.humidity, 1))
+        self.assertEqual(reads, self.db_reads(repo))
+
+        # more than the ring holds goes to the database
+        self.assertEqual(100, len(repo.get_readings(self.humidity, 100)))
+        self.assertGreater(self.db_reads(repo), reads)
+
+    def test_ring_restored_from_snapshot(self):
+        snapshot = self.file + ".snapshot"
+        first = SmartHouseRepository(self.file, snapshot_file=snapshot)
+        first.load_smarthouse()
+        expected = first.get_readings(self.humidity, 5)
+
+        second = SmartHouseRepository(self.file, snapshot_file=snapshot)
+        second.load_smarthouse()
+        self.assertEqual(expected, second.get_readings(self.humidity, 5))
+        self.assertEqual(0, self.db_reads(second))
+
+    def test_readings_applied_once_across_connections(self):
+        writer = SmartHouseRepository(self.file)
+        reader = SmartHouseRepository(self.file)
+        writer.load_smarthouse()
+        reader.load_smarthouse()
+        seen = []
+        writer.reading_listeners.append(lambda *reading: seen.append(("writer",) + reading))
+        reader.reading_listeners.append(lambda *reading: seen.append(("reader",) + reading))
+
+        m = Measurement(timestamp="2030-01-01 00:00:00", value=42.0, unit="%")
+        writer.insert_measurement(self.humidity, m)
+        self.assertTrue(reader.sync_with_database())
+        # catching up in the writer must not add its own reading a second time
+        writer._catch_up_latest()
+        self.assertEqual(["writer", "reader"], [s[0] for s in seen])
+        for repo in (writer, reader):
+            readings = repo.get_readings(self.humidity, 2)
+            self.assertEqual(42.0, readings[0].value)
+            self.assertNotEqual("2030-01-01 00:00:00", readings[1].timestamp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import json
+import unittest
+from smarthouse.domain import Measurement, MeasurementSeries
+from smarthouse.serialization import dumps
+
+
+class SerializationTest(unittest.TestCase):
+
+    def test_series_matches_measurements(self):
+        series = MeasurementSeries.from_rows([("2024-01-28 23:00:00", 13.7, "kWh"), ("2024-01-28 22:00:00", 12.1, "kWh")])
+        expected = [m.model_dump() for m in series.to_measurements()]
+        self.assertEqual(expected, json.loads(dumps(series)))
+
+    def test_series_is_encoded_from_columns(self):
+        series = MeasurementSeries.from_rows([("2024-01-28 23:00:00", 13.7, "°C"), ('2024-01-28 "22"', -0.5, None),
+                                              ("2024-01-28 21:00:00", float("nan"), "°C"), ("x", 1e-20, "\\n")])
+        self.assertEqual([{"timestamp": ts, "value": None if v != v else v, "unit": u}
+                          for ts, v, u in zip(series.timestamps, series.values, series.units)], json.loads(dumps(series)))
+        self.assertEqual(b"[]", dumps(MeasurementSeries()))
+        # a series inside other content is encoded the same way
+        self.assertEqual(json.loads(dumps(series))[:2], json.loads(dumps({"s": series}))["s"][:2])
+
+    def test_models_and_plain_values(self):
+        m = Measurement(timestamp="2024-01-28 23:00:00", value=1.5, unit="°C")
+        self.assertEqual(m.model_dump(), json.loads(dumps(m)))
+        self.assertEqual([m.model_dump()], json.loads(dumps([m])))
+        self.assertEqual({"reason": "x", "m": m.model_dump()}, json.loads(dumps({"reason": "x", "m": m})))
+        self.assertIsNone(json.loads(dumps(None)))
+
+
+if __name__ == '__main__':
+    unittest.main()
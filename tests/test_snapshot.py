@@ -0,0 +1,175 @@
+import os
+import threading
+import unittest
+from smarthouse.domain import Measurement
+from smarthouse.persistence import STATEMENTS, SmartHouseRepository, statement_shape
+from smarthouse.snapshot import read_file_header, read_snapshot
+from db_copy import DatabaseCopyTest
+
+
+class SnapshotTest(DatabaseCopyTest):
+    humidity = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+    plug = "1a66c3d6-22b2-446e-bf5c-eb5b9d1a8c79"
+    # few enough readings for all of them to fit in the sensor's ring
+    small = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+
+    def setUp(self):
+        super().setUp()
+        self.snapshot = self.file + ".snapshot"
+
+    def repo(self):
+        return SmartHouseRepository(self.file, snapshot_file=self.snapshot)
+
+    def loaded_from_sql(self, repo):
+        return statement_shape(STATEMENTS["all_rooms"]) in repo.stats.by_shape
+
+    def test_warm_start_from_snapshot(self):
+        first = self.repo()
+        h1 = first.load_smarthouse()
+        self.assertTrue(self.loaded_from_sql(first))
+        self.assertTrue(os.path.exists(self.snapshot))
+
+        second = self.repo()
+        h2 = second.load_smarthouse()
+        self.assertFalse(self.loaded_from_sql(second))
+        self.assertEqual(len(h1.get_devices()), len(h2.get_devices()))
+        self.assertEqual(h1.get_area(), h2.get_area())
+        sensor = h2.get_device_by_id(self.humidity)
+        self.assertEqual(55.2125, second.get_latest_reading(sensor).value)
+
+    def test_snapshot_catches_up_with_changes(self):
+        first = self.repo()
+        h1 = first.load_smarthouse()
+        plug = h1.get_device_by_id("1a66c3d6-22b2-446e-bf5c-eb5b9d1a8c79")
+        plug.turn_on()
+        first.update_actuator_state(plug)
+        # a measurement written by another process after the snapshot was written
+        other = SmartHouseRepository(self.file)
+        other.insert_measurement(self.humidity, Measurement(timestamp="2024-02-01 10:00:00", value=42.0, unit="%"))
+
+        second = self.repo()
+        h2 = second.load_smarthouse()
+        self.assertFalse(self.loaded_from_sql(second))
+        self.assertTrue(h2.get_device_by_id("1a66c3d6-22b2-446e-bf5c-eb5b9d1a8c79").is_active())
+        self.assertEqual(42.0, second.get_latest_reading(h2.get_device_by_id(self.humidity)).value)
+
+    def test_topology_change_invalidates_snapshot(self):
+        self.repo().load_smarthouse()
+        other = SmartHouseRepository(self.file)
+        other.execute("INSERT INTO rooms (id, floor, area, name) VALUES (13, 2, 5.0, 'Storage')")
+        other.conn.commit()
+
+        second = self.repo()
+        h2 = second.load_smarthouse()
+        self.assertTrue(self.loaded_from_sql(second))
+        self.assertEqual(13, len(h2.get_rooms()))
+
+    def snapshot_plug_state(self, repo):
+        schema_cookie, _ = read_file_header(self.file)
+        snapshot = read_snapshot(self.snapshot, schema_cookie, tuple(repo.run("topology_fingerprint")[0]))
+        return snapshot.house.get_device_by_id(self.plug).is_active()
+
+    def test_actuator_changes_are_written_once(self):
+        repo = SmartHouseRepository(self.file, snapshot_file=self.snapshot, snapshot_delay=60)
+        house = repo.load_smarthouse()
+        plug = house.get_device_by_id(self.plug)
+        for i in range(5):
+            if i % 2 == 0:
+                plug.turn_on()
+            else:
+                plug.turn_off()
+            repo.update_actuator_state(plug)
+        # the write waits in the background, the file still has the state from loading
+        self.assertFalse(self.snapshot_plug_state(repo))
+        repo.flush_snapshot()
+        self.assertTrue(self.snapshot_plug_state(repo))
+        self.assertIsNone(repo._snapshot_timer)
+
+    def test_concurrent_snapshot_writes(self):
+        repo = self.repo()
+        repo.load_smarthouse()
+        errors = []
+
+        def write():
+            try:
+                for _ in range(20):
+                    repo.save_snapshot()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+        self.assertEqual([], [f for f in os.listdir(self.data_dir) if f.endswith(".tmp")])
+        second = self.repo()
+        second.load_smarthouse()
+        self.assertFalse(self.loaded_from_sql(second))
+
+    def test_sync_between_workers(self):
+        worker_a = SmartHouseRepository(self.file)
+        worker_b = SmartHouseRepository(self.file)
+        house_a = worker_a.load_smarthouse()
+        house_b = worker_b.load_smarthouse()
+        self.assertFalse(worker_b.sync_with_database())
+
+        bulb = house_a.get_device_by_id("6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28")
+        bulb.turn_on()
+        worker_a.update_actuator_state(bulb)
+        worker_a.insert_measurement(self.humidity, Measurement(timestamp="2024-02-01 10:00:00", value=42.0, unit="%"))
+        # worker A's own writes do not count as outside changes
+        self.assertFalse(worker_a.sync_with_database())
+
+        self.assertFalse(house_b.get_device_by_id("6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28").is_active())
+        self.assertTrue(worker_b.sync_with_database())
+        self.assertTrue(house_b.get_device_by_id("6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28").is_active())
+        self.assertEqual(42.0, worker_b.get_latest_reading(house_b.get_device_by_id(self.humidity)).value)
+
+    def test_deletes_by_other_workers(self):
+        worker_a = SmartHouseRepository(self.file)
+        worker_b = self.repo()
+        worker_a.load_smarthouse()
+        worker_b.load_smarthouse()
+        deleted = []
+        worker_b.delete_listeners.append(lambda sensor, ts: deleted.append((sensor, ts)))
+        oldest = worker_b.get_readings(self.small, None)[-1]
+        self.assertEqual(oldest, worker_a.delete_oldest_reading(self.small))
+        # worker A's own delete is already applied
+        self.assertFalse(worker_a.sync_with_database())
+
+        self.assertTrue(worker_b.sync_with_database())
+        self.assertEqual([(self.small, oldest.timestamp)], deleted)
+        self.assertNotIn(oldest, worker_b.get_readings(self.small, None))
+
+        # a snapshot written before a delete is caught up on warm start
+        worker_b.save_snapshot()
+        second_oldest = worker_a.delete_oldest_reading(self.small)
+        third = self.repo()
+        third.load_smarthouse()
+        self.assertFalse(self.loaded_from_sql(third))
+        readings = third.get_readings(self.small, None)
+        self.assertNotIn(second_oldest, readings)
+        self.assertEqual(worker_a.get_readings(self.small, None), readings)
+
+    def test_missed_deletes_reload_caches(self):
+        worker_a = SmartHouseRepository(self.file)
+        worker_b = SmartHouseRepository(self.file)
+        house_b = worker_b.load_smarthouse()
+        expected = worker_b.get_readings(self.small, None)[:-3]
+        for _ in range(3):
+            worker_a.delete_oldest_reading(self.small)
+        # the log no longer has the first deletes, worker B cannot tell which sensors they were for
+        worker_a.execute("DELETE FROM measurement_deletes WHERE seq < (SELECT MAX(seq) FROM measurement_deletes)")
+        worker_a.conn.commit()
+        deleted = []
+        worker_b.delete_listeners.append(lambda sensor, ts: deleted.append(sensor))
+        self.assertTrue(worker_b.sync_with_database())
+        self.assertIn(self.small, deleted)
+        self.assertEqual(expected, worker_b.get_readings(self.small, None))
+        self.assertEqual(expected[0].value, worker_b.get_latest_reading(house_b.get_device_by_id(self.small)).value)
+
+
+if __name__ == '__main__':
+    unittest.main()